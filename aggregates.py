@@ -0,0 +1,121 @@
+"""Run counts, pre-aggregated so time-series and ranking charts don't have to scan every run.
+
+The run count cube is one row per day × category × level × fullgame/IL × status × rat flag × runner
+with the number of runs in it. It's tiny next to the runs (a board's whole history is a few
+thousand rows), so weekly/monthly rollups (rollup_run_counts) and the IL/submitter rankings are
+quick groupbys over it instead of over the runs.
+
+It's saved next to the runs as {file_prefix}_run_counts.parquet along with a fingerprint of the
+runs file it was built from. scraper.sync_runs folds synced runs into it (update_run_counts)
+instead of rebuilding it, and if the runs file changed some other way (a full re-download) the
+fingerprint won't match and it gets rebuilt the next time it's loaded
+(see generate_graphs.get_run_counts)."""
+
+import json
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from utils import write_parquet_atomic
+
+
+# The run columns the cube is grouped by. date gets truncated to day
+CUBE_RUN_COLUMNS = ['date', 'category', 'level', 'e_is_il', 'e_status_judgment', 'e_is_rat', 'e_pid', 'e_runner_name']
+CUBE_DIMENSIONS = ['day'] + CUBE_RUN_COLUMNS[1:]
+COUNT_COLUMN = 'runs'
+
+# Where the fingerprint of the runs file is kept in the cube's parquet metadata
+RUNS_FINGERPRINT_KEY = b"runs_fingerprint"
+
+
+def run_counts(runs, dimensions=()):
+    """Build the run count cube from a table of runs (anything with CUBE_RUN_COLUMNS). dimensions are
+    more run columns to count by, for one-off counts (the saved cube only ever has CUBE_DIMENSIONS)"""
+    group_columns = CUBE_RUN_COLUMNS[1:] + [column for column in dimensions if column not in CUBE_RUN_COLUMNS]
+    run_dimensions = runs[group_columns].astype(object).assign(day=pd.to_datetime(runs['date']).dt.normalize())
+    counts = run_dimensions.groupby(['day'] + group_columns, dropna=False, sort=False).size()
+    return counts.rename(COUNT_COLUMN).reset_index()
+
+
+def update_run_counts(counts, removed_runs=None, added_runs=None):
+    """Fold a change to the runs into the cube: removed_runs get counted off and added_runs get
+    counted on. A run that changed (e.g. got verified) is removed as its old row and added as its new one"""
+    parts = [counts]
+    if removed_runs is not None and len(removed_runs):
+        removed = run_counts(removed_runs)
+        parts.append(removed.assign(**{COUNT_COLUMN: -removed[COUNT_COLUMN]}))
+    if added_runs is not None and len(added_runs):
+        parts.append(run_counts(added_runs))
+    if len(parts) == 1:
+        return counts
+
+    combined = pd.concat(parts, ignore_index=True)
+    combined[CUBE_DIMENSIONS[1:]] = combined[CUBE_DIMENSIONS[1:]].astype(object)
+    updated = combined.groupby(CUBE_DIMENSIONS, dropna=False, sort=False)[COUNT_COLUMN].sum().reset_index()
+    return updated[updated[COUNT_COLUMN] > 0].reset_index(drop=True)
+
+
+def runs_fingerprint(runs_path):
+    """The runs file's size and modified time, to tell whether a saved cube is still up to date"""
+    stat = runs_path.stat()
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+def save_run_counts(counts, counts_path, runs_path):
+    """Save the cube, marked as being up to date with runs_path as it is right now"""
+    table = pa.Table.from_pandas(counts, preserve_index=False)
+    table = table.replace_schema_metadata({
+        **(table.schema.metadata or {}),
+        RUNS_FINGERPRINT_KEY: json.dumps(runs_fingerprint(runs_path)).encode()})
+    write_parquet_atomic(table, counts_path)
+
+
+def load_run_counts(counts_path, runs_path):
+    """Load a saved cube, or None if there isn't one or the runs file changed since it was saved"""
+    if not counts_path.exists() or not runs_path.exists():
+        return None
+    table = pq.read_table(counts_path)
+    fingerprint = (table.schema.metadata or {}).get(RUNS_FINGERPRINT_KEY)
+    if fingerprint is None or json.loads(fingerprint) != runs_fingerprint(runs_path):
+        return None
+    return table.to_pandas()
+
+
+def filter_run_counts(counts, filter_users=True, il=None):
+    """Narrow the cube down like join_all_data does: filter_users keeps verified, non-rat runs.
+    il can be "IL" or "Full Game" to keep only those runs"""
+    keep = pd.Series(True, index=counts.index)
+    if filter_users:
+        keep &= (counts['e_status_judgment'] == 'verified') & ~counts['e_is_rat'].fillna(False).astype(bool)
+    if il is not None:
+        keep &= counts['e_is_il'] == il
+    return counts[keep]
+
+
+def rollup_run_counts(counts, freq='W', by=None, start_date=None, end_date=None):
+    """Total up the cube per period (any pandas period frequency, e.g. 'W' or 'M'), indexed by the
+    period's start date. With by set (one or more cube/label columns), there's a column per value of it"""
+    period = counts['day'].dt.to_period(freq).dt.start_time.rename('period')
+    keys = [period] + ([counts[column] for column in ([by] if isinstance(by, str) else by)] if by else [])
+    rollup = counts.groupby(keys, dropna=False)[COUNT_COLUMN].sum()
+    if by:
+        rollup = rollup.unstack([key.name for key in keys[1:]], fill_value=0)
+    else:
+        rollup = rollup.to_frame(COUNT_COLUMN)
+
+    if start_date is not None:
+        rollup = rollup[rollup.index >= pd.Timestamp(start_date)]
+    if end_date is not None:
+        rollup = rollup[rollup.index <= pd.Timestamp(end_date)]
+    return rollup
+
+
+def label_run_counts(counts, levels, categories):
+    """Add level short names (Full Game for full game runs) and category names to the cube, the
+    same labels join_all_data puts on runs"""
+    level_names = pd.DataFrame(levels).set_index('id')['e_short_name'] if len(levels) else pd.Series(dtype=object)
+    category_names = pd.DataFrame(categories).set_index('id')['name'] if len(categories) else pd.Series(dtype=object)
+    return counts.assign(
+        e_short_name=counts['level'].map(level_names).fillna("Full Game"),
+        Categories=counts['category'].map(category_names))
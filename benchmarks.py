@@ -0,0 +1,214 @@
+"""Benchmarks for the heavier parts of the data pipeline, run against synthetic boards so they don't need SRC.
+
+Run them from the command line with `python benchmarks.py`, or call the bench_ functions from a notebook."""
+
+import random
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+
+import pandas as pd
+import pyarrow as pa
+
+from enrich_data import enrich_runs
+from generate_graphs import join_runs
+from scraper import read_runs, write_runs
+
+ENRICHED_COLUMNS = ['e_is_rat', 'e_primary_t', 'e_is_il', 'e_pid', 'e_status_judgment', 'e_runner_name']
+
+
+def make_synthetic_runs(n_runs, n_players=2000, n_categories=6, n_levels=30, seed=0):
+    """Build a list of fake runs shaped like the SRC runs endpoint returns them"""
+    rng = random.Random(seed)
+    categories = [f"cat{i:04d}" for i in range(n_categories)]
+    levels = [f"lvl{i:04d}" for i in range(n_levels)]
+
+    runs = []
+    for i in range(n_runs):
+        if rng.random() < 0.02:
+            player = {"rel": "guest", "name": rng.choice(["Stupid Rat", "some guest"]), "uri": "guest"}
+        else:
+            pid = f"pid{rng.randrange(n_players):05d}"
+            player = {"rel": "user", "id": pid, "uri": f"users/{pid}"}
+
+        status = rng.choice(["verified"] * 8 + ["new", "rejected"])
+        day = rng.randrange(2000)
+        date = (pd.Timestamp("2019-01-01") + pd.Timedelta(days=day)).strftime("%Y-%m-%d")
+        primary_t = round(rng.uniform(30, 3600), 3)
+
+        runs.append({
+            "id": f"run{i:07d}",
+            "weblink": f"https://www.speedrun.com/run/run{i:07d}",
+            "game": "game0001",
+            "level": rng.choice(levels) if rng.random() < 0.6 else None,
+            "category": rng.choice(categories),
+            "comment": None,
+            "status": {
+                "status": status,
+                "examiner": f"pid{rng.randrange(20):05d}" if status != "new" else None,
+                "verify-date": f"{date}T12:00:00Z" if status == "verified" else None,
+            },
+            "players": [player],
+            "date": date,
+            "submitted": f"{date}T10:00:00Z",
+            "times": {"primary": f"PT{primary_t}S", "primary_t": primary_t, "realtime": None, "realtime_t": 0},
+            "system": {"platform": "plat0001", "emulated": False, "region": None},
+            "values": {"var00001": rng.choice(["val00001", "val00002", "val00003"])},
+            "links": [{"rel": "self", "uri": f"runs/run{i:07d}"}],
+        })
+    return runs
+
+
+def make_synthetic_metadata(n_categories=6, n_levels=30):
+    """Fake levels and categories tables to go with make_synthetic_runs, with the rules text and
+    links lists SRC sends along with them"""
+    links = [{"rel": rel, "uri": f"https://www.speedrun.com/api/v1/{rel}/x"} for rel in ("self", "game", "runs", "leaderboard")]
+    levels = pd.DataFrame({
+        "id": [f"lvl{i:04d}" for i in range(n_levels)],
+        "name": [f"Level {i}" for i in range(n_levels)],
+        "weblink": [f"https://www.speedrun.com/game/level{i}" for i in range(n_levels)],
+        "rules": ["No glitches that skip the level. " * 30] * n_levels,
+        "links": [links] * n_levels,
+    })
+    levels["e_short_name"] = levels["name"]
+    categories = pd.DataFrame({
+        "id": [f"cat{i:04d}" for i in range(n_categories)],
+        "name": [f"Category {i}" for i in range(n_categories)],
+        "weblink": [f"https://www.speedrun.com/game#cat{i}" for i in range(n_categories)],
+        "type": ["per-level" if i % 2 else "per-game" for i in range(n_categories)],
+        "rules": ["Timing starts on the first frame of input. " * 30] * n_categories,
+        "links": [links] * n_categories,
+    })
+    return levels, categories
+
+
+def time_it(fun, repeat=3):
+    """Best-of-repeat wall time of fun, in seconds"""
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fun()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def apply_enrich_runs(run_df):
+    """The original per-row enrich_runs, one Series.apply lambda per e_ column, kept as the baseline
+    the columnar enrichment is measured against"""
+    run_df['date'] = pd.to_datetime(run_df['date'])
+    run_df['e_is_rat'] = run_df['players'].apply(lambda x: x[0]['rel'] == 'guest' and x[0]['name'] == 'Stupid Rat')
+    run_df['e_primary_t'] = run_df['times'].apply(lambda x: x['primary_t'])
+    # pandas can load missing levels as NaN instead of None, and NaN is truthy
+    run_df['e_is_il'] = run_df['level'].apply(lambda x: 'IL' if pd.notna(x) and x else "Full Game")
+    run_df['e_pid'] = run_df['players'].apply(lambda x: x[0]['id'] if 'id' in x[0] else None)
+    run_df['e_status_judgment'] = run_df['status'].apply(lambda x: x['status'])
+    run_df['e_runner_name'] = run_df['e_pid']
+    return run_df
+
+
+def bench_enrich_runs(n_runs=50000):
+    """Compare enriching runs straight off the API (the list of run dicts query_api returns) with the
+    original per-row lambdas (apply_enrich_runs on a dataframe of them) against enrich_runs, which is
+    what every scraper fetch path runs them through.
+
+    enrich_runs does more than the lambdas ever did, since it flattens the runs all the way into
+    RUN_SCHEMA instead of only adding the e_ columns. Both are also timed with saving the runs
+    afterwards, which is the rest of the fetch path. Checks that the e_ columns and dates come out
+    identical to the lambdas' before reporting."""
+    runs = make_synthetic_runs(n_runs)
+
+    from_lambdas = apply_enrich_runs(pd.DataFrame(runs))
+    enriched = enrich_runs(runs)
+    for column in ENRICHED_COLUMNS:
+        pd.testing.assert_series_equal(
+            from_lambdas[column].astype(object), enriched[column].astype(object), check_names=False)
+    assert (from_lambdas['date'].astype('datetime64[ns]') == enriched['date'].astype('datetime64[ns]')).all()
+
+    lambda_time = time_it(lambda: apply_enrich_runs(pd.DataFrame(runs)))
+    enrich_time = time_it(lambda: enrich_runs(runs))
+
+    # The whole fetch path also saves the runs, which used to be a to_parquet of the nested frame
+    bench_path = Path(tempfile.mkdtemp())
+    lambda_save_time = time_it(
+        lambda: apply_enrich_runs(pd.DataFrame(runs)).to_parquet(bench_path / "nested_runs.parquet"))
+    enrich_save_time = time_it(lambda: write_runs(enrich_runs(runs), bench_path / "flat_runs.parquet"))
+
+    print(f"enrich_runs on {n_runs} runs from the API")
+    print(f"  per-row lambdas (DataFrame + apply):  {lambda_time:.3f}s, {lambda_save_time:.3f}s with saving")
+    print(f"  enrich_runs (Arrow, full RUN_SCHEMA): {enrich_time:.3f}s, {enrich_save_time:.3f}s with saving")
+    print(f"  speedup over the lambdas: {lambda_time / enrich_time:.1f}x, "
+          f"{lambda_save_time / enrich_save_time:.1f}x with saving")
+    return lambda_time, enrich_time
+
+
+def bench_load_runs(n_runs=50000, columns=('id', 'date', 'e_is_il')):
+    """Compare loading an old-style nested runs file against a flat RUN_SCHEMA one.
+
+    The nested file is loaded the way runs used to be (pd.read_parquet of everything), the flat one
+    with read_runs, both in full and with only the columns a graph would need."""
+    bench_path = Path(tempfile.mkdtemp())
+    runs_df = pd.DataFrame(make_synthetic_runs(n_runs))
+    runs_df.to_parquet(bench_path / "nested_runs.parquet")
+    write_runs(enrich_runs(runs_df.copy()), bench_path / "flat_runs.parquet")
+
+    nested_time = time_it(lambda: pd.read_parquet(bench_path / "nested_runs.parquet"))
+    flat_time = time_it(lambda: read_runs(bench_path / "flat_runs.parquet"))
+    projected_time = time_it(lambda: read_runs(bench_path / "flat_runs.parquet", columns=list(columns)))
+
+    print(f"Loading {n_runs} runs")
+    print(f"  nested, all columns:  {nested_time:.3f}s")
+    print(f"  flat, all columns:    {flat_time:.3f}s")
+    print(f"  flat, {len(columns)} columns:      {projected_time:.3f}s")
+    return nested_time, flat_time, projected_time
+
+
+def merge_join_runs(runs, levels, categories):
+    """How join_runs used to join: merging every run with the full levels and categories tables"""
+    joined = pd.merge(runs, levels, left_on='level', right_on='id', how='left', suffixes=('_runs', '_levels'))
+    joined = pd.merge(joined, categories, left_on='category', right_on='id', how='left', suffixes=(None, '_categories'))
+    joined['Categories'] = joined['name_categories']
+    joined["e_short_name"] = joined["e_short_name"].fillna("Full Game")
+    return joined
+
+
+def measure_join(join, runs, levels, categories):
+    """Join the runs and return how much memory the join allocated, in bytes, as (peak python/numpy
+    memory, Arrow memory). tracemalloc only sees numpy and python allocations, so the Arrow buffers
+    behind string columns get counted separately, from pyarrow's allocator"""
+    arrow_before = pa.total_allocated_bytes()
+    tracemalloc.start()
+    try:
+        joined = join(runs, levels, categories)
+        traced_peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    arrow_allocated = pa.total_allocated_bytes() - arrow_before
+    del joined
+    return traced_peak, arrow_allocated
+
+
+def bench_join_memory(n_runs=100000):
+    """Compare the memory of the old full-table merge against join_runs' code lookups, on a synthetic board"""
+    runs_path = Path(tempfile.mkdtemp()) / "bench_runs.parquet"
+    write_runs(enrich_runs(make_synthetic_runs(n_runs)), runs_path)
+    levels, categories = make_synthetic_metadata()
+
+    results = {
+        name: measure_join(join, read_runs(runs_path), levels, categories)
+        for name, join in (("merge", merge_join_runs), ("lookup", join_runs))}
+
+    print(f"Joining {n_runs} runs, memory allocated by the join")
+    for name, label in (("merge", "full-table merge:"), ("lookup", "code lookups:    ")):
+        traced_peak, arrow_allocated = results[name]
+        print(f"  {label}  {(traced_peak + arrow_allocated) / 1e6:.1f} MB "
+              f"({traced_peak / 1e6:.1f} MB peak python/numpy, {arrow_allocated / 1e6:.1f} MB Arrow)")
+    print(f"  {sum(results['merge']) / sum(results['lookup']):.1f}x less")
+    return results
+
+
+if __name__ == "__main__":
+    bench_enrich_runs()
+    bench_load_runs()
+    bench_join_memory()
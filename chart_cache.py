@@ -0,0 +1,92 @@
+"""Cache of rendered charts, so a chart whose data hasn't changed is never drawn or saved twice.
+
+Charts are cached under RENDER_CACHE_PATH by a hash of the chart's kind, table, title, style and
+matplotlib settings (see chart_hash). Saving a chart that's in the cache hard-links its path to the
+cached PNG instead of drawing it again. Both render.py and the plot_ functions in generate_graphs
+save their charts through here."""
+
+import hashlib
+import os
+import shutil
+from pathlib import Path
+
+import matplotlib
+import pandas as pd
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.figure import Figure
+
+from config import DATA_PATH
+
+# Rendered charts, named by their chart_hash. They live with the other caches under data/, not next to the charts
+RENDER_CACHE_PATH = DATA_PATH / "render_cache"
+
+
+def style_fingerprint():
+    """matplotlib version and settings, so changing the style re-renders everything"""
+    rc_params = sorted((key, str(value)) for key, value in matplotlib.rcParams.items() if key != "backend")
+    return repr((matplotlib.__version__, rc_params))
+
+
+def chart_hash(kind, table, title, style=None, transparent=False):
+    """Hash of everything that goes into drawing a chart: its kind, table, style, and title"""
+    chart_hash = hashlib.sha256()
+    chart_hash.update(repr((kind, sorted((style or {}).items()), title, transparent)).encode())
+    chart_hash.update(repr((list(getattr(table, "columns", [])), str(getattr(table, "dtypes", "")))).encode())
+    chart_hash.update(pd.util.hash_pandas_object(table, index=True).to_numpy().tobytes())
+    chart_hash.update(style_fingerprint().encode())
+    return chart_hash.hexdigest()
+
+
+def link_chart(cached_path, path):
+    """Point path at a cached chart, with a hard link where the filesystem allows it"""
+    path = Path(path)
+    if path.exists() and os.path.samefile(cached_path, path):
+        return False
+    path.unlink(missing_ok=True)
+    try:
+        os.link(cached_path, path)
+    except OSError:
+        shutil.copyfile(cached_path, path)
+    return True
+
+
+def draw_chart(draw, table, title, **style):
+    """Draw a chart with draw(ax, table, title, **style) on a figure that isn't attached to pyplot,
+    so it's freed as soon as it's saved"""
+    fig = Figure()
+    FigureCanvasAgg(fig)
+    draw(fig.subplots(), table, title, **style)
+    return fig
+
+
+def save_chart(path, kind, table, title, make_figure, style=None, transparent=False, use_cache=True):
+    """Save a chart to path. make_figure() returns the drawn figure, and only gets called if the
+    render cache doesn't have the chart yet.
+
+    Returns a manifest entry for the chart: status is "rendered" if it had to be drawn, "linked" if it
+    came from the render cache, or "unchanged" if path already was the cached chart"""
+    entry = {"path": str(path), "kind": kind}
+
+    if use_cache:
+        entry["hash"] = chart_hash(kind, table, title, style, transparent)
+        cached_path = RENDER_CACHE_PATH / f"{entry['hash']}.png"
+        if cached_path.exists():
+            entry["status"] = "linked" if link_chart(cached_path, path) else "unchanged"
+            return entry
+
+    fig = make_figure()
+    if use_cache:
+        # Render into the cache through a temp file, other processes might be drawing the same chart
+        RENDER_CACHE_PATH.mkdir(parents=True, exist_ok=True)
+        tmp_path = cached_path.with_name(f".{cached_path.name}.{os.getpid()}.tmp")
+        fig.savefig(tmp_path, format="png", bbox_inches="tight", transparent=transparent)
+        os.replace(tmp_path, cached_path)
+        link_chart(cached_path, path)
+    else:
+        fig.savefig(path, format="png", bbox_inches="tight", transparent=transparent)
+    entry["status"] = "rendered"
+    return entry
+
+
+def clear_render_cache():
+    shutil.rmtree(RENDER_CACHE_PATH, ignore_errors=True)
@@ -0,0 +1,106 @@
+"""Checkpoint journal for long downloads, so a timeout or a kernel restart halfway through a board
+doesn't mean starting over from the first page.
+
+Every in-progress download gets a JSON entry under CHECKPOINT_PATH with its endpoint, params, the
+offset of the next page to fetch, and how many pages it's got so far. Downloads that collect their
+results in memory (query_api) also keep the pages they've fetched in a .pages.jsonl file next to it.
+Entries are removed once their download finishes, so whatever is left in the journal is unfinished."""
+
+import hashlib
+import json
+import os
+from datetime import datetime, timezone
+
+from config import CHECKPOINT_PATH
+
+
+def checkpoint_key(endpoint, params=None, target=None):
+    """Key for a download: the same endpoint, params, and target (eg. the file it's streaming into) resume each other"""
+    key_source = json.dumps([endpoint, params or {}, str(target) if target is not None else None], sort_keys=True, default=str)
+    return hashlib.sha1(key_source.encode()).hexdigest()
+
+
+def checkpoint_path(key):
+    return CHECKPOINT_PATH / f"{key}.json"
+
+
+def pages_path(key):
+    return CHECKPOINT_PATH / f"{key}.pages.jsonl"
+
+
+def load_checkpoint(endpoint, params=None, target=None):
+    """Get the journal entry for a download, or a fresh one at offset 0 if it isn't in progress"""
+    key = checkpoint_key(endpoint, params, target)
+    if checkpoint_path(key).exists():
+        with open(checkpoint_path(key)) as checkpoint_file:
+            return json.load(checkpoint_file)
+
+    # Anything journaled without a checkpoint died before its first page was recorded
+    pages_path(key).unlink(missing_ok=True)
+    return {
+        "key": key,
+        "endpoint": endpoint,
+        "params": params or {},
+        "target": str(target) if target is not None else None,
+        "next_offset": 0,
+        "pages": 0,
+        "started": datetime.now(timezone.utc).isoformat(),
+    }
+
+
+def save_checkpoint(checkpoint, offset, page_size, page=None):
+    """Record a finished page. If page is given, its results get journaled too so they can be loaded back
+    with load_pages. The page goes to disk before the offset moves past it."""
+    CHECKPOINT_PATH.mkdir(parents=True, exist_ok=True)
+    if page is not None:
+        with open(pages_path(checkpoint["key"]), "a") as pages_file:
+            pages_file.write(json.dumps(page) + "\n")
+            pages_file.flush()
+            os.fsync(pages_file.fileno())
+
+    checkpoint.update(
+        next_offset=offset + page_size,
+        pages=checkpoint["pages"] + 1,
+        updated=datetime.now(timezone.utc).isoformat())
+    path = checkpoint_path(checkpoint["key"])
+    tmp_path = path.with_name(f".{path.name}.tmp")
+    with open(tmp_path, "w") as checkpoint_file:
+        json.dump(checkpoint, checkpoint_file)
+    os.replace(tmp_path, path)
+
+
+def load_pages(checkpoint):
+    """Load the results of every page journaled for a download, in order. Only the pages the
+    checkpoint counts are used, in case the last one was written right as things died."""
+    path = pages_path(checkpoint["key"])
+    if not checkpoint["pages"] or not path.exists():
+        return []
+
+    with open(path) as pages_file:
+        lines = pages_file.readlines()
+
+    # Drop a page that was written but never recorded, it'll get fetched again
+    if len(lines) > checkpoint["pages"]:
+        lines = lines[:checkpoint["pages"]]
+        with open(path, "w") as pages_file:
+            pages_file.writelines(lines)
+
+    results = []
+    for line in lines:
+        results += json.loads(line)
+    return results
+
+
+def clear_checkpoint(checkpoint):
+    """Drop a download from the journal once it's done"""
+    checkpoint_path(checkpoint["key"]).unlink(missing_ok=True)
+    pages_path(checkpoint["key"]).unlink(missing_ok=True)
+
+
+def list_checkpoints():
+    """Every download that's still in progress"""
+    checkpoints = []
+    for path in sorted(CHECKPOINT_PATH.glob("*.json")):
+        with open(path) as checkpoint_file:
+            checkpoints.append(json.load(checkpoint_file))
+    return checkpoints
@@ -7,6 +7,8 @@ from typing import Dict, Optional, List
 
 DATA_PATH = Path(__file__).parent / "data"
 CHART_PATH = Path(__file__).parent / "charts"
+CACHE_PATH = DATA_PATH / "http_cache"
+CHECKPOINT_PATH = DATA_PATH / "checkpoints"
 
 SRC_API_URL = "https://www.speedrun.com/api/v1"
 
@@ -22,3 +24,7 @@ class BoardInfo:
     levels: List[Dict]
     variables: List[Dict]
     runs: Optional[List[Dict]]
+    # Where the board's parquet files were saved, if anywhere. generate_graphs reads the joined
+    # data from here (see generate_graphs.join_all_data)
+    save_path: Optional[Path] = None
+    file_prefix: Optional[str] = None
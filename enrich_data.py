@@ -3,9 +3,72 @@
 Fields added by these transformations will have e_ prepended to them to denote they
 aren't base API fields."""
 
-from utils import map_short_name
+from utils import map_short_name, get_user_names
+
+import json
 
 import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+
+# Low-cardinality strings (ids, statuses, names) get stored dictionary-encoded, which pandas loads as categoricals
+CATEGORY_TYPE = pa.dictionary(pa.int32(), pa.string())
+
+# Layout of saved runs. The nested API fields (players, times, status, system) get flattened into typed
+# e_ columns so loading runs never has to rebuild python dicts. On top of these, every variable a board
+# uses becomes a value_{variable id} column, and raw_json optionally holds the original API response.
+RUN_SCHEMA = pa.schema([
+    ('id', pa.string()),
+    ('weblink', pa.string()),
+    ('game', CATEGORY_TYPE),
+    ('level', CATEGORY_TYPE),
+    ('category', CATEGORY_TYPE),
+    ('comment', pa.string()),
+    ('date', pa.timestamp('ns')),
+    ('submitted', pa.timestamp('ns', tz='UTC')),
+    ('e_status_judgment', CATEGORY_TYPE),
+    ('e_examiner', CATEGORY_TYPE),
+    ('e_verify_date', pa.timestamp('ns', tz='UTC')),
+    ('e_primary_t', pa.float64()),
+    ('e_realtime_t', pa.float64()),
+    ('e_realtime_noloads_t', pa.float64()),
+    ('e_ingame_t', pa.float64()),
+    ('e_platform', CATEGORY_TYPE),
+    ('e_emulated', pa.bool_()),
+    ('e_region', CATEGORY_TYPE),
+    ('e_player_count', pa.int16()),
+    ('e_pid', CATEGORY_TYPE),
+    ('e_guest_name', pa.string()),
+    ('e_is_rat', pa.bool_()),
+    ('e_is_il', CATEGORY_TYPE),
+    ('e_runner_name', CATEGORY_TYPE),
+])
+VALUE_COLUMN_PREFIX = "value_"
+RAW_JSON_COLUMN = "raw_json"
+
+# The API fields that feed into RUN_SCHEMA, typed up front so Arrow doesn't have to work out the type of
+# every nested dict on every run. Everything else (links, videos, splits) is dropped. values isn't in here,
+# its fields are the board's variable ids, so its type gets worked out from the runs.
+RUN_SOURCE_SCHEMA = pa.schema([
+    ('id', pa.string()),
+    ('weblink', pa.string()),
+    ('game', pa.string()),
+    ('level', pa.string()),
+    ('category', pa.string()),
+    ('comment', pa.string()),
+    ('date', pa.string()),
+    ('submitted', pa.string()),
+    ('status', pa.struct([('status', pa.string()), ('examiner', pa.string()), ('verify-date', pa.string())])),
+    ('times', pa.struct([
+        ('primary_t', pa.float64()),
+        ('realtime_t', pa.float64()),
+        ('realtime_noloads_t', pa.float64()),
+        ('ingame_t', pa.float64())])),
+    ('system', pa.struct([('platform', pa.string()), ('emulated', pa.bool_()), ('region', pa.string())])),
+    ('players', pa.list_(pa.struct([('rel', pa.string()), ('id', pa.string()), ('name', pa.string())]))),
+])
+RUN_SOURCE_COLUMNS = RUN_SOURCE_SCHEMA.names + ['values']
+
 
 def mark_level_era(level_name):
     """For now, if this is tricky treat or Secrets of the world, it's 2023 Halloween,
@@ -32,35 +95,260 @@ def enrich_categories(cat_df):
     return cat_df
 
 
-def enrich_runs(run_df):
-    """Perform standard flattening/cleaning to runs so we can more easily use them in dataframes"""
+def extract_embedded_players(players):
+    """Pull the full player objects out of the players of runs fetched with embed=players.
+
+    Returns a dict of player ID -> SRC names dict for every user on the runs, and the players
+    swapped back to the plain {rel, id/name, uri} references the runs endpoint normally returns,
+    so saved runs look the same whether or not they were fetched with embeds."""
+    users = {}
+
+    def to_player_refs(run_players):
+        refs = []
+        for player in run_players['data']:
+            uri = next((link['uri'] for link in player.get('links', []) if link['rel'] == 'self'), None)
+            if player['rel'] == 'user':
+                users[player['id']] = player['names']
+                refs.append({'rel': 'user', 'id': player['id'], 'uri': uri})
+            else:
+                refs.append({'rel': 'guest', 'name': player.get('name'), 'uri': uri})
+        return refs
+
+    return users, [to_player_refs(run_players) for run_players in players]
+
+
+def enrich_runs(runs, resolve_names=False, keep_raw=False):
+    """Flatten runs from the API into the typed, flat RUN_SCHEMA layout so we can more easily use them in dataframes
+
+    runs is the list of run dicts the API returned (a dataframe of them works too). They go straight
+    into Arrow with the types in RUN_SOURCE_SCHEMA and get flattened there (see flatten_runs_table),
+    so no python code runs per run besides the conversion.
+
+    If the runs were fetched with embed=players, runner names come straight from the embedded
+    players. Nothing gets written to the user store here, that's up to whoever fetched the runs
+    (see scraper.enrich_fetched_runs). Otherwise, if resolve_names is set, look up every runner's
+    username (see get_user_names), or fall back to e_runner_name being the player ID.
+
+    If keep_raw is set, each run's original JSON is kept in a raw_json column, in case you need
+    something that didn't make it into the flat columns."""
+
+    if isinstance(runs, pd.DataFrame):
+        raw_json = [json.dumps(run, default=str) for run in runs.to_dict('records')] if keep_raw else None
+    else:
+        raw_json = [json.dumps(run, default=str) for run in runs] if keep_raw else None
+
+    # Embedded players come back as {"data": [...]} instead of a list of references
+    user_names = None
+    players = None
+    if len(runs):
+        run_players = runs['players'] if isinstance(runs, pd.DataFrame) else [run.get('players') for run in runs]
+        if isinstance(run_players[0], dict):
+            embedded_users, players = extract_embedded_players(run_players)
+            user_names = {pid: names.get('international') for pid, names in embedded_users.items()}
+
+    runs_table = runs_to_source_table(runs, players=players)
+
+    return flatten_runs_table(
+        runs_table,
+        resolve_names=resolve_names,
+        user_names=user_names,
+        raw_json=raw_json).to_pandas()
+
+
+def runs_to_source_table(runs, players=None):
+    """Convert runs in their nested API shape (a list of run dicts, or a dataframe of them) to an Arrow
+    table of only their RUN_SOURCE_COLUMNS, there's no point converting links/videos/splits.
+    If players is given, it replaces the runs' own players."""
+    schema = RUN_SOURCE_SCHEMA
+    if players is not None:
+        schema = schema.remove(schema.get_field_index('players'))
+
+    if isinstance(runs, pd.DataFrame):
+        runs_table = pa.table({
+            field.name: pa.array(runs[field.name], type=field.type, from_pandas=True)
+            for field in schema if field.name in runs.columns})
+        values = runs['values'] if 'values' in runs.columns else None
+    else:
+        # One struct array straight from the run dicts, the keys that aren't in schema never get looked at
+        runs_table = pa.Table.from_struct_array(pa.array(runs, type=pa.struct(list(schema))))
+        values = [run.get('values') for run in runs]
+
+    if players is not None:
+        runs_table = runs_table.append_column(
+            'players', pa.array(players, type=RUN_SOURCE_SCHEMA.field('players').type))
+    if values is not None:
+        runs_table = runs_table.append_column('values', pa.array(values, from_pandas=True))
+    return runs_table
+
+
+def enrich_runs_table(runs_table, resolve_names=False, user_names=None):
+    """Add the e_ columns to runs that are still in their nested API shape, but already in Arrow
+    (eg. converted from API results, or read with pyarrow from an older nested runs file).
+
+    Instead of digging through a python dict per row, the e_ columns are pulled straight out of the
+    players/times/status struct columns with Arrow compute, so nothing nested ever gets turned into
+    python objects. Returns an Arrow table (call to_pandas on it if you want a dataframe).
+
+    Runner names come from user_names (player ID -> name) if it's given, otherwise they're looked
+    up if resolve_names is set. Players need to be the plain references the runs endpoint returns
+    (see extract_embedded_players)."""
 
     # Make dates into, well, dates
-    run_df['date'] = pd.to_datetime(run_df['date'])
+    runs_table = runs_table.set_column(
+        runs_table.schema.get_field_index('date'), 'date', to_timestamps(runs_table['date']))
+
+    first_player = pc.list_element(runs_table['players'], 0)
+    player_rel = pc.struct_field(first_player, 'rel')
+    player_name = pc.struct_field(first_player, 'name') \
+        if first_player.type.get_field_index('name') != -1 else pa.nulls(len(runs_table), pa.string())
 
     # Tag Stupid Rat runs
-    run_df['e_is_rat'] = run_df['players'].apply(lambda x: x[0]['rel'] == 'guest' and x[0]['name'] == 'Stupid Rat')
+    is_rat = pc.and_(
+        pc.fill_null(pc.equal(player_rel, 'guest'), False),
+        pc.fill_null(pc.equal(player_name, 'Stupid Rat'), False))
 
     # Make primary time a top-level column
-    run_df['e_primary_t'] = run_df['times'].apply(lambda x: x['primary_t'])
+    primary_t = pc.struct_field(runs_table['times'], 'primary_t')
 
-    # Tag ILs
-    run_df['e_is_il'] = run_df['level'].apply(lambda x: 'IL' if x else "Full Game")
+    # Tag ILs (an empty level id counts as full game, same as the truthiness check in enrich_runs)
+    has_level = pc.fill_null(pc.not_equal(runs_table['level'].cast(pa.string()), ''), False)
+    is_il = pc.if_else(has_level, 'IL', 'Full Game')
 
     # Extract playerids, if you want 'em
-    run_df['e_pid'] = run_df['players'].apply(lambda x: x[0]['id'] if 'id' in x[0] else None)
+    pid = pc.struct_field(first_player, 'id') \
+        if first_player.type.get_field_index('id') != -1 else pa.nulls(len(runs_table), pa.string())
 
     # Extract run status
-    run_df['e_status_judgment'] = run_df['status'].apply(lambda x: x['status'])
-
-    # Commenting out the runner's username here so we don't do an expensive lookup for all
-    # usernames who've ever submitted. Sub in pid for now so it doesn't totally break graphing
-    run_df['e_runner_name'] = run_df['e_pid']
-    '''
-    # Get the runner's username
-    run_df['e_runner_name'] = run_df['e_pid'].apply(
-        lambda x: get_user_name(x) if x else "Guest"
-    )
-    '''
-
-    return run_df
\ No newline at end of file
+    status_judgment = pc.struct_field(runs_table['status'], 'status')
+
+    runner_name = pid
+    if user_names is not None or resolve_names:
+        pid_values = pid.to_pandas()
+        if user_names is None:
+            user_names = get_user_names(pid_values)
+        runner_name = pa.chunked_array([pa.array(
+            pid_values.map(user_names).fillna(pid_values).fillna("Guest"),
+            type=pa.string())])
+
+    for name, column in (
+            ('e_is_rat', is_rat),
+            ('e_primary_t', primary_t),
+            ('e_is_il', is_il),
+            ('e_pid', pid),
+            ('e_status_judgment', status_judgment),
+            ('e_runner_name', runner_name)):
+        if name in runs_table.column_names:
+            runs_table = runs_table.drop_columns([name])
+        runs_table = runs_table.append_column(name, column)
+
+    return runs_table
+
+
+def struct_field_or_null(array, field_name, field_type):
+    """Pull a field out of a struct column, or an all-null column if no run ever had that field"""
+    if pa.types.is_struct(array.type) and array.type.get_field_index(field_name) != -1:
+        return pc.struct_field(array, field_name)
+    return pa.nulls(len(array), field_type)
+
+
+def to_timestamps(array, utc=False):
+    """Parse an Arrow column of SRC date/datetime strings into timestamps. Arrow parses the ISO 8601
+    strings SRC sends itself, anything it can't handle goes through pd.to_datetime instead."""
+    if pa.types.is_timestamp(array.type):
+        return array
+    try:
+        return array.cast(pa.timestamp('ns', tz='UTC' if utc else None))
+    except (pa.ArrowInvalid, pa.ArrowNotImplementedError):
+        return pa.Array.from_pandas(pd.to_datetime(array.to_pandas(), utc=utc))
+
+
+def flatten_runs_table(runs_table, resolve_names=False, user_names=None, raw_json=None):
+    """Turn an Arrow table of runs in their nested API shape into a flat table matching RUN_SCHEMA.
+
+    The e_ columns come from enrich_runs_table, the rest of the nested status/times/system/players
+    fields get pulled out into their own columns, and every variable in values becomes its own
+    value_{variable id} column. If raw_json is given (one JSON string per run), it's kept as a
+    raw_json column."""
+    runs_table = enrich_runs_table(runs_table, resolve_names=resolve_names, user_names=user_names)
+    n_runs = len(runs_table)
+
+    def column(name, field_type=pa.string()):
+        return runs_table[name] if name in runs_table.column_names else pa.nulls(n_runs, field_type)
+
+    status = column('status', pa.struct([]))
+    times = column('times', pa.struct([]))
+    system = column('system', pa.struct([]))
+    players = column('players', pa.list_(pa.struct([])))
+    first_player = pc.list_element(players, 0) if pa.types.is_list(players.type) else players
+
+    flat_columns = {
+        'id': column('id'),
+        'weblink': column('weblink'),
+        'game': column('game'),
+        'level': column('level'),
+        'category': column('category'),
+        'comment': column('comment'),
+        'date': runs_table['date'],
+        'submitted': to_timestamps(column('submitted'), utc=True),
+        'e_status_judgment': runs_table['e_status_judgment'],
+        'e_examiner': struct_field_or_null(status, 'examiner', pa.string()),
+        'e_verify_date': to_timestamps(struct_field_or_null(status, 'verify-date', pa.string()), utc=True),
+        'e_primary_t': runs_table['e_primary_t'],
+        'e_realtime_t': struct_field_or_null(times, 'realtime_t', pa.float64()),
+        'e_realtime_noloads_t': struct_field_or_null(times, 'realtime_noloads_t', pa.float64()),
+        'e_ingame_t': struct_field_or_null(times, 'ingame_t', pa.float64()),
+        'e_platform': struct_field_or_null(system, 'platform', pa.string()),
+        'e_emulated': struct_field_or_null(system, 'emulated', pa.bool_()),
+        'e_region': struct_field_or_null(system, 'region', pa.string()),
+        'e_player_count': pc.list_value_length(players) if pa.types.is_list(players.type) else pa.nulls(n_runs, pa.int32()),
+        'e_pid': runs_table['e_pid'],
+        'e_guest_name': pc.if_else(
+            pc.fill_null(pc.equal(struct_field_or_null(first_player, 'rel', pa.string()), 'guest'), False),
+            struct_field_or_null(first_player, 'name', pa.string()),
+            pa.scalar(None, pa.string())),
+        'e_is_rat': runs_table['e_is_rat'],
+        'e_is_il': runs_table['e_is_il'],
+        'e_runner_name': runs_table['e_runner_name'],
+    }
+    fields = list(RUN_SCHEMA)
+
+    # Every variable the board uses gets its own column
+    values = column('values', pa.struct([]))
+    if pa.types.is_struct(values.type):
+        for value_field in values.type:
+            flat_columns[f"{VALUE_COLUMN_PREFIX}{value_field.name}"] = pc.struct_field(values, value_field.name)
+            fields.append(pa.field(f"{VALUE_COLUMN_PREFIX}{value_field.name}", CATEGORY_TYPE))
+
+    if raw_json is not None:
+        flat_columns[RAW_JSON_COLUMN] = pa.array(raw_json, type=pa.string())
+        fields.append(pa.field(RAW_JSON_COLUMN, pa.string()))
+
+    return pa.table(
+        [cast_column(flat_columns[field.name], field.type) for field in fields],
+        schema=pa.schema(fields))
+
+
+def cast_column(array, field_type):
+    """Cast a column to its schema type, dictionary-encoding it if that's what the schema wants"""
+    if pa.types.is_dictionary(array.type):
+        array = array.cast(array.type.value_type)
+    if pa.types.is_dictionary(field_type):
+        return array.cast(field_type.value_type).dictionary_encode().cast(field_type)
+    return array.cast(field_type)
+
+
+def runs_to_table(run_df):
+    """Convert a dataframe of flattened runs (eg. after merging new runs into old ones) back into an
+    Arrow table that matches RUN_SCHEMA, ready to be written to parquet"""
+    runs_table = pa.Table.from_pandas(run_df, preserve_index=False)
+    fields = [
+        field if field.name in runs_table.column_names else None for field in RUN_SCHEMA
+    ]
+    fields = [field for field in fields if field is not None] + [
+        pa.field(name, CATEGORY_TYPE if name.startswith(VALUE_COLUMN_PREFIX) else pa.string())
+        for name in runs_table.column_names
+        if name not in RUN_SCHEMA.names
+    ]
+    return pa.table(
+        [cast_column(runs_table[field.name], field.type) for field in fields],
+        schema=pa.schema(fields))
@@ -1,84 +1,389 @@
 
-from datetime import datetime, timezone
+from datetime import datetime
+import hashlib
+
 import numpy as np
 import matplotlib.pyplot as plt
 import pandas as pd
+import pyarrow.parquet as pq
 
+from aggregates import (
+    filter_run_counts, label_run_counts, load_run_counts, rollup_run_counts, run_counts, save_run_counts,
+    COUNT_COLUMN, CUBE_RUN_COLUMNS)
+from chart_cache import draw_chart, save_chart
 from config import BoardInfo
-from utils import DATA_PATH, CHART_PATH, get_user_name
+from enrich_data import VALUE_COLUMN_PREFIX
+from records import (
+    barrier_histograms, leaderboards_as_of, pb_events, update_wr_progression, wr_progression, subcategory_columns,
+    WR_GROUP_COLUMNS, WR_SORT_COLUMNS)
+from query import combine_filters, compile_query, filter_runs, RunQuery
+from run_index import decode_variables, select_runs, build_run_index, variable_columns, INDEX_BASE_COLUMNS
+from scraper import read_runs, run_filters
+from utils import DATA_PATH, CHART_PATH, get_user_names, write_parquet_atomic
 
 
 plt.tight_layout()
 
+# Run columns each graph/aggregation actually uses. Pass these to get_full_game_local/read_runs
+# (or they get passed to join_all_data for you) so only those columns are read off disk
+RUN_COLUMNS = {
+    "get_run_counts": CUBE_RUN_COLUMNS,
+    "get_verifier_stats": ['id', 'e_examiner'],
+    "get_wr_runs": ['id', 'level', 'category', 'date', 'submitted', 'e_primary_t', 'e_pid', 'e_runner_name', 'e_is_il'],
+    "get_longest_standing_wrs": ['id', 'level', 'category', 'date', 'submitted', 'e_primary_t', 'e_pid', 'e_runner_name', 'e_is_il'],
+    "get_leaderboard": ['id', 'level', 'category', 'date', 'e_primary_t', 'e_pid', 'e_runner_name'],
+    "get_run_index": [
+        'id', 'level', 'category', 'date', 'submitted', 'e_primary_t', 'e_pid', 'e_runner_name', 'e_is_il',
+        'e_status_judgment'],
+    "export_joined_runs_csv": [
+        'id', 'weblink', 'game', 'level', 'category', 'date', 'submitted',
+        'e_primary_t', 'e_pid', 'e_is_il', 'e_status_judgment'],
+}
+
 # Common Data Transformations
 
-def join_all_data(board_info: BoardInfo, filter_users=True):
-    """Perform a mega-join of all of our data so we can label levels, categories, users, whatever
-    
-    filter_users removes Stupid Rat and Rejected runs from the dataset
-    """
+# Joined runs from join_all_data, keyed by the fingerprints of the files they were built from and
+# the join options, PB events from get_pb_events keyed by the fingerprints, and run indexes from
+# get_run_index keyed by the fingerprints and filter_users. Only the latest version of each board's
+# files is kept (see cache_board_entry). Cleared with clear_join_cache
+JOINED_RUNS_CACHE = {}
+PB_EVENTS_CACHE = {}
+RUN_INDEX_CACHE = {}
+# WR progressions from get_wr_runs, keyed by the board's files and the options, holding the fingerprints
+# they were built from and a hash per run (see wr_run_hashes). When the files change, the new and changed
+# runs get folded into the last progression instead of starting over (see refresh_wr_progression)
+WR_PROGRESSION_CACHE = {}
+JOINED_SOURCES = ("runs", "levels", "categories")
+
+# The level/category columns join_runs labels runs with, and what they're called on the joined runs.
+# Nothing else from the levels/categories tables (weblinks, rules, links) gets joined in
+JOINED_LEVEL_COLUMNS = {'name': 'name', 'e_short_name': 'e_short_name'}
+JOINED_CATEGORY_COLUMNS = {'name': 'name_categories', 'type': 'type'}
+
+
+def board_file(board_info: BoardInfo, name):
+    """Path of one of a board's saved parquet files (runs, levels, categories...)"""
+    return board_info.save_path / f"{board_info.file_prefix}_{name}.parquet"
+
+
+def file_fingerprint(path):
+    """Cheap change detection for a source file: its path, modified time, and size"""
+    stat = path.stat()
+    return (str(path), stat.st_mtime_ns, stat.st_size)
+
+
+def board_fingerprints(board_info: BoardInfo):
+    return tuple(file_fingerprint(board_file(board_info, name)) for name in JOINED_SOURCES)
+
+
+def cache_board_entry(cache, cache_key, value):
+    """Add an entry to one of the caches keyed by (board fingerprints, ...), dropping the board's entries
+    for older versions of its files, so syncs and re-fetches don't pile up copies of the same board"""
+    fingerprints = cache_key[0]
+    paths = [path for path, *_ in fingerprints]
+    for stale_key in [key for key in cache if key[0] != fingerprints and [path for path, *_ in key[0]] == paths]:
+        del cache[stale_key]
+    cache[cache_key] = value
+    return value
+
+
+def clear_join_cache():
+    JOINED_RUNS_CACHE.clear()
+    PB_EVENTS_CACHE.clear()
+    RUN_INDEX_CACHE.clear()
+    WR_PROGRESSION_CACHE.clear()
+
+
+def board_query(board_info: BoardInfo, query):
+    """Compile a query string (see query.py) against the board's categories, levels, and variables.
+    Already compiled queries and None come back as they are"""
+    if query is None or isinstance(query, RunQuery):
+        return query
+    return compile_query(query, board_info.categories, board_info.levels, board_info.variables)
+
+
+def query_group_columns(query: RunQuery, group_columns=WR_GROUP_COLUMNS):
+    """Leaderboard group columns, plus the query's split column so each split gets its own leaderboards"""
+    split_columns = query.split_columns if query is not None else []
+    return list(group_columns) + [column for column in split_columns if column not in group_columns]
+
+
+def lookup_labels(keys, table, columns):
+    """Label each of keys (level or category ids) with columns of its row in table, renamed per columns.
+
+    The lookup is done once per distinct id, then every run just gets the integer code of its label,
+    so each label column is a categorical that costs a byte or two per run"""
+    keys = keys.astype('category')
+    rows = pd.DataFrame(table)
+    if len(rows):
+        rows = rows.drop_duplicates('id').set_index('id').reindex(keys.cat.categories)
+    else:
+        rows = pd.DataFrame(index=keys.cat.categories)
+    # Runs with no id (code -1) point at the extra -1 on the end
+    run_codes = keys.cat.codes.to_numpy()
+
+    labels = {}
+    for column, name in columns.items():
+        values = rows[column] if column in rows else pd.Series(None, index=rows.index, dtype=object)
+        label_codes, label_values = pd.factorize(values)
+        labels[name] = pd.Categorical.from_codes(np.append(label_codes, -1)[run_codes], categories=label_values)
+    return labels
 
-    runs = pd.read_parquet(DATA_PATH / "PT_runs.parquet")
-    levels = pd.read_parquet(DATA_PATH / "PT_levels.parquet")
-    categories = pd.read_parquet(DATA_PATH / "PT_categories.parquet")
 
+def join_runs(runs, levels, categories):
+    """Join runs to their levels and categories, labelling everything for the graphs.
 
-    # Join runs to levels to get level names for axes
-    runs_level = pd.merge(runs, levels, left_on='level', right_on='id', how='left', suffixes=('_runs', '_levels'))
-    runs_level = pd.merge(runs_level, categories, left_on='category', right_on='id', how='left', suffixes=(None, '_categories'))
-    runs_level['Categories'] = runs_level['name_categories']
+    Only JOINED_LEVEL_COLUMNS/JOINED_CATEGORY_COLUMNS get joined in, as categoricals looked up by
+    integer code (see lookup_labels), instead of merging every row with the whole levels/categories tables"""
+    runs = runs.rename(columns={'id': 'id_runs', 'weblink': 'weblink_runs'}).reset_index(drop=True)
+    runs = runs.assign(level=runs['level'].astype('category'), category=runs['category'].astype('category'))
+    level_labels = lookup_labels(runs['level'], levels, JOINED_LEVEL_COLUMNS)
+    category_labels = lookup_labels(runs['category'], categories, JOINED_CATEGORY_COLUMNS)
 
     # Mark runs without a short_name as full game, for convenience
-    runs_level["e_short_name"] = runs_level["e_short_name"].fillna("Full Game")
+    short_names = level_labels['e_short_name']
+    if "Full Game" not in short_names.categories:
+        short_names = short_names.add_categories("Full Game")
+    level_labels['e_short_name'] = short_names.fillna("Full Game")
 
-    # Remove Stupid Rat and Rejected runs
-    if filter_users:
-        runs_level = runs_level.loc[not runs_level['e_is_rat']]
-        runs_level = runs_level.loc[runs_level['e_status_judgment'] == 'verified']
+    return runs.assign(**level_labels, **category_labels, Categories=category_labels['name_categories'])
 
-    return runs_level
 
+def join_all_data(board_info: BoardInfo, filter_users=True, columns=None, materialize=False, query=None):
+    """Perform a mega-join of all of our data so we can label levels, categories, users, whatever
+    
+    filter_users removes Stupid Rat and Rejected runs from the dataset. It's pushed down into the
+    runs read, along with columns and query's filter (a query string or RunQuery, see query.py),
+    so runs/columns that would be thrown away are never loaded.
+
+    For boards saved to disk the join is only done once: it's kept in memory until the board's runs,
+    levels, or categories files change. With materialize set it's also written next to them as
+    {file_prefix}_joined_*.parquet, so later sessions can load it instead of redoing the join.
+    Boards that were never saved are joined straight from board_info every time.
+    """
 
-def get_il_counts():
-    """Load in, join, and group data to get counts of IL runs per level/category"""
-    runs_level = join_all_data()
-    runs_level = runs_level[runs_level["e_is_il"]]
+    query = board_query(board_info, query)
+    if columns is not None:
+        # The join always needs the level/category ids, and whatever the query splits by
+        columns = list(dict.fromkeys(list(columns) + ['level', 'category'] + (query.split_columns if query else [])))
+    filters = combine_filters(run_filters(statuses=['verified'], exclude_rats=True) if filter_users else None, query)
+
+    if board_info.save_path is None:
+        runs = pd.DataFrame(board_info.runs)
+        if filter_users:
+            runs = runs[(runs['e_status_judgment'] == 'verified') & ~runs['e_is_rat'].astype(bool)]
+        if query is not None:
+            runs = filter_runs(runs, query.filter)
+        if columns is not None:
+            runs = runs[columns]
+        return join_runs(runs, pd.DataFrame(board_info.levels), pd.DataFrame(board_info.categories))
+
+    fingerprints = board_fingerprints(board_info)
+    options = (filter_users, tuple(columns) if columns is not None else None) + ((query.key,) if query else ())
+    cache_key = (fingerprints, options)
+
+    if cache_key not in JOINED_RUNS_CACHE:
+        options_hash = hashlib.sha1(repr(options).encode()).hexdigest()[:10]
+        sources_hash = hashlib.sha1(repr(fingerprints).encode()).hexdigest()[:10]
+        joined_prefix = f"{board_info.file_prefix}_joined_{options_hash}"
+        joined_path = board_info.save_path / f"{joined_prefix}_{sources_hash}.parquet"
+
+        if joined_path.exists():
+            joined = pd.read_parquet(joined_path)
+        else:
+            joined = join_runs(
+                read_runs(board_file(board_info, "runs"), columns=columns, filters=filters),
+                pd.read_parquet(board_file(board_info, "levels")),
+                pd.read_parquet(board_file(board_info, "categories")))
+            if materialize:
+                # Anything materialized from older versions of the source files is stale now
+                for stale_path in board_info.save_path.glob(f"{joined_prefix}_*.parquet"):
+                    stale_path.unlink()
+                write_parquet_atomic(joined, joined_path)
+        cache_board_entry(JOINED_RUNS_CACHE, cache_key, joined)
+
+    # Callers sort and add columns in place, so hand out a copy
+    return JOINED_RUNS_CACHE[cache_key].copy()
+
+
+def get_run_counts(board_info: BoardInfo, query=None):
+    """The board's run count cube (see aggregates.py). For saved boards it's loaded from
+    {file_prefix}_run_counts.parquet, and only rebuilt from the runs if it's missing or out of date.
+
+    With a query, the counts are made from just the runs it matches (counted by its split column
+    too), with the filter pushed down into the runs read. Those aren't saved"""
+    query = board_query(board_info, query)
+    if query is not None:
+        columns = list(dict.fromkeys(RUN_COLUMNS["get_run_counts"] + query.split_columns))
+        if board_info.save_path is None:
+            runs = filter_runs(pd.DataFrame(board_info.runs), query.filter)
+        else:
+            runs = read_runs(board_file(board_info, "runs"), columns=columns, filters=query.filter)
+        return run_counts(runs, dimensions=query.split_columns)
+
+    if board_info.save_path is None:
+        return run_counts(pd.DataFrame(board_info.runs))
+
+    runs_path = board_file(board_info, "runs")
+    counts_path = board_file(board_info, "run_counts")
+    counts = load_run_counts(counts_path, runs_path)
+    if counts is None:
+        counts = run_counts(read_runs(runs_path, columns=RUN_COLUMNS["get_run_counts"]))
+        save_run_counts(counts, counts_path, runs_path)
+    return counts
+
+
+def get_il_counts(board_info: BoardInfo, query=None):
+    """Get counts of verified IL runs per level/category, from the run count cube"""
+    il_counts = label_run_counts(
+        filter_run_counts(get_run_counts(board_info, query), il="IL"), board_info.levels, board_info.categories)
 
     # Get run counts broken up by level and category
-    return runs_level.groupby(['e_short_name', 'Categories']).count().unstack('Categories').loc[:, ('id_runs')].fillna(0)
+    return il_counts.pivot_table(
+        index='e_short_name', columns='Categories', values=COUNT_COLUMN, aggfunc='sum', fill_value=0)
 
 
-def get_verifier_stats():
+def get_verifier_stats(board_info: BoardInfo, query=None):
     """This one's just for me, get a list of who's verified the most runs, lol"""
-    runs = pd.read_parquet(DATA_PATH / "PT_runs.parquet")
-    runs['examiner'] = runs['status'].apply(lambda x: x['examiner'])
+    runs = read_runs(
+        board_file(board_info, "runs"),
+        columns=RUN_COLUMNS["get_verifier_stats"],
+        filters=combine_filters(None, board_query(board_info, query)))
+    runs['examiner'] = runs['e_examiner']
 
     z = runs.groupby('examiner').count()
-    z['verifier_name'] = z.apply(lambda x: get_user_name(x.name), axis=1)
+    z['verifier_name'] = z.index.map(get_user_names(z.index))
     z = z[['id','verifier_name']].sort_values('id',ascending=False)
     return z
 
 
-def get_wr_runs(filter_users=True):
-    """Filter the run set to runs that were WR at the time they happened"""
-    runs = join_all_data(filter_users=filter_users)
-    runs.sort_values(["date", "submitted"], inplace=True)
-    runs["wr_t"] = runs.groupby(["Categories", "e_short_name"])['e_primary_t'].cummin()
-    runs["was_wr"] = runs.apply(lambda x: x.e_primary_t == x.wr_t, axis=1)
+def board_run_columns(board_info: BoardInfo):
+    if board_info.save_path is not None:
+        return pq.read_schema(board_file(board_info, "runs")).names
+    return list(pd.DataFrame(board_info.runs).columns)
 
-    return runs[runs["was_wr"]].copy()
-    
 
-def get_longest_standing_wrs(longest_active=False, fullgame_only=False, filter_users=True, result_count=20):
+def board_subcategory_columns(board_info: BoardInfo):
+    """value_ columns for the board's subcategory variables that its runs actually have"""
+    run_columns = board_run_columns(board_info)
+    return [column for column in subcategory_columns(board_info.variables) if column in run_columns]
+
+
+def get_run_index(board_info: BoardInfo, filter_users=True, query=None):
+    """The board's joined runs with their variables decoded, indexed by category, level, and
+    subcategory (see run_index.py). Like join_all_data, it's only built once per version of the
+    board's files. With a query, only the runs it matches are indexed"""
+    query = board_query(board_info, query)
+    cache_key = (board_fingerprints(board_info), filter_users, query.key if query else None)\
+        if board_info.save_path is not None else None
+    if cache_key is not None and cache_key in RUN_INDEX_CACHE:
+        return RUN_INDEX_CACHE[cache_key]
+
+    value_columns = [column for column in board_run_columns(board_info) if column.startswith(VALUE_COLUMN_PREFIX)]
+    runs = join_all_data(
+        board_info, filter_users=filter_users, columns=RUN_COLUMNS["get_run_index"] + value_columns, query=query)
+
+    # The decoded names of the subcategory variables are what the runs get indexed by
+    decoded_names = variable_columns(board_info.variables, runs.columns)
+    subcategories = [
+        decoded_names[column[len(VALUE_COLUMN_PREFIX):]] for column in board_subcategory_columns(board_info)
+        if column[len(VALUE_COLUMN_PREFIX):] in decoded_names]
+    run_index = build_run_index(decode_variables(runs, board_info.variables), subcategories)
+
+    if cache_key is not None:
+        cache_board_entry(RUN_INDEX_CACHE, cache_key, run_index)
+    return run_index
+
+
+def board_subcategories(run_index):
+    """The decoded subcategory columns a run index from get_run_index is split by"""
+    return run_index.group_columns[len(INDEX_BASE_COLUMNS):]
+
+
+def get_runs(board_info: BoardInfo, filter_users=True, query=None, **criteria):
+    """Joined, decoded runs from get_run_index in the groups matching criteria, e.g.
+    get_runs(board_info, Categories="Any%", e_short_name="Full Game", Character=["Noise", "Swap"])"""
+    return select_runs(get_run_index(board_info, filter_users, query), **criteria)
+
+
+def get_wr_runs(board_info: BoardInfo, filter_users=True, split_subcategories=False, where=None, query=None):
+    """Filter the run set to runs that were WR at the time they happened, along with when each
+    record was set and broken (see records.wr_progression)
+
+    If split_subcategories is set, subcategory variables get their own WR progressions. where is a
+    dict of criteria (see get_runs) to only look at some of the board's leaderboards, and query
+    (see query.py) narrows down the runs, with its split getting its own WR progressions too."""
+    query = board_query(board_info, query)
+    run_index = get_run_index(board_info, filter_users, query)
+    subcategories = board_subcategories(run_index) if split_subcategories else []
+    group_columns = query_group_columns(query) + subcategories
+
+    if board_info.save_path is None:
+        progression = wr_progression(run_index.runs, group_columns=group_columns)
+    else:
+        # Kept per board and options, and brought up to date when the board's files change
+        fingerprints = board_fingerprints(board_info)
+        cache_key = (tuple(path for path, *_ in fingerprints), filter_users, split_subcategories, query.key if query else None)
+        cached = WR_PROGRESSION_CACHE.get(cache_key)
+        if cached is not None and cached[0] == fingerprints:
+            progression = cached[2]
+        else:
+            # The hashes are all that's kept of the runs, for the next refresh to compare against
+            run_hashes = wr_run_hashes(run_index.runs, group_columns)
+            if cached is None:
+                progression = wr_progression(run_index.runs, group_columns=group_columns)
+            else:
+                progression = refresh_wr_progression(cached[1], run_hashes, cached[2], run_index.runs, group_columns)
+            WR_PROGRESSION_CACHE[cache_key] = (fingerprints, run_hashes, progression)
+
+    if where:
+        # where picks whole leaderboards, so it can pick them out of the progression just the same
+        return select_runs(build_run_index(progression, subcategories), **where).copy()
+    return progression.copy()
+
+
+def wr_run_hashes(runs, group_columns):
+    """A hash per run of the columns a WR progression depends on, to tell which runs changed between two versions of a board"""
+    columns = ['id_runs'] + group_columns + [column for column in WR_SORT_COLUMNS + ['e_primary_t'] if column in runs]
+    return pd.util.hash_pandas_object(runs[list(dict.fromkeys(columns))], index=False).to_numpy()
+
+
+def refresh_wr_progression(previous_hashes, run_hashes, progression, runs, group_columns):
+    """Bring a WR progression up to date with runs, given the wr_run_hashes of the runs it was built
+    from (previous_hashes) and of runs (run_hashes).
+
+    Runs with a new hash (new runs, changed runs) get folded in with records.update_wr_progression.
+    Runs that went away or changed without being WRs can't have set any records, but if a WR run did,
+    records can be taken away, so the progression gets rebuilt from scratch instead"""
+    is_new = ~np.isin(run_hashes, previous_hashes)
+    is_wr = runs['id_runs'].isin(progression['id_runs']).to_numpy()
+    if is_wr.sum() < progression['id_runs'].nunique() or (is_wr & is_new).any():
+        return wr_progression(runs, group_columns=group_columns)
+
+    return update_wr_progression(progression, runs[is_new], group_columns=group_columns, id_column='id_runs')
+
+
+def get_longest_standing_wrs(
+        board_info: BoardInfo,
+        longest_active=False,
+        fullgame_only=False,
+        filter_users=True,
+        result_count=20,
+        split_subcategories=False,
+        where=None,
+        query=None):
     """Get the longest-standing WRs"""
-    wr_runs = get_wr_runs(filter_users=filter_users)
+    wr_runs = get_wr_runs(
+        board_info, filter_users=filter_users, split_subcategories=split_subcategories, where=where, query=query)
+    return longest_standing_wrs(wr_runs, longest_active, fullgame_only, result_count)
+
 
-    # Get the date of the next WR after this one
-    wr_runs.loc[:, "next_wr_date"] = wr_runs.groupby(["Categories", "e_short_name"])['date'].shift(-1)
+def longest_standing_wrs(wr_runs, longest_active=False, fullgame_only=False, result_count=20):
+    """Rank the WRs from get_wr_runs by how long they stood"""
+    wr_runs = wr_runs.copy()
 
-    # Mark currently-standing WRs, then fill in blank dates for time comparisons
-    wr_runs.loc[:, "is_active"] = wr_runs["next_wr_date"].isna()
-    wr_runs.loc[:, "next_wr_date"] = wr_runs["next_wr_date"].fillna(np.datetime64("today"))
+    # Fill in blank broken dates for currently-standing WRs for time comparisons
+    wr_runs.loc[:, "next_wr_date"] = wr_runs["wr_broken"].fillna(np.datetime64("today"))
 
     # Get how long the record stood for, up to today for active ones
     wr_runs.loc[:, "stood_for"] = (wr_runs['next_wr_date'] - wr_runs['date']).dt.days
@@ -87,7 +392,7 @@ def get_longest_standing_wrs(longest_active=False, fullgame_only=False, filter_u
         wr_runs = wr_runs[wr_runs['is_active']]
 
     if fullgame_only:
-        wr_runs = wr_runs[~wr_runs['e_is_il']]
+        wr_runs = wr_runs[wr_runs['e_is_il'] == 'Full Game']
 
     # Return the top 20 longest-standing WRs
     return wr_runs[
@@ -98,34 +403,106 @@ def get_longest_standing_wrs(longest_active=False, fullgame_only=False, filter_u
         ].sort_values('stood_for', ascending=False).head(result_count)
 
 
-def get_leaderboard(category, level, barrier_cutoff_date=None):
-    """Pull out current active runs for all users on the board and order it by time
-    to get the current leaderboard"""
-    runs = join_all_data(filter_users=True)
-    runs = runs[(runs["Categories"] == category) & (runs["e_short_name"] == level)].sort_values('date')
+def get_pb_events(board_info: BoardInfo, query=None):
+    """Every personal best change on the board (see records.pb_events), kept around until the
+    board's files change so leaderboards for any date can be pulled out of it.
+
+    With a query (see query.py), only the runs it matches count, and its split gets its own leaderboards"""
+    query = board_query(board_info, query)
+
+    def build_events():
+        runs = join_all_data(board_info, filter_users=True, columns=RUN_COLUMNS["get_leaderboard"], query=query)
+        return pb_events(runs, group_columns=query_group_columns(query))
+
+    if board_info.save_path is None:
+        return build_events()
+
+    cache_key = (board_fingerprints(board_info), query.key if query else None)
+    if cache_key not in PB_EVENTS_CACHE:
+        cache_board_entry(PB_EVENTS_CACHE, cache_key, build_events())
+    return PB_EVENTS_CACHE[cache_key]
 
-    latest_runs = runs.groupby("e_pid").tail(1)
+
+def get_leaderboards_as_of(board_info: BoardInfo, dates, categories=None, levels=None, query=None):
+    """Get the leaderboards as they were on each of dates, for all categories/levels or only the
+    given category names and level short names (see records.leaderboards_as_of)"""
+    query = board_query(board_info, query)
+    return leaderboards_from_events(
+        get_pb_events(board_info, query), dates, categories, levels, group_columns=query_group_columns(query))
+
+
+def leaderboards_from_events(events, dates, categories=None, levels=None, group_columns=None):
+    if categories is not None:
+        events = events[events["Categories"].isin(categories)]
+    if levels is not None:
+        events = events[events["e_short_name"].isin(levels)]
+    return leaderboards_as_of(events, dates, group_columns=group_columns)
+
+
+def get_leaderboard(board_info: BoardInfo, category, level, barrier_cutoff_date=None, query=None):
+    """Pull out each user's current PB on the board and order it by time to get the current leaderboard
+
+    If barrier_cutoff_date is set, each user's PB as of that date comes along as e_primary_t_prior"""
+    query = board_query(board_info, query)
+    return leaderboard_from_events(
+        get_pb_events(board_info, query), category, level, barrier_cutoff_date, group_columns=query_group_columns(query))
+
+
+def leaderboard_from_events(events, category, level, barrier_cutoff_date=None, group_columns=None):
+    """get_leaderboard, for PB events you already have (see get_pb_events)"""
+    today = pd.Timestamp.now().normalize()
+    dates = [today] + ([pd.Timestamp(barrier_cutoff_date)] if barrier_cutoff_date else [])
+    boards = leaderboards_from_events(events, dates, categories=[category], levels=[level], group_columns=group_columns)
+    split_columns = [column for column in (group_columns or WR_GROUP_COLUMNS) if column not in WR_GROUP_COLUMNS]
+
+    latest_runs = boards[boards["as_of"] == today]
 
     # If I'm marking new minute barriers, get a copy of the leaderboard as of the barrier_cutoff_date
     if barrier_cutoff_date:
-        runs_before_cutoff = runs[runs['date'] <= barrier_cutoff_date]
-        latest_before_cutoff = runs_before_cutoff.groupby("e_pid").tail(1)
+        latest_before_cutoff = boards[boards["as_of"] == pd.Timestamp(barrier_cutoff_date)]
         latest_runs = pd.merge(
             latest_runs,
-            latest_before_cutoff[['e_pid', 'e_primary_t']],
-            left_on="e_pid",
-            right_on="e_pid",
+            latest_before_cutoff[['e_pid', 'e_primary_t'] + split_columns],
+            on=["e_pid"] + split_columns,
             how="left",
             suffixes=(None, "_prior"))
 
     return latest_runs.sort_values("e_primary_t")
 
 
+def get_barrier_histograms(
+        board_info: BoardInfo, barrier_cutoff_dates=(), bucket_minutes=1, split_subcategories=False, query=None):
+    """Minute barrier counts for every category/level on the board at once (see records.barrier_histograms),
+    with players who hit a new barrier since each of barrier_cutoff_dates split out. Pull single
+    charts out of it with barrier_counts.
+
+    If split_subcategories is set, subcategory variables get their own leaderboards too, in columns
+    named after the variables (see get_run_index). So does a query's split (see query.py)."""
+    query = board_query(board_info, query)
+    split_columns = query_group_columns(query)[len(WR_GROUP_COLUMNS):]
+    subcategories = []
+    if split_subcategories:
+        run_index = get_run_index(board_info, query=query)
+        subcategories = board_subcategories(run_index)
+    if subcategories:
+        events = pb_events(run_index.runs, group_columns=WR_GROUP_COLUMNS + subcategories + split_columns)
+    else:
+        events = get_pb_events(board_info, query)
+
+    # Bring the category/level names along so charts can be picked out by name
+    return barrier_histograms(
+        events,
+        pd.Timestamp.now().normalize(),
+        cutoff_dates=[cutoff_date for cutoff_date in barrier_cutoff_dates if cutoff_date is not None],
+        bucket_minutes=bucket_minutes,
+        group_columns=WR_GROUP_COLUMNS + subcategories + split_columns + ['Categories', 'e_short_name'])
+
+
 # CSV export, for XBC
 
-def export_joined_runs_csv():
+def export_joined_runs_csv(board_info: BoardInfo, query=None):
     """Export a CSV with the nested fields removed"""
-    joined_run_list = join_all_data()
+    joined_run_list = join_all_data(board_info, columns=RUN_COLUMNS["export_joined_runs_csv"], query=query)
     scrubbed_run_list = joined_run_list[[
         'id_runs', 'weblink_runs', 'game', 'level', 'e_short_name', 'category', 'name_categories',
         'date', 'submitted', 'e_primary_t', 'e_pid', 'e_is_il', 'e_status_judgment', 
@@ -137,6 +514,192 @@ def export_joined_runs_csv():
         date_format="%Y-%m-%d %H:%M:%S")
 
 
+# Chart Data
+# Each chart is an aggregation, which builds the small table the chart shows, and a draw_ function
+# that draws that table onto a matplotlib Axes. The plot_ functions below stitch them together with
+# pyplot for notebooks, and render.py uses them to render whole batches of charts in parallel
+
+def minute_barrier_counts(leaderboard, minute_cutoff=1000, fill_minutes=False):
+    """Count the players on a leaderboard at each minute barrier, leaving out runs slower than minute_cutoff
+
+    If the leaderboard has e_primary_t_prior (see get_leaderboard's barrier_cutoff_date), players who
+    broke into a new minute barrier since then are counted as new, everyone else as old"""
+    minute_time = np.floor(leaderboard['e_primary_t'] / 60)
+    if 'e_primary_t_prior' in leaderboard:
+        last_month_minute_time = np.floor(leaderboard['e_primary_t_prior'] / 60).fillna(900000000.0)
+        new_minute_barrier = minute_time < last_month_minute_time
+    else:
+        new_minute_barrier = pd.Series(False, index=leaderboard.index)
+
+    # Cutoff runs
+    in_cutoff = minute_time <= minute_cutoff
+    minutes = pd.crosstab(minute_time[in_cutoff], new_minute_barrier[in_cutoff])\
+        .reindex(columns=[False, True], fill_value=0)
+    minutes.columns = ['old', 'new']
+    minutes.index = minutes.index.astype(int)
+
+    if fill_minutes and len(minutes):
+        # Fill in missing minutes with 0
+        minutes = minutes.reindex(index=range(minutes.index.min(), minutes.index.max() + 1), fill_value=0)
+
+    minutes['total'] = minutes['old'] + minutes['new']
+    return minutes
+
+
+def barrier_counts(
+        histograms,
+        category,
+        level="Full Game",
+        barrier_cutoff_date=None,
+        minute_cutoff=1000,
+        fill_minutes=False,
+        bucket_minutes=1,
+        subcategories=None):
+    """Cut one leaderboard's minute_barrier_counts out of get_barrier_histograms' table, by category
+    name and level short name. subcategories is a dict of subcategory variable name to value to narrow it down
+    further, otherwise subcategory leaderboards are added together. bucket_minutes has to match the
+    histograms' for fill_minutes to fill the right barriers"""
+    keep = (histograms['Categories'] == category) & (histograms['e_short_name'] == level) & (histograms['barrier'] <= minute_cutoff)
+    if barrier_cutoff_date is not None:
+        keep &= histograms['cutoff'] == pd.Timestamp(barrier_cutoff_date)
+    else:
+        keep &= histograms['cutoff'].isna()
+    for column, value in (subcategories or {}).items():
+        keep &= histograms[column] == value
+
+    minutes = histograms[keep].groupby('barrier')[['old', 'new', 'total']].sum()
+    minutes.index.name = None
+    if fill_minutes and len(minutes):
+        # Fill in missing barriers with 0
+        barriers = np.arange(minutes.index.min(), minutes.index.max() + bucket_minutes, bucket_minutes)
+        minutes = minutes.reindex(index=barriers[barriers <= minutes.index.max()], fill_value=0)
+    return minutes
+
+
+def runs_per_week_counts(counts, start_date, end_date=None, il_split=False, split_by=None, split_names=None):
+    """Count runs per week between start_date and end_date from the run count cube (see get_run_counts),
+    optionally split by fullgame/IL, or by any column the counts have (e.g. a query's split, with
+    split_names to label its values)"""
+    end_date = end_date or datetime.now()
+    if split_by is not None:
+        split_names = split_names or {}
+        return rollup_run_counts(counts, 'W', by=split_by, start_date=start_date, end_date=end_date)\
+            .rename(columns=lambda value: "Full Game" if split_by == 'level' and pd.isna(value) else split_names.get(value, value))
+    if il_split:
+        return rollup_run_counts(counts, 'W', by='e_is_il', start_date=start_date, end_date=end_date)\
+            .reindex(columns=['Full Game', 'IL'], fill_value=0)
+    return rollup_run_counts(counts, 'W', start_date=start_date, end_date=end_date)\
+        .rename(columns={COUNT_COLUMN: 'Runs'})
+
+
+def il_count_totals(il_counts, categories=None):
+    """IL run counts per level for the given IL categories (all of them by default), ordered by total runs"""
+    categories = list(categories) if categories is not None else list(il_counts.columns)
+    totals = il_counts[categories].sum(axis=1)
+    return il_counts.loc[totals.sort_values(ascending=False).index, categories]
+
+
+def top_counts(counts, count=10):
+    """Top count entries of a series of counts, ordered smallest to biggest for horizontal bar charts"""
+    return counts.sort_values(ascending=False)[:count].sort_values(ascending=True)
+
+
+def get_submitter_counts(board_info: BoardInfo, query=None):
+    """Count verified IL/Full Game/total runs per runner, from the run count cube"""
+    counts = filter_run_counts(get_run_counts(board_info, query))
+
+    # Group runs by runners and count up ILs/Fullgame runs
+    runner_count = counts.groupby(["e_runner_name", "e_is_il"])[COUNT_COLUMN].sum().unstack("e_is_il")\
+        .reindex(columns=["IL", "Full Game"], fill_value=0).fillna(0)
+    runner_count.loc[:, ("total_count")] = runner_count["IL"] + runner_count["Full Game"]
+    return runner_count
+
+
+def long_standing_wr_bars(wr_list, full_game, count=10):
+    """Label the WRs from longest_standing_wrs for a bar chart, ordered for horizontal bars"""
+    # Create a title col out of the other cols
+    format_str = "{e_runner_name}'s {Category}\n({date} to {next_wr_date})'"\
+         if full_game else "{e_runner_name}'s {e_short_name} {Category}\n({date} to {next_wr_date})'"
+    titles = wr_list.apply(
+        lambda x: format_str\
+            .format(
+                e_runner_name=x.e_runner_name,
+                e_short_name=x.e_short_name,
+                Category=x.Categories,
+                date=x.date.strftime("%y-%m-%d"),
+                next_wr_date="Now" if x.is_active else x.next_wr_date.strftime("%y-%m-%d")),
+            axis=1)
+
+    wr_bars = pd.DataFrame({"Title": titles, "Days": wr_list["stood_for"]})
+    return wr_bars[:count].sort_values("Days", ascending=True)
+
+
+# Drawing Functions
+
+def annotate_generated(ax, y):
+    """Stamp today's date under the chart"""
+    curr_date = datetime.utcnow().strftime('%Y-%m-%d')
+    ax.annotate(
+        f"Generated on {curr_date}",
+        xy=(1.0, y),
+        xycoords="axes fraction",
+        ha="right",
+        va="center",
+        fontsize=8)
+
+
+def draw_minute_histogram(ax, minutes, title, color='C0', new_run_color='C1'):
+    """Draw minute_barrier_counts, stacking new runs on top of old ones if there are any"""
+    minute_values = minutes.index.values
+
+    if minutes['new'].any():
+        totals = ax.bar(minute_values, minutes['total'])
+        ax.bar(minute_values, minutes['old'], color=color, label="Older Runs")
+        ax.bar(minute_values, minutes['new'], bottom=minutes['old'], color=new_run_color, label="New Runs")
+        ax.legend()
+    else:
+        totals = ax.bar(minute_values, minutes['total'], color=color)
+        ax.legend(['Players'])
+    ax.bar_label(totals)
+
+    ax.set_xticks(minute_values)
+    ax.tick_params(axis='x', labelrotation=90)
+    if len(minutes):
+        ax.set_ylim(0, max(minutes['total'] + 2))
+        ax.set_xlim(min(minute_values) - 1, max(minute_values) + 1)
+    ax.set_title(title)
+    ax.set_xlabel("Run Minutes")
+    ax.set_ylabel("Players")
+    annotate_generated(ax, -0.15)
+
+
+def draw_runs_per_week(ax, runs_per_week, title):
+    """Draw runs_per_week_counts, stacked if it's split by fullgame/IL"""
+    runs_per_week = runs_per_week.set_axis(runs_per_week.index.strftime('%b-%d')).rename_axis(index=None, columns=None)
+    runs_per_week.plot.bar(ax=ax, stacked=True, title=title)
+    annotate_generated(ax, -0.2)
+
+
+def draw_stacked_counts(ax, counts, title):
+    """Draw a stacked bar per row of counts, e.g. il_count_totals"""
+    counts.plot.bar(ax=ax, stacked=True, title=title)
+    annotate_generated(ax, -0.5)
+
+
+def draw_top_counts(ax, counts, title, color='C0'):
+    """Draw labelled horizontal bars for top_counts"""
+    counts.plot.barh(ax=ax, title=title, color=color)
+    ax.bar_label(ax.containers[0])
+    annotate_generated(ax, -0.1)
+
+
+def draw_long_standing_wrs(ax, wr_bars, title, color='C0', legend=True):
+    """Draw long_standing_wr_bars"""
+    wr_bars.plot.barh(ax=ax, x='Title', y='Days', title=title, color=color, legend=legend)
+    ax.bar_label(ax.containers[0])
+    annotate_generated(ax, -0.1)
+
+
 # Actual Graphing Functions
 
 def plot_minute_histogram(
@@ -148,32 +711,17 @@ def plot_minute_histogram(
         transparent=False):
     """Plot the number of runs on the leaderboard on per-minute buckets,
     with a cutoff for runs slower than minute_cutoff"""
+    minutes = minute_barrier_counts(
+        leaderboard.drop(columns='e_primary_t_prior', errors='ignore'), minute_cutoff, fill_minutes)
 
-    # Sort the runs into minute buckets
-    leaderboard['minute_time'] = np.floor(leaderboard['e_primary_t'] / 60)
-
-    # Cutoff runs
-    lb_cutoff = leaderboard[leaderboard['minute_time'] <= minute_cutoff]
-
-    lb_minutes = lb_cutoff.groupby(['minute_time']).count()
-
-    if fill_minutes:
-        # Fill in missing minutes with 0
-        lb_times = range(int(lb_minutes.index.min()), int(lb_minutes.index.max()+1))
-        lb_minutes = lb_minutes.reindex(index=lb_times, fill_value=0)
-
-    # Build da graph
     curr_date = datetime.utcnow().strftime('%Y-%m-%d')
-    rp = lb_minutes['id'].plot.bar(title=f"{category_name} Minute Barriers", color=color)
-    rp.legend(['Players'])
-    rp.bar_label(rp.containers[0])
-    rp.annotate(f"Generated on {curr_date}", xy=(1.0,-0.2), xycoords="axes fraction", ha="right", va="center", fontsize=8)
-    plt.savefig(
-        CHART_PATH / f"{category_name}_minute_barriers_{curr_date}.png",
-        format="png",
-        bbox_inches="tight", 
-        transparent=transparent)
-    return rp
+    title = f"{category_name} Minute Barriers"
+    fig, ax = plt.subplots()
+    draw_minute_histogram(ax, minutes, title, color=color)
+    save_chart(
+        CHART_PATH / f"{category_name}_minute_barriers_{curr_date}.png", "minute_histogram", minutes, title,
+        lambda: fig, style={"color": color}, transparent=transparent)
+    return ax
 
 def plot_minute_histogram_with_new_runs(
         leaderboard,
@@ -183,55 +731,50 @@ def plot_minute_histogram_with_new_runs(
         color='C0',
         new_run_color='C1',
         transparent=False):
-    """Try out the new subplot-based process for creating graphs"""
-
-    # Sort the runs into minute buckets, both old and new
-    leaderboard['minute_time'] = np.floor(leaderboard['e_primary_t'] / 60)
-    leaderboard['last_month_minute_time'] = np.floor(leaderboard['e_primary_t_prior'] / 60).fillna(900000000.0)
-    leaderboard['new_minute_barrier'] = leaderboard['minute_time'] < leaderboard['last_month_minute_time']
-
-    # Cutoff runs
-    lb_cutoff = leaderboard[leaderboard['minute_time'] <= minute_cutoff]
-    lb_minutes = lb_cutoff.groupby(['minute_time', 'new_minute_barrier']).count().unstack('new_minute_barrier').fillna(0)
-
-    if fill_minutes:
-        # Fill in missing minutes with 0
-        lb_times = range(int(lb_minutes.index.min()), int(lb_minutes.index.max()+1))
-        lb_minutes = lb_minutes.reindex(index=lb_times, fill_value=0)
+    """Plot the minute histogram with the players who hit a new barrier since the leaderboard's
+    barrier_cutoff_date stacked on top (see get_leaderboard)"""
+    minutes = minute_barrier_counts(leaderboard, minute_cutoff, fill_minutes)
 
-    minutes = lb_minutes['id'].copy()
-    minutes['total'] = minutes[False] + minutes[True]
-    minutes['total'] = minutes['total'].fillna(0)
-
-    # Build da graph
     curr_date = datetime.utcnow().strftime('%Y-%m-%d')
+    title = f"{category_name} Minute Barriers"
+    style = {"color": color, "new_run_color": new_run_color}
     fig, ax = plt.subplots()
+    draw_minute_histogram(ax, minutes, title, **style)
+    save_chart(
+        CHART_PATH / f"{category_name}_minute_barriers_{curr_date}.png", "minute_histogram", minutes, title,
+        lambda: fig, style=style, transparent=transparent)
+    return ax
 
-    p = ax.bar(minutes.index.values, minutes['total'])
-    ax.bar(minutes.index.values, minutes[False], color=color, label="Older Runs")
-    ax.bar(
-        minutes.index.values,
-        minutes[True],
-        bottom=minutes[False],
-        color=new_run_color,
-        label="New Runs")
-    
-    ax.bar_label(p)
-    ax.legend()
-    plt.xticks(minutes.index.values, rotation=90)
 
-    plt.ylim(0, max(minutes['total']+2))
-    plt.xlim(min(minutes.index.values)-1, max(minutes.index.values)+1)
-    plt.title(f"{category_name} Minute Barriers")
-    plt.xlabel("Run Minutes")
-    plt.ylabel("Players")
+def plot_minute_histograms(
+        board_info: BoardInfo,
+        categories,
+        levels=("Full Game",),
+        barrier_cutoff_date=None,
+        minute_cutoff=1000,
+        fill_minutes=False,
+        color='C0',
+        new_run_color='C1',
+        transparent=False,
+        query=None):
+    """Plot minute histograms for every category x level given (names and short names), all counted
+    in one pass over the board's leaderboards (see get_barrier_histograms). Histograms that haven't
+    changed since they were last saved come out of the render cache (see chart_cache.py)"""
+    histograms = get_barrier_histograms(board_info, [barrier_cutoff_date], query=query)
+    curr_date = datetime.utcnow().strftime('%Y-%m-%d')
+    style = {"color": color, "new_run_color": new_run_color}
 
-    ax.annotate(f"Generated on {curr_date}", xy=(1.0,-0.15), xycoords="axes fraction", ha="right", va="center", fontsize=8)
-    plt.savefig(
-        CHART_PATH / f"{category_name}_minute_barriers_{curr_date}.png",
-        format="png",
-        bbox_inches="tight", 
-        transparent=transparent)
+    for category in categories:
+        for level in levels:
+            minutes = barrier_counts(histograms, category, level, barrier_cutoff_date, minute_cutoff, fill_minutes)
+            if not len(minutes):
+                continue
+            name = category if level == "Full Game" else f"{level} {category}"
+            title = f"{name} Minute Barriers"
+            save_chart(
+                CHART_PATH / f"{name}_minute_barriers_{curr_date}.png", "minute_histogram", minutes, title,
+                lambda: draw_chart(draw_minute_histogram, minutes, title, **style),
+                style=style, transparent=transparent)
 
 
 def plot_runs_per_week(
@@ -240,109 +783,61 @@ def plot_runs_per_week(
         end_date:datetime=None,
         il_split=False,
         save_fig_path=None,
-        transparent=False):
-    """Plot the number of runs per week, split by fullgame/IL"""
-    runs = board_info.runs
-    runs['run_week'] = pd.to_datetime(runs['date'].dt.to_period('W').dt.start_time)
-
-    if il_split:
-        runs_per_week = runs.groupby(['run_week', 'e_is_il'])['id'].count().unstack('e_is_il')
-    else:
-        runs_per_week = pd.DataFrame(runs.groupby('run_week')['id'].count())
-
-    runs_per_week["run_week"] = pd.to_datetime(runs_per_week.index)
-    runs_per_week['run_week_str'] = runs_per_week['run_week'].apply(lambda x: x.strftime('%b-%d'))
-
-    # Select down to the start/end dates provided
-    end_date = end_date or datetime.now()
-    mask = (runs_per_week['run_week'] >= start_date) & (runs_per_week['run_week'] <= end_date)
-    runs_per_week = runs_per_week.loc[mask]
-
-    curr_date = datetime.now(timezone.utc).strftime('%Y-%m-%d')
+        transparent=False,
+        query=None):
+    """Plot the number of runs per week, split by fullgame/IL, or by the query's split if it has one
+
+    Counts come from the run count cube (see get_run_counts), so the runs themselves don't need to be
+    loaded: get_full_game_local(..., columns=[]) is enough for saved boards"""
+    query = board_query(board_info, query)
+    runs_per_week = runs_per_week_counts(
+        get_run_counts(board_info, query), start_date, end_date, il_split,
+        split_by=query.split_by if query else None,
+        split_names=query.split_names if query else None)
 
     title = f"{board_info.game['names']['international']} Runs Per Week"
-    if il_split:
-        rp = runs_per_week.plot.bar(x="run_week_str", y=["Full Game", "IL"], stacked=True, title=title)
-    else:
-        rp = runs_per_week.plot.bar(x="run_week_str", y='id', title=title)
-        rp.legend(["Runs"])
-
-    rp.annotate(
-        f"Generated on {curr_date}",
-        xy=(1.0,-0.2),
-        xycoords="axes fraction",
-        ha="right",
-        va="center",
-        fontsize=8)
+    fig, ax = plt.subplots()
+    draw_runs_per_week(ax, runs_per_week, title)
 
     if save_fig_path:
-        plt.savefig(
-            save_fig_path,
-            format="png",
-            bbox_inches="tight",
-            transparent=transparent)
-    return rp
+        save_chart(save_fig_path, "runs_per_week", runs_per_week, title, lambda: fig, transparent=transparent)
+    return ax
 
 
-def plot_il_graph(transparent=False):
+def plot_il_graph(board_info: BoardInfo, categories=None, transparent=False, query=None):
     """Create a full stacked IL graph, ordered by total number of runs"""
-    il_run_count = get_il_counts()
-
-    # Use total number of runs to sort the graph
-    il_run_count.loc[:, ('total_runs')] = il_run_count['Any%']+il_run_count['All Toppins']+il_run_count['100%']
+    il_run_count = il_count_totals(get_il_counts(board_info, query), categories)
 
     # Get plottin'
     curr_date = datetime.utcnow().strftime('%Y-%m-%d')
-    x = il_run_count.sort_values('total_runs', ascending=False)[['Any%','All Toppins', '100%']].plot.bar(stacked=True, title="Runs Per Level")
-    x.annotate(
-        f"Generated on {curr_date}",
-        xy=(1.0,-0.5),
-        xycoords="axes fraction",
-        ha="right",
-        va="center",
-        fontsize=8)
-    plt.savefig(
-        CHART_PATH / f"runs_per_level_{curr_date}.png",
-        format="png",
-        bbox_inches="tight",
-        transparent=transparent)
-    return x
+    fig, ax = plt.subplots()
+    draw_stacked_counts(ax, il_run_count, "Runs Per Level")
+    save_chart(
+        CHART_PATH / f"runs_per_level_{curr_date}.png", "il_counts", il_run_count, "Runs Per Level",
+        lambda: fig, transparent=transparent)
+    return ax
 
 
-def plot_top_ils(transparent=False):
-    """Create graphs for the top levels per each IL category"""
-    il_counts = get_il_counts()
+def plot_top_ils(board_info: BoardInfo, categories=None, transparent=False, query=None):
+    """Create graphs for the top levels per each IL category. Graphs that haven't changed since they
+    were last saved come out of the render cache (see chart_cache.py)"""
+    il_counts = get_il_counts(board_info, query)
     curr_date = datetime.utcnow().strftime('%Y-%m-%d')
 
-    def plot_top_il_helper(category, color):
-        """Helper fun for plotting all 3 categories. Order by the category, take the top 10, label the bars, and add a date"""
-        top_runs = il_counts[category].sort_values(ascending=False)[:10].sort_values(ascending=True).plot.barh(title=f"Top {category} ILs", color=color)
-        top_runs.bar_label(top_runs.containers[0])
-        top_runs.annotate(
-            f"Generated on {curr_date}",
-            xy=(1.0,-0.1),
-            xycoords="axes fraction",
-            ha="right",
-            va="center",
-            fontsize=8)
-
-        # Save the figure and close it so the next one doesn't stack
-        plt.savefig(CHART_PATH / f"Top_IL_{category}_{curr_date}.png",
-                    format="png",
-                    bbox_inches="tight",
-                    transparent=transparent)
-        plt.close()
-
-    plot_top_il_helper("Any%", "C0")
-    plot_top_il_helper("All Toppins", "C1")
-    plot_top_il_helper("100%", "C2")
-
-
-def plot_single_il(category, color):
+    for i, category in enumerate(categories if categories is not None else il_counts.columns):
+        counts = top_counts(il_counts[category])
+        title = f"Top {category} ILs"
+        save_chart(
+            CHART_PATH / f"Top_IL_{category}_{curr_date}.png", "top_ils", counts, title,
+            lambda: draw_chart(draw_top_counts, counts, title, color=f"C{i}"),
+            style={"color": f"C{i}"}, transparent=transparent)
+
+
+def plot_single_il(board_info: BoardInfo, category, color):
     """Generate a graph for the given IL category
     
     Largely deprecated in favor of plot_top_ils"""
-    il_run_count = get_il_counts()
+    il_run_count = get_il_counts(board_info)
     single_graph = il_run_count.sort_values(category, ascending=False)[category].plot.bar(color=color)
 
     # Add a legend and label the bars
@@ -352,37 +847,21 @@ def plot_single_il(category, color):
     return single_graph
 
 
-def plot_top_submitters(transparent=False):
-    """Create graphs for both top IL and top fullgame submitters"""
-    runs = join_all_data(filter_users=True)
-
-    # Group runs by runners and count up ILs/Fullgame runs
-    runner_count = runs.groupby(["e_runner_name", "e_is_il"])["id_runs"].count().unstack("e_is_il").fillna(0)
-    runner_count.rename({True: "IL", False: "Full Game"}, axis=1, inplace=True)
-    runner_count.loc[:, ("total_count")] = runner_count["IL"] + runner_count["Full Game"]
+def plot_top_submitters(board_info: BoardInfo, transparent=False, query=None):
+    """Create graphs for both top IL and top fullgame submitters. Graphs that haven't changed since
+    they were last saved come out of the render cache (see chart_cache.py)"""
+    runner_count = get_submitter_counts(board_info, query)
+    curr_date = datetime.utcnow().strftime('%Y-%m-%d')
 
-    def plot_top_submitters_helper(count_field, title, color="C0"):
-        rc = runner_count[count_field].sort_values(ascending=False)[:10]\
-            .sort_values(ascending=True).plot.barh(title=title, color=color)
-        curr_date = datetime.utcnow().strftime('%Y-%m-%d')
-        rc.bar_label(rc.containers[0])
-        rc.annotate(
-            f"Generated on {curr_date}",
-            xy=(1.0,-0.1),
-            xycoords="axes fraction",
-            ha="right",
-            va="center",
-            fontsize=8)
-        plt.savefig(
-            CHART_PATH / f"{title}_{curr_date}.png",
-            format="png",
-            bbox_inches="tight",
-            transparent=transparent)
-        plt.close()
-
-    plot_top_submitters_helper("Full Game", title="Top Full Game Submitters", color="C1")
-    plot_top_submitters_helper("IL", title="Top IL Submitters", color="C2")
-    plot_top_submitters_helper("total_count", title="Top Submitters", color="C0")
+    for count_field, title, color in (
+            ("Full Game", "Top Full Game Submitters", "C1"),
+            ("IL", "Top IL Submitters", "C2"),
+            ("total_count", "Top Submitters", "C0")):
+        counts = top_counts(runner_count[count_field])
+        save_chart(
+            CHART_PATH / f"{title}_{curr_date}.png", "top_submitters", counts, title,
+            lambda: draw_chart(draw_top_counts, counts, title, color=color),
+            style={"color": color}, transparent=transparent)
 
 
 def plot_long_standing_wrs(
@@ -393,34 +872,13 @@ def plot_long_standing_wrs(
         legend=True,
         transparent=False):
     """Given a list of WRs and how long they've stood, plot 'em"""
-    # Create a title col out of the other cols
-    format_str = "{e_runner_name}'s {Category}\n({date} to {next_wr_date})'"\
-         if full_game else "{e_runner_name}'s {e_short_name} {Category}\n({date} to {next_wr_date})'"
-    wr_list["Title"] = wr_list.apply(
-        lambda x: format_str\
-            .format(
-                e_runner_name=x.e_runner_name,
-                e_short_name=x.e_short_name,
-                Category=x.Categories,
-                date=x.date.strftime("%y-%m-%d"),
-                next_wr_date="Now" if x.is_active else x.next_wr_date.strftime("%y-%m-%d")),
-            axis=1)
-
-    wr_list["Days"] = wr_list["stood_for"]
+    wr_bars = long_standing_wr_bars(wr_list, full_game)
 
     curr_date = datetime.utcnow().strftime('%Y-%m-%d')
-
-    lwr = wr_list[:10].sort_values("stood_for", ascending=True).plot.barh(x='Title', y='Days', title=title, color=color, legend=legend)
-    lwr.bar_label(lwr.containers[0])
-    lwr.annotate(
-        f"Generated on {curr_date}",
-        xy=(1.0,-0.1),
-        xycoords="axes fraction",
-        ha="right",
-        va="center",
-        fontsize=8)
-    plt.savefig(
-        CHART_PATH / f"{title}_{curr_date}.png",
-        format="png",
-        bbox_inches="tight",
-        transparent=transparent)
\ No newline at end of file
+    style = {"color": color, "legend": legend}
+    fig, ax = plt.subplots()
+    draw_long_standing_wrs(ax, wr_bars, title, **style)
+    save_chart(
+        CHART_PATH / f"{title}_{curr_date}.png", "long_standing_wrs", wr_bars, title,
+        lambda: fig, style=style, transparent=transparent)
+    return ax
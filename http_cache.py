@@ -0,0 +1,169 @@
+"""On-disk cache for SRC API responses, so metadata that barely ever changes doesn't get re-downloaded
+every time a notebook is re-run.
+
+Responses are stored as JSON files under CACHE_PATH, keyed by the url and query params. How long an entry
+is trusted without asking SRC again depends on the endpoint (see CACHE_TTLS), and stale entries get
+revalidated with ETag/Last-Modified so an unchanged response costs a 304 instead of a full download."""
+
+import contextvars
+import hashlib
+import json
+import os
+import time
+from contextlib import contextmanager
+from urllib.parse import urlparse
+
+from config import CACHE_PATH, SRC_API_URL
+
+# How long (in seconds) cached responses are used without revalidating, by endpoint. Anything not listed
+# here isn't cached: runs change constantly and are better handled by sync_runs, and users have their
+# own store (see utils.get_user_names)
+CACHE_TTLS = {
+    "games": 24 * 60 * 60,
+    "categories": 24 * 60 * 60,
+    "levels": 24 * 60 * 60,
+    "variables": 24 * 60 * 60,
+    "platforms": 30 * 24 * 60 * 60,
+    "regions": 30 * 24 * 60 * 60,
+    "leaderboards": 60 * 60,
+}
+
+# The API routes that get cached, and which CACHE_TTLS endpoint each one is. * matches any one id.
+# Anything else (e.g. /games/{id}/records, /games/{id}/derived-games) isn't cached
+CACHED_ROUTES = {
+    ("games", "*"): "games",
+    ("games", "*", "categories"): "categories",
+    ("games", "*", "levels"): "levels",
+    ("games", "*", "variables"): "variables",
+    ("categories", "*"): "categories",
+    ("categories", "*", "variables"): "variables",
+    ("levels", "*"): "levels",
+    ("levels", "*", "categories"): "categories",
+    ("levels", "*", "variables"): "variables",
+    ("variables", "*"): "variables",
+    ("platforms",): "platforms",
+    ("platforms", "*"): "platforms",
+    ("regions",): "regions",
+    ("regions", "*"): "regions",
+    ("leaderboards", "*", "category", "*"): "leaderboards",
+    ("leaderboards", "*", "level", "*", "*"): "leaderboards",
+}
+API_PATH = urlparse(SRC_API_URL).path
+
+# In offline mode, requests are only ever answered from the cache. Can be turned on for a whole session
+# with SRC_OFFLINE=1, or for a block of code with offline_mode(). It's a context variable so a block
+# only affects its own thread (and threads it starts with utils.ContextThreadPoolExecutor)
+OFFLINE = contextvars.ContextVar("src_offline", default=os.environ.get("SRC_OFFLINE") == "1")
+
+
+class CacheMiss(Exception):
+    """Raised when a request can't be answered in offline mode because it was never cached"""
+
+
+@contextmanager
+def offline_mode(offline=True):
+    """Only serve requests from the cache inside this block"""
+    token = OFFLINE.set(offline)
+    try:
+        yield
+    finally:
+        OFFLINE.reset(token)
+
+
+def is_offline():
+    return OFFLINE.get()
+
+
+# Inside revalidate(), cached entries are never trusted as they are: SRC gets asked whether they changed
+REVALIDATE = contextvars.ContextVar("src_revalidate", default=False)
+
+
+@contextmanager
+def revalidate():
+    """Check every cached response with SRC inside this block, for when the data has to be current
+    (e.g. leaderboard snapshots). Unchanged responses still only cost a 304"""
+    token = REVALIDATE.set(True)
+    try:
+        yield
+    finally:
+        REVALIDATE.reset(token)
+
+
+def cache_ttl(url):
+    """Figure out which endpoint a url is for and return its TTL, or None if it shouldn't be cached.
+
+    The whole path has to match one of CACHED_ROUTES, so sub-resources of a cached resource (like a
+    game's records) aren't cached just because they start with /games/{id}."""
+    path = urlparse(url).path
+    if path.startswith(API_PATH):
+        path = path[len(API_PATH):]
+    segments = tuple(segment for segment in path.split("/") if segment)
+
+    for route, endpoint in CACHED_ROUTES.items():
+        if len(route) == len(segments) and all(part in ("*", segment) for part, segment in zip(route, segments)):
+            return CACHE_TTLS[endpoint]
+    return None
+
+
+def cache_key(url, params=None):
+    """Hash the url and params into a filename-safe key"""
+    raw_key = json.dumps([url, sorted((params or {}).items())], default=str)
+    return hashlib.sha256(raw_key.encode("utf-8")).hexdigest()
+
+
+def load_entry(url, params=None):
+    """Load a cached response for url/params, or None if there isn't one"""
+    entry_path = CACHE_PATH / f"{cache_key(url, params)}.json"
+    if not entry_path.exists():
+        return None
+    with open(entry_path, "r", encoding="utf-8") as entry_file:
+        return json.load(entry_file)
+
+
+def save_entry(url, params, body, headers=None):
+    """Cache a response body along with the validators SRC sent for it"""
+    headers = headers or {}
+    entry = {
+        "url": url,
+        "params": params,
+        "fetched_at": time.time(),
+        "etag": headers.get("ETag"),
+        "last_modified": headers.get("Last-Modified"),
+        "body": body,
+    }
+    CACHE_PATH.mkdir(parents=True, exist_ok=True)
+    entry_path = CACHE_PATH / f"{cache_key(url, params)}.json"
+    tmp_path = entry_path.with_name(f".{entry_path.name}.tmp")
+    with open(tmp_path, "w", encoding="utf-8") as entry_file:
+        json.dump(entry, entry_file)
+    os.replace(tmp_path, entry_path)
+    return entry
+
+
+def touch_entry(url, params, entry):
+    """Mark a cached response as fresh again after SRC told us it hasn't changed"""
+    return save_entry(url, params, entry["body"], {
+        "ETag": entry.get("etag"),
+        "Last-Modified": entry.get("last_modified"),
+    })
+
+
+def is_fresh(entry, ttl):
+    """Check whether a cached entry can still be used without revalidating"""
+    return ttl is not None and not REVALIDATE.get() and time.time() - entry["fetched_at"] < ttl
+
+
+def revalidation_headers(entry):
+    """Build conditional request headers from a cached entry's validators"""
+    headers = {}
+    if entry.get("etag"):
+        headers["If-None-Match"] = entry["etag"]
+    if entry.get("last_modified"):
+        headers["If-Modified-Since"] = entry["last_modified"]
+    return headers
+
+
+def clear_cache():
+    """Delete every cached response"""
+    for entry_path in CACHE_PATH.glob("*.json"):
+        entry_path.unlink()
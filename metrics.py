@@ -0,0 +1,220 @@
+"""Instrumentation for SRC API requests, so when a refresh is slow you can tell whether the time went
+to latency, throttling, retries, or parsing.
+
+utils.api_get hands a RequestRecord for every request (cache hits included) to every hook in
+REQUEST_HOOKS. record_requests() is the easy way to collect them for a block of code, and
+summarize/print_summary turn them into a report. Records can be saved as JSON lines
+(write_jsonl) or as Prometheus text (write_prometheus) to track API performance over time."""
+
+import contextvars
+import json
+import threading
+from contextlib import contextmanager
+from dataclasses import asdict, dataclass, field
+from typing import Dict, Optional
+from urllib.parse import urlparse
+
+# Callables that get every RequestRecord, see add_request_hook/record_requests
+REQUEST_HOOKS = []
+REQUEST_HOOKS_LOCK = threading.Lock()
+
+# Time the current thread's request has spent sleeping in retry backoff, added to by utils.SRCRetry
+RETRY_SLEEP = threading.local()
+
+# Labels (eg. board=...) attached to every request made in the current context, see request_labels
+REQUEST_LABELS = contextvars.ContextVar("request_labels", default={})
+
+THROTTLE_STATUS_CODES = (420, 429)
+
+
+@dataclass
+class RequestRecord:
+    url: str
+    endpoint: str
+    # HTTP status, None if the request never got a response
+    status: Optional[int]
+    # "hit" (served from the response cache), "revalidated" (a 304), or None if SRC sent a body
+    cache: Optional[str]
+    started: float
+    # Seconds spent in the request itself (including retries), waiting on the rate limiter,
+    # sleeping in retry backoff, and parsing JSON
+    latency: float = 0.0
+    limiter_wait: float = 0.0
+    retry_sleep: float = 0.0
+    parse_time: float = 0.0
+    bytes: int = 0
+    retries: int = 0
+    throttles: int = 0
+    error: Optional[str] = None
+    labels: Dict = field(default_factory=dict)
+
+
+def endpoint_name(url):
+    """Short name for a url's endpoint, eg. runs, games, or games/categories"""
+    segments = [segment for segment in urlparse(url).path.split("/") if segment]
+    if "v1" in segments:
+        segments = segments[segments.index("v1") + 1:]
+    # Drop ids, which is every other segment after the first resource name
+    return "/".join(segments[::2]) or url
+
+
+def add_request_hook(hook):
+    with REQUEST_HOOKS_LOCK:
+        REQUEST_HOOKS.append(hook)
+
+
+def remove_request_hook(hook):
+    with REQUEST_HOOKS_LOCK:
+        if hook in REQUEST_HOOKS:
+            REQUEST_HOOKS.remove(hook)
+
+
+def emit(record: RequestRecord):
+    """Hand a finished request's record to every hook"""
+    with REQUEST_HOOKS_LOCK:
+        hooks = list(REQUEST_HOOKS)
+    for hook in hooks:
+        hook(record)
+
+
+def reset_retry_sleep():
+    RETRY_SLEEP.seconds = 0.0
+
+
+def add_retry_sleep(seconds):
+    RETRY_SLEEP.seconds = getattr(RETRY_SLEEP, "seconds", 0.0) + seconds
+
+
+def retry_sleep():
+    return getattr(RETRY_SLEEP, "seconds", 0.0)
+
+
+@contextmanager
+def request_labels(**labels):
+    """Label every request made inside this block. Threads started with utils.ContextThreadPoolExecutor
+    inside the block carry the labels with them"""
+    token = REQUEST_LABELS.set({**REQUEST_LABELS.get(), **labels})
+    try:
+        yield
+    finally:
+        REQUEST_LABELS.reset(token)
+
+
+@contextmanager
+def record_requests(**labels):
+    """Collect the records of every request made while this block runs (from any thread) into a list.
+    If labels are given, only requests with those labels (see request_labels) are collected"""
+    records = []
+    lock = threading.Lock()
+
+    def hook(record):
+        if any(record.labels.get(key) != value for key, value in labels.items()):
+            return
+        with lock:
+            records.append(record)
+
+    add_request_hook(hook)
+    try:
+        yield records
+    finally:
+        remove_request_hook(hook)
+
+
+def percentile(values, fraction):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+def summarize(records):
+    """Roll request records up into totals, overall and per endpoint"""
+    def rollup(records):
+        network = [record for record in records if record.cache != "hit"]
+        latencies = [record.latency for record in network]
+        statuses = {}
+        for record in records:
+            status = "cache" if record.cache == "hit" else str(record.status)
+            statuses[status] = statuses.get(status, 0) + 1
+        return {
+            "requests": len(records),
+            "network_requests": len(network),
+            "statuses": statuses,
+            "errors": sum(record.error is not None for record in records),
+            "bytes": sum(record.bytes for record in records),
+            "retries": sum(record.retries for record in records),
+            "throttles": sum(record.throttles for record in records),
+            "latency_total": sum(latencies),
+            "latency_p50": percentile(latencies, 0.5),
+            "latency_p95": percentile(latencies, 0.95),
+            "latency_max": max(latencies, default=0.0),
+            "limiter_wait": sum(record.limiter_wait for record in records),
+            "retry_sleep": sum(record.retry_sleep for record in records),
+            "parse_time": sum(record.parse_time for record in records),
+        }
+
+    endpoints = sorted({record.endpoint for record in records})
+    return {
+        **rollup(records),
+        "endpoints": {
+            endpoint: rollup([record for record in records if record.endpoint == endpoint])
+            for endpoint in endpoints},
+    }
+
+
+def print_summary(records, title="API requests"):
+    summary = summarize(records)
+    print(
+        f"{title}: {summary['requests']} requests ({summary['network_requests']} over the network), "
+        f"{summary['bytes'] / 1e6:.1f} MB, statuses {summary['statuses']}")
+    print(
+        f"  latency {summary['latency_total']:.1f}s total (p50 {summary['latency_p50']:.2f}s, "
+        f"p95 {summary['latency_p95']:.2f}s, max {summary['latency_max']:.2f}s), "
+        f"rate limit waits {summary['limiter_wait']:.1f}s, "
+        f"{summary['retries']} retries ({summary['throttles']} throttled) sleeping {summary['retry_sleep']:.1f}s, "
+        f"parsing {summary['parse_time']:.1f}s")
+    for endpoint, endpoint_summary in summary["endpoints"].items():
+        print(
+            f"  {endpoint}: {endpoint_summary['requests']} requests, "
+            f"{endpoint_summary['latency_total']:.1f}s latency, {endpoint_summary['throttles']} throttled")
+    return summary
+
+
+def write_jsonl(records, path, **labels):
+    """Append request records to a JSON-lines file, one request per line, tagged with any labels (eg. board=...)"""
+    with open(path, "a") as jsonl_file:
+        for record in records:
+            jsonl_file.write(json.dumps({**labels, **asdict(record)}) + "\n")
+
+
+def prometheus_text(records, **labels):
+    """Summarize request records in the Prometheus text exposition format, per endpoint"""
+    base_labels = "".join(f',{key}="{value}"' for key, value in sorted(labels.items()))
+    metrics = [
+        ("src_api_requests_total", "counter", "requests", "API requests, including cache hits"),
+        ("src_api_errors_total", "counter", "errors", "API requests that failed"),
+        ("src_api_bytes_total", "counter", "bytes", "Response bytes downloaded"),
+        ("src_api_retries_total", "counter", "retries", "Retried requests"),
+        ("src_api_throttles_total", "counter", "throttles", "420/429 throttle responses"),
+        ("src_api_latency_seconds_total", "counter", "latency_total", "Time spent in requests"),
+        ("src_api_latency_p95_seconds", "gauge", "latency_p95", "95th percentile request latency"),
+        ("src_api_limiter_wait_seconds_total", "counter", "limiter_wait", "Time spent waiting on the rate limiter"),
+        ("src_api_retry_sleep_seconds_total", "counter", "retry_sleep", "Time spent in retry backoff"),
+        ("src_api_parse_seconds_total", "counter", "parse_time", "Time spent parsing JSON"),
+    ]
+    endpoint_summaries = summarize(records)["endpoints"]
+
+    lines = []
+    for name, metric_type, key, help_text in metrics:
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {metric_type}")
+        for endpoint, endpoint_summary in endpoint_summaries.items():
+            lines.append(f'{name}{{endpoint="{endpoint}"{base_labels}}} {endpoint_summary[key]}')
+    return "\n".join(lines) + "\n"
+
+
+def write_prometheus(records, path, **labels):
+    """Write prometheus_text to path, eg. for node_exporter's textfile collector"""
+    tmp_path = path.with_name(f".{path.name}.tmp")
+    tmp_path.write_text(prometheus_text(records, **labels))
+    tmp_path.replace(path)
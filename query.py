@@ -0,0 +1,326 @@
+"""A small query language for picking which runs a graph looks at, and what to split them by:
+
+    category in [Any%, 100%] and level = "Full Game" and date >= 2024-01-01 split by platform
+
+compile_query turns it into a pyarrow expression over the saved run columns, which read_runs pushes
+down into the parquet scan, so row groups and rows that don't match are never turned into pandas rows.
+
+Fields are run columns (see enrich_data.RUN_SCHEMA), the friendlier names in FIELD_ALIASES, or the
+name of one of the board's variables. Categories can be given by name or id, levels by name, short
+name, or id ("Full Game" for full game runs), and variable values by label or id. Values with spaces
+need quotes. Comparisons are =, !=, <, <=, >, >=, in [...] and not in [...], combined with and, or,
+not, and parentheses. null matches missing values, and times can be written as h:mm:ss."""
+
+import re
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+
+from enrich_data import RUN_SCHEMA, VALUE_COLUMN_PREFIX
+from run_index import variable_values
+
+
+FIELD_ALIASES = {
+    'status': 'e_status_judgment',
+    'runner': 'e_runner_name',
+    'player': 'e_pid',
+    'examiner': 'e_examiner',
+    'verified': 'e_verify_date',
+    'time': 'e_primary_t',
+    'platform': 'e_platform',
+    'region': 'e_region',
+    'emulated': 'e_emulated',
+    'type': 'e_is_il',
+    'rat': 'e_is_rat',
+}
+
+TOKEN_PATTERN = re.compile(r'''\s*(?:(?P<string>"[^"]*"|'[^']*')|(?P<op><=|>=|!=|==|=|<|>|\[|\]|\(|\)|,)|(?P<word>[^\s\[\](),=<>!"']+))''')
+COMPARISONS = {
+    '=': lambda column, value: column == value,
+    '==': lambda column, value: column == value,
+    '!=': lambda column, value: column != value,
+    '<': lambda column, value: column < value,
+    '<=': lambda column, value: column <= value,
+    '>': lambda column, value: column > value,
+    '>=': lambda column, value: column >= value,
+}
+
+
+@dataclass
+class RunQuery:
+    text: str
+    # Filter over the saved run columns, None if the query only splits
+    filter: Optional[pc.Expression]
+    # Run column to split by, and readable names for its values (category/level/variable value names)
+    split_by: Optional[str] = None
+    split_names: Dict = field(default_factory=dict)
+
+    @property
+    def key(self):
+        """Something hashable that's the same for queries that pick the same runs, for caches"""
+        return (str(self.filter), self.split_by)
+
+    @property
+    def split_columns(self) -> List[str]:
+        return [self.split_by] if self.split_by else []
+
+
+def tokenize(text):
+    tokens = []
+    position = 0
+    text = text.strip()
+    while position < len(text):
+        match = TOKEN_PATTERN.match(text, position)
+        if match is None or match.end() == position:
+            raise ValueError(f"Can't parse query at {text[position:]!r}")
+        kind = match.lastgroup
+        value = match.group(kind)
+        if kind == 'string':
+            tokens.append(('value', value[1:-1]))
+        elif kind == 'op':
+            tokens.append(('op', value))
+        elif value.lower() in ('and', 'or', 'not', 'in', 'split', 'by'):
+            tokens.append(('keyword', value.lower()))
+        else:
+            tokens.append(('value', value))
+        position = match.end()
+    return tokens
+
+
+class QueryParser:
+    """Recursive descent parser from tokens to nested tuples:
+    ("and"/"or", left, right), ("not", term), ("compare", field, op, value), ("in", field, values)"""
+
+    def __init__(self, tokens):
+        self.tokens = tokens
+        self.position = 0
+
+    def peek(self, offset=0):
+        position = self.position + offset
+        return self.tokens[position] if position < len(self.tokens) else (None, None)
+
+    def take(self, kind=None, value=None):
+        token = self.peek()
+        if token == (None, None) or (kind and token[0] != kind) or (value and token[1] != value):
+            raise ValueError(f"Expected {value or kind} in query, got {token[1]!r}")
+        self.position += 1
+        return token[1]
+
+    def parse(self):
+        expression = None
+        if self.peek() != ('keyword', 'split'):
+            expression = self.parse_or()
+        split_by = None
+        if self.peek() == ('keyword', 'split'):
+            self.take('keyword', 'split')
+            self.take('keyword', 'by')
+            split_by = self.take('value')
+        if self.peek() != (None, None):
+            raise ValueError(f"Unexpected {self.peek()[1]!r} in query")
+        return expression, split_by
+
+    def parse_or(self):
+        expression = self.parse_and()
+        while self.peek() == ('keyword', 'or'):
+            self.take()
+            expression = ('or', expression, self.parse_and())
+        return expression
+
+    def parse_and(self):
+        expression = self.parse_not()
+        while self.peek() == ('keyword', 'and'):
+            self.take()
+            expression = ('and', expression, self.parse_not())
+        return expression
+
+    def parse_not(self):
+        if self.peek() == ('keyword', 'not'):
+            self.take()
+            return ('not', self.parse_not())
+        if self.peek() == ('op', '('):
+            self.take()
+            expression = self.parse_or()
+            self.take('op', ')')
+            return expression
+        return self.parse_comparison()
+
+    def parse_comparison(self):
+        field_name = self.take('value')
+        if self.peek() == ('keyword', 'not') and self.peek(1) == ('keyword', 'in'):
+            self.take()
+            self.take()
+            return ('not', ('in', field_name, self.parse_list()))
+        if self.peek() == ('keyword', 'in'):
+            self.take()
+            return ('in', field_name, self.parse_list())
+        op = self.take('op')
+        if op not in COMPARISONS:
+            raise ValueError(f"Unknown comparison {op!r} in query")
+        return ('compare', field_name, op, self.take('value'))
+
+    def parse_list(self):
+        self.take('op', '[')
+        values = []
+        while self.peek() != ('op', ']'):
+            values.append(self.take('value'))
+            if self.peek() == ('op', ','):
+                self.take()
+        self.take('op', ']')
+        return values
+
+
+def parse_seconds(value):
+    """Seconds from 83.5, 1:23.5, or 1:01:23.5"""
+    seconds = 0.0
+    for part in str(value).split(':'):
+        seconds = seconds * 60 + float(part)
+    return seconds
+
+
+class QueryCompiler:
+    """Resolves query fields and values against a board's metadata and builds the Arrow expression"""
+
+    def __init__(self, categories=None, levels=None, variables=None):
+        self.category_ids = {}
+        self.category_names = {}
+        if categories is not None and len(categories):
+            for category in pd.DataFrame(categories).to_dict('records'):
+                self.category_ids[category['name']] = category['id']
+                self.category_names[category['id']] = category['name']
+
+        self.level_ids = {}
+        self.level_names = {}
+        if levels is not None and len(levels):
+            for level in pd.DataFrame(levels).to_dict('records'):
+                self.level_ids[level['name']] = level['id']
+                short_name = level.get('e_short_name') or level['name']
+                self.level_ids[short_name] = level['id']
+                self.level_names[level['id']] = short_name
+
+        self.variable_ids = {}
+        self.variable_labels = {}
+        if variables is not None and len(variables):
+            for variable in pd.DataFrame(variables).to_dict('records'):
+                self.variable_ids[variable['name']] = variable['id']
+                self.variable_labels[variable['id']] = variable_values(variable)
+
+    def column(self, field_name):
+        """The run column a query field refers to"""
+        if field_name in FIELD_ALIASES:
+            return FIELD_ALIASES[field_name]
+        if field_name in RUN_SCHEMA.names or field_name.startswith(VALUE_COLUMN_PREFIX):
+            return field_name
+        if field_name in self.variable_ids:
+            return f"{VALUE_COLUMN_PREFIX}{self.variable_ids[field_name]}"
+        raise ValueError(f"Unknown query field {field_name!r}")
+
+    def value(self, column, value):
+        """Convert a query value to what's saved in column, None for null"""
+        if value.lower() in ('null', 'none'):
+            return None
+        if column == 'category':
+            return self.category_ids.get(value, value)
+        if column == 'level':
+            return None if value == "Full Game" else self.level_ids.get(value, value)
+        if column.startswith(VALUE_COLUMN_PREFIX):
+            labels = self.variable_labels.get(column[len(VALUE_COLUMN_PREFIX):], {})
+            return {label: value_id for value_id, label in labels.items()}.get(value, value)
+
+        field_type = RUN_SCHEMA.field(column).type
+        if pa.types.is_timestamp(field_type):
+            timestamp = pd.Timestamp(value)
+            if field_type.tz is not None and timestamp.tzinfo is None:
+                timestamp = timestamp.tz_localize(field_type.tz)
+            return timestamp
+        if pa.types.is_floating(field_type):
+            return parse_seconds(value)
+        if pa.types.is_integer(field_type):
+            return int(value)
+        if pa.types.is_boolean(field_type):
+            return value.lower() in ('true', 'yes', '1')
+        return value
+
+    def expression(self, node):
+        kind = node[0]
+        if kind == 'and':
+            return self.expression(node[1]) & self.expression(node[2])
+        if kind == 'or':
+            return self.expression(node[1]) | self.expression(node[2])
+        if kind == 'not':
+            if node[1][0] == 'in':
+                return self.not_in(node[1])
+            return ~self.expression(node[1])
+
+        column = self.column(node[1])
+        run_field = pc.field(column)
+        if kind == 'in':
+            values = [self.value(column, value) for value in node[2]]
+            present = [value for value in values if value is not None]
+            matched = run_field.isin(present)
+            return (matched | run_field.is_null()) if None in values else matched
+
+        op, value = node[2], self.value(column, node[3])
+        if value is None:
+            if op in ('=', '=='):
+                return run_field.is_null()
+            if op == '!=':
+                return run_field.is_valid()
+            raise ValueError(f"Can't compare {node[1]} {op} null")
+        if op == '!=':
+            # Missing values aren't equal to anything
+            return (run_field != value) | run_field.is_null()
+        return COMPARISONS[op](run_field, value)
+
+    def not_in(self, node):
+        column = self.column(node[1])
+        run_field = pc.field(column)
+        values = [self.value(column, value) for value in node[2]]
+        present = [value for value in values if value is not None]
+        if None in values:
+            return run_field.is_valid() & ~run_field.isin(present)
+        return ~run_field.isin(present) | run_field.is_null()
+
+    def split_names(self, column):
+        if column == 'category':
+            return dict(self.category_names)
+        if column == 'level':
+            return dict(self.level_names)
+        if column.startswith(VALUE_COLUMN_PREFIX):
+            return dict(self.variable_labels.get(column[len(VALUE_COLUMN_PREFIX):], {}))
+        return {}
+
+
+def compile_query(text, categories=None, levels=None, variables=None):
+    """Compile a query into a RunQuery, resolving names with the board's categories, levels, and variables"""
+    expression, split_field = QueryParser(tokenize(text)).parse()
+    compiler = QueryCompiler(categories, levels, variables)
+    split_by = compiler.column(split_field) if split_field else None
+    return RunQuery(
+        text=text,
+        filter=compiler.expression(expression) if expression is not None else None,
+        split_by=split_by,
+        split_names=compiler.split_names(split_by) if split_by else {})
+
+
+def combine_filters(filters, query: Optional[RunQuery]):
+    """AND a query's filter onto read_runs filters (a run_filters list, an expression, or None)"""
+    if query is None or query.filter is None:
+        return filters
+    if filters is None:
+        return query.filter
+    if not isinstance(filters, pc.Expression):
+        filters = pq.filters_to_expression(filters)
+    return filters & query.filter
+
+
+def filter_runs(runs, filters):
+    """Apply read_runs filters to runs that are already in memory"""
+    if filters is None:
+        return runs
+    if not isinstance(filters, pc.Expression):
+        filters = pq.filters_to_expression(filters)
+    return pa.Table.from_pandas(runs, preserve_index=False).filter(filters).to_pandas()
@@ -0,0 +1,213 @@
+"""World record progressions and leaderboard history: which runs were WR when they were set, when
+each record got broken, what every leaderboard looked like on any date, and how many players sit
+at each minute barrier.
+
+Everything here works on whole run tables at once (groupby cummin and masks), so the progression
+for every category/level/subcategory on a board comes out of one pass."""
+
+import numpy as np
+import pandas as pd
+
+from enrich_data import VALUE_COLUMN_PREFIX
+
+
+# Runs compete for a record with other runs in the same category and level (NaN for full game).
+# Subcategory variables split that further, see subcategory_columns
+WR_GROUP_COLUMNS = ['category', 'level']
+WR_SORT_COLUMNS = ['date', 'submitted']
+
+# Columns wr_progression adds on top of the run columns
+PROGRESSION_COLUMNS = ['prev_wr_t', 'is_tie', 'record_no', 'wr_set', 'wr_broken', 'is_active']
+
+
+def subcategory_columns(variables):
+    """value_ columns for the board's subcategory variables, the ones that get their own leaderboards"""
+    if variables is None or len(variables) == 0:
+        return []
+    variables = pd.DataFrame(variables)
+    if 'is-subcategory' not in variables:
+        return []
+    is_subcategory = variables['is-subcategory'].fillna(False).astype(bool)
+    return [f"{VALUE_COLUMN_PREFIX}{var_id}" for var_id in variables.loc[is_subcategory, 'id']]
+
+
+def wr_progression(runs, group_columns=None, time_column='e_primary_t'):
+    """Get every run that was a WR (or tied one) when it happened, for every group at once.
+
+    runs is any table of runs with group_columns (defaults to WR_GROUP_COLUMNS), time_column, and
+    a date. Runs are ordered by date, then submission time, and compared to the best time in their
+    group before them. The runs that come back have:
+
+    - prev_wr_t: the record they beat or tied, NaN for the first run in a group
+    - is_tie: matched the record instead of beating it
+    - record_no: which record in the group this is, ties share the number of the record they tied
+    - wr_set/wr_broken: when the record was set and when a faster run beat it (ties don't break
+      records), wr_broken is NaT for records that still stand
+    - is_active: the record still stands
+    """
+    group_columns = list(group_columns or WR_GROUP_COLUMNS)
+    sort_columns = [column for column in WR_SORT_COLUMNS if column in runs.columns]
+
+    runs = runs[runs[time_column].notna()].sort_values(sort_columns, kind='stable')
+    if not len(runs):
+        return runs.assign(**{column: pd.Series(dtype=object) for column in PROGRESSION_COLUMNS})
+
+    group_id = runs.groupby(group_columns, dropna=False, observed=True, sort=False).ngroup()
+    times = runs[time_column]
+
+    # Best time in the group before each run, so runs at or under it were WR when they were set
+    prev_wr_t = times.groupby(group_id).cummin().groupby(group_id).shift()
+    improved = prev_wr_t.isna() | (times < prev_wr_t)
+    tied = times == prev_wr_t
+    is_wr = improved | tied
+
+    wr_runs = runs[is_wr].copy()
+    wr_group = group_id[is_wr]
+    wr_runs['prev_wr_t'] = prev_wr_t[is_wr]
+    wr_runs['is_tie'] = tied[is_wr]
+    wr_runs['record_no'] = improved[is_wr].astype(int).groupby(wr_group).cumsum()
+    wr_runs['wr_set'] = wr_runs['date']
+
+    # A record gets broken on the date the next record in its group is set, then ties pick up the
+    # broken date of the record they tied
+    record_starts = ~wr_runs['is_tie']
+    next_record_set = wr_runs.loc[record_starts, 'date'].groupby(wr_group[record_starts]).shift(-1)
+    wr_runs['wr_broken'] = next_record_set.reindex(wr_runs.index)
+    wr_runs['wr_broken'] = wr_runs.groupby([wr_group, wr_runs['record_no']])['wr_broken'].transform('first')
+    wr_runs['is_active'] = wr_runs['wr_broken'].isna()
+
+    return wr_runs
+
+
+def update_wr_progression(progression, new_runs, group_columns=None, time_column='e_primary_t', id_column=None):
+    """Fold new runs into a progression from wr_progression, without recomputing it from scratch.
+
+    Only the groups the new runs land in get recomputed, and only from their existing WR runs plus
+    the new runs: a run that wasn't a WR can't become one because more runs showed up. If id_column
+    is set, new runs replace WR runs with the same id (e.g. runs that got re-fetched by a sync).
+
+    Runs that were removed (rejected, deleted) or got slower can take a record away, and need a full
+    wr_progression rebuild instead."""
+    group_columns = list(group_columns or WR_GROUP_COLUMNS)
+    if not len(new_runs):
+        return progression
+
+    base_runs = progression.drop(columns=PROGRESSION_COLUMNS)
+    if id_column is not None:
+        base_runs = base_runs[~base_runs[id_column].isin(new_runs[id_column])]
+
+    combined = pd.concat([base_runs, new_runs], ignore_index=True)
+    group_id = combined.groupby(group_columns, dropna=False, observed=True, sort=False).ngroup()
+    touched = group_id.isin(group_id.iloc[len(base_runs):])
+
+    untouched_wrs = progression.loc[base_runs.index[~touched.iloc[:len(base_runs)].to_numpy()]]
+    updated_wrs = wr_progression(combined[touched], group_columns=group_columns, time_column=time_column)
+
+    sort_columns = [column for column in WR_SORT_COLUMNS if column in combined.columns]
+    return pd.concat([untouched_wrs, updated_wrs], ignore_index=True).sort_values(sort_columns, kind='stable')
+
+
+def pb_events(runs, group_columns=None, time_column='e_primary_t', player_column='e_pid'):
+    """Get every time a player's personal best changed on a leaderboard, for all leaderboards at once.
+
+    The runs that come back are the ones that beat their player's previous PB in their group (or
+    were their first run there), with prev_pb_t and obsoleted_on, the date the player beat it again
+    (NaT if it's still their PB). Guest runs without a player id are left out.
+
+    Only verified runs count, so runs that get rejected after the fact never make an event: building
+    the events again just drops them, and their player's PB falls back to the run before."""
+    group_columns = list(group_columns or WR_GROUP_COLUMNS)
+    sort_columns = [column for column in WR_SORT_COLUMNS if column in runs.columns]
+
+    keep = runs[time_column].notna() & runs[player_column].notna()
+    if 'e_status_judgment' in runs.columns:
+        keep &= runs['e_status_judgment'] == 'verified'
+    runs = runs[keep].sort_values(sort_columns, kind='stable')
+
+    board_player = runs.groupby(group_columns + [player_column], dropna=False, observed=True, sort=False).ngroup()
+    times = runs[time_column]
+    prev_pb_t = times.groupby(board_player).cummin().groupby(board_player).shift()
+    improved = prev_pb_t.isna() | (times < prev_pb_t)
+
+    events = runs[improved].copy()
+    events['prev_pb_t'] = prev_pb_t[improved]
+    events['obsoleted_on'] = events['date'].groupby(board_player[improved]).shift(-1)
+    return events
+
+
+def leaderboards_as_of(events, dates, group_columns=None, time_column='e_primary_t'):
+    """Rebuild the leaderboards as they stood on each of dates from pb_events, all in one go.
+
+    Each event is some player's PB from its date until obsoleted_on, so it's placed on every board
+    in dates that falls in that window. Returns one row per player per leaderboard per date, with
+    as_of set to the date and place their rank on that board (ties share a place)."""
+    group_columns = list(group_columns or WR_GROUP_COLUMNS)
+    dates = pd.DatetimeIndex(sorted(set(pd.to_datetime(list(dates)))))
+
+    # The range of dates each event was the PB for
+    start = dates.searchsorted(events['date'].to_numpy(), side='left')
+    obsoleted_on = events['obsoleted_on']
+    end = np.where(
+        obsoleted_on.isna(),
+        len(dates),
+        dates.searchsorted(obsoleted_on.fillna(events['date']).to_numpy(), side='left'))
+    counts = np.clip(end - start, 0, None)
+
+    # One copy of each event per date it covers
+    rows = np.repeat(np.arange(len(events)), counts)
+    offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    boards = events.iloc[rows].copy()
+    boards['as_of'] = dates[np.repeat(start, counts) + offsets]
+
+    boards['place'] = boards.groupby(['as_of'] + group_columns, dropna=False, observed=True)[time_column]\
+        .rank(method='min').astype(int)
+    return boards.sort_values(['as_of', 'place'], kind='stable')
+
+
+def barrier_histograms(
+        events,
+        as_of,
+        cutoff_dates=(),
+        bucket_minutes=1,
+        group_columns=None,
+        time_column='e_primary_t',
+        player_column='e_pid'):
+    """Count the players at each time barrier on every leaderboard at once, from pb_events.
+
+    The leaderboards as of as_of are bucketed into bucket_minutes-wide barriers (1 for minute
+    barriers), and players are counted per group per barrier. For each of cutoff_dates, players are
+    also split into new (broke into a faster barrier since that date, or weren't on the board yet)
+    and old. Returns one row per group per barrier per cutoff, with the group columns, cutoff (NaT
+    for the no-cutoff counts, where every player is old), barrier (the bucket's start in minutes),
+    and old/new/total player counts."""
+    group_columns = list(group_columns or WR_GROUP_COLUMNS)
+    board_keys = group_columns + [player_column]
+    as_of = pd.Timestamp(as_of)
+    cutoff_dates = sorted({pd.Timestamp(cutoff_date) for cutoff_date in cutoff_dates})
+
+    boards = leaderboards_as_of(events, [as_of] + cutoff_dates, group_columns, time_column)
+    boards['bucket'] = np.floor(boards[time_column] / (60 * bucket_minutes))
+    current = boards[boards['as_of'] == as_of].sort_values(group_columns + ['bucket'], kind='stable')
+
+    histograms = []
+    for cutoff_date in [pd.NaT] + cutoff_dates:
+        if pd.isna(cutoff_date):
+            is_new = np.zeros(len(current), dtype=bool)
+        else:
+            prior = boards.loc[boards['as_of'] == cutoff_date, board_keys + ['bucket']]
+            prior_bucket = current[board_keys].merge(prior, on=board_keys, how='left')['bucket'].to_numpy()
+            is_new = current['bucket'].to_numpy() < np.nan_to_num(prior_bucket, nan=np.inf)
+
+        counts = current.assign(is_new=is_new)\
+            .groupby(group_columns + ['bucket', 'is_new'], dropna=False, observed=True, sort=False).size()\
+            .unstack('is_new', fill_value=0)\
+            .reindex(columns=[False, True], fill_value=0)
+        counts.columns = ['old', 'new']
+        histograms.append(counts.reset_index().assign(cutoff=cutoff_date))
+
+    histograms = pd.concat(histograms, ignore_index=True)
+    histograms['barrier'] = histograms.pop('bucket') * bucket_minutes
+    if float(bucket_minutes).is_integer():
+        histograms['barrier'] = histograms['barrier'].astype(int)
+    histograms['total'] = histograms['old'] + histograms['new']
+    return histograms[group_columns + ['cutoff', 'barrier', 'old', 'new', 'total']]
@@ -0,0 +1,203 @@
+"""Render a whole batch of charts at once, spread over a pool of processes.
+
+Each chart is a ChartSpec: which kind of chart it is (see CHART_KINDS), where to save it, and the
+params/style for it. render_data builds the board-wide tables the charts are cut from once, then
+render_charts hands them to every worker and renders the specs in parallel. Workers draw with
+matplotlib's Figure API on the Agg backend, so they never touch pyplot's global state and every
+figure is thrown away as soon as it's saved.
+
+Rendered charts are cached by a hash of the chart's table, title, style and matplotlib settings
+(see chart_cache.py). A chart whose hash has been rendered before isn't drawn again, its spec.path
+just gets hard-linked to the cached PNG, and render_charts writes a manifest of which charts were
+actually rendered. The "Generated on" date isn't part of the hash, so a chart that's reused keeps
+the date it was first drawn on.
+
+    specs = [ChartSpec("top_ils", CHART_PATH / f"Top_IL_{c}.png", params={"category": c}) for c in categories]
+    render_charts(specs, render_data(board_info, specs))
+"""
+
+import json
+import multiprocessing
+import os
+from datetime import datetime, timezone
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Callable, Dict, Optional, Tuple
+
+import generate_graphs as grph
+from chart_cache import draw_chart, save_chart
+from config import BoardInfo, DATA_PATH
+
+
+# Which charts the last render_charts call actually rendered, kept with the render cache under data/
+RENDER_MANIFEST_PATH = DATA_PATH / "render_manifest.json"
+
+
+@dataclass
+class ChartKind:
+    # prepare(data, **params) cuts the chart's table out of the shared data,
+    # draw(ax, table, title, **style) draws it
+    prepare: Callable
+    draw: Callable
+    # Default title, formatted with the spec's params
+    title: str
+    # Keys of render_data the chart needs
+    needs: Tuple[str, ...]
+
+
+@dataclass
+class ChartSpec:
+    kind: str
+    path: Path
+    params: Dict = field(default_factory=dict)
+    style: Dict = field(default_factory=dict)
+    title: Optional[str] = None
+    transparent: bool = False
+
+
+def prepare_runs_per_week(data, start_date, end_date=None, il_split=False):
+    query = data.get("query")
+    return grph.runs_per_week_counts(
+        data["run_counts"], start_date, end_date, il_split,
+        split_by=query.split_by if query else None,
+        split_names=query.split_names if query else None)
+
+
+def prepare_il_counts(data, categories=None):
+    return grph.il_count_totals(data["il_counts"], categories)
+
+
+def prepare_top_ils(data, category, count=10):
+    return grph.top_counts(data["il_counts"][category], count)
+
+
+def prepare_top_submitters(data, count_field="total_count", count=10):
+    return grph.top_counts(data["submitter_counts"][count_field], count)
+
+
+def prepare_minute_histogram(
+        data, category, level="Full Game", barrier_cutoff_date=None, minute_cutoff=1000, fill_minutes=False, subcategories=None):
+    return grph.barrier_counts(
+        data["barrier_histograms"], category, level, barrier_cutoff_date, minute_cutoff, fill_minutes,
+        subcategories=subcategories)
+
+
+def prepare_long_standing_wrs(data, longest_active=False, fullgame_only=False, count=10):
+    wr_list = grph.longest_standing_wrs(data["wr_runs"], longest_active, fullgame_only, result_count=count)
+    return grph.long_standing_wr_bars(wr_list, full_game=fullgame_only, count=count)
+
+
+CHART_KINDS = {
+    "runs_per_week": ChartKind(prepare_runs_per_week, grph.draw_runs_per_week, "{game} Runs Per Week", ("run_counts", "game")),
+    "il_counts": ChartKind(prepare_il_counts, grph.draw_stacked_counts, "Runs Per Level", ("il_counts",)),
+    "top_ils": ChartKind(prepare_top_ils, grph.draw_top_counts, "Top {category} ILs", ("il_counts",)),
+    "top_submitters": ChartKind(prepare_top_submitters, grph.draw_top_counts, "Top Submitters", ("submitter_counts",)),
+    "minute_histogram": ChartKind(
+        prepare_minute_histogram, grph.draw_minute_histogram, "{category} Minute Barriers", ("barrier_histograms",)),
+    "long_standing_wrs": ChartKind(
+        prepare_long_standing_wrs, grph.draw_long_standing_wrs, "Longest Standing World Records", ("wr_runs",)),
+}
+
+def build_barrier_histograms(board_info: BoardInfo, specs, query=None):
+    """Every minute histogram in one go, with new runs split out for each cutoff date the specs use"""
+    cutoff_dates = {spec.params.get("barrier_cutoff_date") for spec in specs}
+    split_subcategories = any(spec.params.get("subcategories") for spec in specs)
+    return grph.get_barrier_histograms(board_info, cutoff_dates, split_subcategories=split_subcategories, query=query)
+
+
+# How to build each piece of shared data from a board, given the specs that need it and the query
+RENDER_DATA_BUILDERS = {
+    "game": lambda board_info, specs, query: board_info.game['names']['international'],
+    "run_counts": lambda board_info, specs, query: grph.get_run_counts(board_info, query),
+    "il_counts": lambda board_info, specs, query: grph.get_il_counts(board_info, query),
+    "submitter_counts": lambda board_info, specs, query: grph.get_submitter_counts(board_info, query),
+    "barrier_histograms": build_barrier_histograms,
+    "wr_runs": lambda board_info, specs, query: grph.get_wr_runs(board_info, query=query),
+}
+
+
+def render_data(board_info: BoardInfo, specs, query=None):
+    """Build the shared data the given chart specs need from the board, once for all of them. With a
+    query (see query.py), every chart only looks at the runs it matches"""
+    query = grph.board_query(board_info, query)
+    needs = {need for spec in specs for need in CHART_KINDS[spec.kind].needs}
+    data = {
+        need: RENDER_DATA_BUILDERS[need](
+            board_info, [spec for spec in specs if need in CHART_KINDS[spec.kind].needs], query)
+        for need in needs}
+    data["query"] = query
+    return data
+
+
+def chart_title(spec: ChartSpec, data):
+    if spec.title is not None:
+        return spec.title
+    return CHART_KINDS[spec.kind].title.format(game=data.get("game", ""), **spec.params)
+
+
+def render_chart(spec: ChartSpec, data, use_cache=True):
+    """Render a single chart to spec.path. The figure isn't attached to pyplot, so it's freed when this returns
+
+    Returns a manifest entry for the chart (see chart_cache.save_chart)"""
+    kind = CHART_KINDS[spec.kind]
+    table = kind.prepare(data, **spec.params)
+    title = chart_title(spec, data)
+    return save_chart(
+        spec.path, spec.kind, table, title,
+        lambda: draw_chart(kind.draw, table, title, **spec.style),
+        style=spec.style,
+        transparent=spec.transparent,
+        use_cache=use_cache)
+
+
+def write_manifest(entries, manifest_path):
+    manifest = {
+        "generated": datetime.now(timezone.utc).isoformat(),
+        "rendered": sum(entry["status"] == "rendered" for entry in entries),
+        "charts": entries,
+    }
+    manifest_path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = manifest_path.with_name(f".{manifest_path.name}.tmp")
+    with open(tmp_path, "w") as manifest_file:
+        json.dump(manifest, manifest_file, indent=2)
+    os.replace(tmp_path, manifest_path)
+
+
+# Shared data for the charts, set once per worker process by init_render_worker
+WORKER_DATA = None
+
+
+def init_render_worker(data):
+    global WORKER_DATA
+    WORKER_DATA = data
+
+
+def render_worker_chart(spec: ChartSpec, use_cache=True):
+    return render_chart(spec, WORKER_DATA, use_cache)
+
+
+def render_charts(specs, data, max_workers=None, use_cache=True, manifest_path=RENDER_MANIFEST_PATH):
+    """Render every spec, using data from render_data, across max_workers processes (one per core
+    by default). Returns render_chart's manifest entries, in the order of specs, and writes them to
+    manifest_path (unless it's None).
+
+    Where processes can be forked, workers share data with this process instead of getting their own
+    copy. With max_workers=1 everything renders in this process, which is handy for debugging.
+    With use_cache off every chart gets drawn again and nothing's written to the render cache."""
+    specs = list(specs)
+    max_workers = max_workers or os.cpu_count() or 1
+    if max_workers == 1 or len(specs) <= 1:
+        entries = [render_chart(spec, data, use_cache) for spec in specs]
+    else:
+        start_method = "fork" if "fork" in multiprocessing.get_all_start_methods() else None
+        with ProcessPoolExecutor(
+                max_workers=min(max_workers, len(specs)),
+                mp_context=multiprocessing.get_context(start_method),
+                initializer=init_render_worker,
+                initargs=(data,)) as pool:
+            entries = list(pool.map(render_worker_chart, specs, [use_cache] * len(specs)))
+
+    if manifest_path is not None:
+        write_manifest(entries, Path(manifest_path))
+    return entries
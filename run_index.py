@@ -0,0 +1,135 @@
+"""Variable-aware runs: decode each run's variable values into readable columns, and index runs by
+the leaderboard they're on so filtering and splitting doesn't mean scanning every run.
+
+decode_variables turns the value_{variable id} columns (value ids) into categorical columns named
+after their variables (e.g. Character: Peppino/Noise/Swap). build_run_index then groups the runs
+by category, level, and subcategory values once, and keeps the row positions of every group:
+
+    run_index = build_run_index(decode_variables(joined_runs, variables), ["Character"])
+    noise_any = select_runs(run_index, Categories="Any%", Character="Noise")
+    by_character = split_runs(run_index, "Character", e_short_name="Full Game")
+
+Lookups only look at the groups (a few hundred for a big board) and then take their rows."""
+
+from dataclasses import dataclass
+from typing import Dict, List
+
+import numpy as np
+import pandas as pd
+
+from enrich_data import VALUE_COLUMN_PREFIX
+
+
+# The runs are always indexed by these: category/level ids and their names (see join_runs)
+INDEX_BASE_COLUMNS = ['category', 'level', 'Categories', 'e_short_name']
+
+
+@dataclass
+class RunIndex:
+    runs: pd.DataFrame
+    group_columns: List[str]
+    # Each group's key (its values of group_columns) -> row positions of its runs
+    groups: Dict[tuple, np.ndarray]
+
+
+def variable_values(variable):
+    """Value id -> label for a variable from the SRC variables endpoint"""
+    values = (variable.get('values') or {}).get('values') or {}
+    # Variables loaded from parquet have every value id any variable uses, with None for the rest
+    return {value_id: value['label'] for value_id, value in values.items() if value is not None}
+
+
+def variable_columns(variables, columns):
+    """Name of the decoded column for each variable that has a value_ column in columns. It's the
+    variable's name, unless that name is already taken"""
+    names = {}
+    if variables is None or len(variables) == 0:
+        return names
+    for variable in pd.DataFrame(variables).to_dict('records'):
+        value_column = f"{VALUE_COLUMN_PREFIX}{variable['id']}"
+        if value_column not in columns:
+            continue
+        name = variable['name']
+        if name in columns or name in names.values():
+            name = f"{name} ({variable['id']})"
+        names[variable['id']] = name
+    return names
+
+
+def decode_variables(runs, variables, subcategories_only=False):
+    """Add a categorical column per variable with its value labels instead of value ids, named
+    after the variable (see variable_columns). Categories are in the order SRC lists the values.
+
+    subcategories_only only decodes the subcategory variables, the ones that split leaderboards"""
+    if variables is None or len(variables) == 0:
+        return runs
+
+    variable_table = pd.DataFrame(variables)
+    if subcategories_only:
+        is_subcategory = variable_table.get('is-subcategory', pd.Series(False, index=variable_table.index))
+        variable_table = variable_table[is_subcategory.fillna(False).astype(bool)]
+
+    names = variable_columns(variable_table, runs.columns)
+    decoded = {}
+    for variable in variable_table.to_dict('records'):
+        if variable['id'] not in names:
+            continue
+        labels = variable_values(variable)
+        value_ids = runs[f"{VALUE_COLUMN_PREFIX}{variable['id']}"].astype('category')
+
+        # Decode the categories, not the rows, then point each row's code at its label. Value ids
+        # the variable doesn't list (removed values) are kept as they are
+        category_labels = [labels.get(value_id, value_id) for value_id in value_ids.cat.categories]
+        label_order = list(dict.fromkeys(list(labels.values()) + category_labels))
+        label_codes = np.array([label_order.index(label) for label in category_labels] + [-1])
+        decoded[names[variable['id']]] = pd.Categorical.from_codes(
+            label_codes[value_ids.cat.codes.to_numpy()], categories=label_order)
+    return runs.assign(**decoded)
+
+
+def build_run_index(runs, subcategory_columns=()):
+    """Index runs by category, level, and the given decoded subcategory columns (see decode_variables).
+    runs needs the ids and names join_all_data gives them"""
+    group_columns = INDEX_BASE_COLUMNS + list(subcategory_columns)
+    runs = runs.reset_index(drop=True)
+    groups = runs.groupby(group_columns, dropna=False, observed=True, sort=False).indices
+    return RunIndex(runs=runs, group_columns=group_columns, groups=groups)
+
+
+def matches(value, wanted):
+    """Whether a group value matches a criteria value: a single value or a list of them. NaN matches NaN"""
+    wanted = list(wanted) if isinstance(wanted, (list, tuple, set)) else [wanted]
+    return any(value == option or (pd.isna(value) and pd.isna(option)) for option in wanted)
+
+
+def index_positions(run_index: RunIndex, **criteria):
+    """Row positions of the runs in every group matching criteria: group column -> value or list of values"""
+    unknown = set(criteria) - set(run_index.group_columns)
+    if unknown:
+        raise ValueError(f"{sorted(unknown)} aren't indexed, only {run_index.group_columns} are")
+
+    column_numbers = {column: number for number, column in enumerate(run_index.group_columns)}
+    positions = [
+        group_positions for key, group_positions in run_index.groups.items()
+        if all(matches(key[column_numbers[column]], wanted) for column, wanted in criteria.items())]
+    if not positions:
+        return np.array([], dtype=np.intp)
+    return np.sort(np.concatenate(positions))
+
+
+def select_runs(run_index: RunIndex, **criteria):
+    """The runs in every group matching criteria, e.g. select_runs(run_index, Categories=["Any%", "100%"])"""
+    if not criteria:
+        return run_index.runs
+    return run_index.runs.iloc[index_positions(run_index, **criteria)]
+
+
+def split_runs(run_index: RunIndex, by, **criteria):
+    """Split the runs matching criteria by one of the indexed columns, value -> runs"""
+    column_number = run_index.group_columns.index(by)
+    splits = {}
+    for value in dict.fromkeys(key[column_number] for key in run_index.groups):
+        positions = index_positions(run_index, **{**criteria, by: value})
+        if len(positions):
+            splits[value] = run_index.runs.iloc[positions]
+    return splits
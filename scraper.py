@@ -1,20 +1,76 @@
 """Script for getting runs and such from the src API"""
 
+from concurrent.futures import as_completed
 from datetime import datetime
+import itertools
+import os
+import shutil
+
 import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
 import requests
 
-from config import DATA_PATH, SRC_API_URL, PT_ID, BoardInfo
-from enrich_data import enrich_categories, enrich_levels, enrich_runs
-from utils import query_api
+from aggregates import load_run_counts, save_run_counts, update_run_counts
+from checkpoints import clear_checkpoint, load_checkpoint, save_checkpoint
+from config import SRC_API_URL, BoardInfo
+from enrich_data import enrich_categories, enrich_levels, enrich_runs, flatten_runs_table, runs_to_table, RUN_SCHEMA
+from http_cache import offline_mode, revalidate, CacheMiss
+from metrics import print_summary, record_requests, request_labels, write_jsonl
+from run_index import variable_values
+from utils import (
+    get_users_table, query_api, save_users, write_parquet_atomic, ContextThreadPoolExecutor, MAX_WORKERS,
+    SRC_MAX_OFFSET)
 
 
 """Loading different datasets"""
-def get_full_game(board_id, file_prefix=None, fetch_runs=True, save_path=None):
+def get_full_game(
+        board_id,
+        file_prefix=None,
+        fetch_runs=True,
+        save_path=None,
+        sync=False,
+        concurrent=False,
+        partitioned=False,
+        embed_players=False,
+        stream=False,
+        metrics_path=None):
     """Download and enrich all categories, levels, variables, and optionally runs for a board.
     Save them in save_path. If board_prefix is provided, saved files will start with it. Otherwise,
-    they will be prefixed by board_id."""
-
+    they will be prefixed by board_id.
+
+    If sync is set and save_path already has a runs file for this board, only fetch the runs that
+    changed since it was written (see sync_runs) instead of re-downloading every run.
+
+    If concurrent is set, run pages are fetched several at a time (see query_api). Boards with more
+    than SRC_MAX_OFFSET runs need partitioned set to get all of their runs (see get_runs_partitioned).
+    Serial run downloads are journaled page by page (see checkpoints.py), so running this again after
+    a failure resumes the runs download instead of starting it over.
+
+    If embed_players is set, runs are fetched with their players embedded, which fills in runner
+    names and a {file_prefix}_users.parquet table without any extra user lookups.
+
+    If stream is set (and save_path is), runs are written to disk page by page as they come in
+    instead of being collected in memory, and an interrupted download picks up where it stopped
+    the next time (see stream_runs). The runs aren't loaded back into the BoardInfo, use
+    get_full_game_local or read_runs for them.
+
+    Once it's done (or fails), a summary of the API requests it made gets printed (see metrics.py).
+    If metrics_path is set, every request is also appended to it as a JSON line, tagged with the board."""
+    with request_labels(board=board_id), record_requests(board=board_id) as requests_made:
+        try:
+            return fetch_full_game(
+                board_id, file_prefix, fetch_runs, save_path, sync, concurrent, partitioned, embed_players, stream)
+        finally:
+            print_summary(requests_made, title=f"{board_id} API requests")
+            if metrics_path:
+                write_jsonl(requests_made, metrics_path, board=board_id)
+
+
+def fetch_full_game(board_id, file_prefix, fetch_runs, save_path, sync, concurrent, partitioned, embed_players, stream):
+    """The actual downloading for get_full_game"""
     print(f"Fetching data for {board_id}")
     game = query_api(f"{SRC_API_URL}/games/{board_id}")
     file_prefix = file_prefix or board_id
@@ -22,61 +78,177 @@ def get_full_game(board_id, file_prefix=None, fetch_runs=True, save_path=None):
     # Extract links and download the categories, levels, variables, and runs
     game_links = {link['rel']: link['uri'] for link in game['links']}
 
-    # TODO fill in vars on categories/levels/runs
-    print("Fetching Variables...")
-    variables = load_data(
-        game_links['variables'],
-        lambda x: x,
-        save_path=save_path / f"{file_prefix}_variables.parquet" if save_path else None
-    )
-
-    print("Fetching Categories...")
-    categories = load_data(
-        game_links['categories'],
-        enrich_categories,
-        save_path=save_path / f"{file_prefix}_categories.parquet" if save_path else None
-    )
-
-    print("Fetching Levels...")
-    levels = load_data(
-        game_links['levels'],
-        enrich_levels,
-        save_path=save_path / f"{file_prefix}_levels.parquet" if save_path else None
-    )
+    # Variables, categories, and levels don't depend on each other, so grab them all at once
+    print("Fetching Variables, Categories, and Levels...")
+    metadata = {
+        'variables': lambda x: x,
+        'categories': enrich_categories,
+        'levels': enrich_levels,
+    }
+    with ContextThreadPoolExecutor(max_workers=len(metadata)) as pool:
+        futures = {
+            name: pool.submit(
+                load_data,
+                game_links[name],
+                enrich_fun,
+                save_path=save_path / f"{file_prefix}_{name}.parquet" if save_path else None)
+            for name, enrich_fun in metadata.items()}
+    variables, categories, levels = (futures[name].result() for name in metadata)
 
     runs = None
-    if fetch_runs:
+    if fetch_runs and sync and save_path and (save_path / f"{file_prefix}_runs.parquet").exists():
+        print("Syncing Runs...")
+        runs = sync_runs(game['id'], save_path, board_prefix=file_prefix, embed_players=embed_players)
+    elif fetch_runs and stream and save_path:
+        print("Streaming Runs...")
+        stream_runs(game_links['runs'], save_path / f"{file_prefix}_runs.parquet", api_args=run_query_args(embed_players))
+        if embed_players:
+            save_users_table(
+                read_runs(save_path / f"{file_prefix}_runs.parquet", columns=['e_pid']),
+                save_path / f"{file_prefix}_users.parquet")
+    elif fetch_runs and partitioned:
+        print("Fetching Runs...")
+        runs = get_runs_partitioned(
+            game['id'], board_prefix=file_prefix, save_path=save_path, embed_players=embed_players)
+    elif fetch_runs:
         # The runs str needs to have max pagination added to it
         print("Fetching Runs...")
-        runs = load_data(
+        runs = load_runs(
             game_links['runs'],
-            enrich_runs,
-            api_args={'max': 200},
-            save_path=save_path / f"{file_prefix}_runs.parquet" if save_path else None
+            api_args=run_query_args(embed_players),
+            save_path=save_path / f"{file_prefix}_runs.parquet" if save_path else None,
+            concurrent=concurrent,
+            checkpoint=not concurrent
         )
 
+    if embed_players and save_path and runs is not None and len(runs):
+        save_users_table(runs, save_path / f"{file_prefix}_users.parquet")
+
     return BoardInfo(
         game=game,
         categories=categories,
         levels=levels,
         variables=variables,
-        runs=runs)
+        runs=runs,
+        save_path=save_path,
+        file_prefix=file_prefix)
 
 
-def get_full_game_local(board_id, save_path, file_prefix=None):
-    """Lookup the main game info on SRC, but load runs, categories, levels, and variables from save_path"""
+def get_full_game_local(board_id, save_path, file_prefix=None, columns=None, filters=None):
+    """Lookup the main game info on SRC, but load runs, categories, levels, and variables from save_path
+
+    The game info comes out of the response cache whenever it's been fetched before, so this only
+    touches the network the first time a board is loaded.
+
+    columns and filters are passed on to read_runs, so if you only need a few columns or a slice of
+    the runs (see generate_graphs.RUN_COLUMNS and run_filters), only those get read off disk."""
     print(f"Fetching data for {board_id}")
-    game = query_api(f"{SRC_API_URL}/games/{board_id}")
+    file_prefix = file_prefix or board_id
+    try:
+        with offline_mode():
+            game = query_api(f"{SRC_API_URL}/games/{board_id}")
+    except CacheMiss:
+        game = query_api(f"{SRC_API_URL}/games/{board_id}")
 
     return BoardInfo(
         game=game,
         categories=pd.read_parquet(save_path / f"{file_prefix}_categories.parquet"),
         levels=pd.read_parquet(save_path / f"{file_prefix}_levels.parquet"),
         variables=pd.read_parquet(save_path / f"{file_prefix}_variables.parquet"),
-        runs=pd.read_parquet(save_path / f"{file_prefix}_runs.parquet")
+        runs=read_runs(save_path / f"{file_prefix}_runs.parquet", columns=columns, filters=filters),
+        save_path=save_path,
+        file_prefix=file_prefix,
     )
 
 
+def get_full_games(board_ids, save_path, file_prefixes=None, max_boards=4, **full_game_args):
+    """Run get_full_game for a bunch of boards at once, saving each one's files in save_path.
+
+    Up to max_boards boards are fetched at a time. They all share the global API rate limit, so
+    more boards in flight doesn't mean more requests per second, just less time waiting on any one
+    board. file_prefixes maps board ids to file prefixes (the board id is used otherwise), and
+    anything else is passed on to get_full_game (e.g. sync=True, partitioned=True).
+
+    A board that fails doesn't stop the rest. Returns a dict of board id -> BoardInfo for the boards
+    that made it and a dict of board id -> exception for the ones that didn't."""
+    file_prefixes = file_prefixes or {}
+    board_ids = list(dict.fromkeys(board_ids))
+    boards, errors = {}, {}
+
+    def fetch_board(board_id):
+        start = datetime.now()
+        board_info = get_full_game(
+            board_id, file_prefix=file_prefixes.get(board_id), save_path=save_path, **full_game_args)
+        return board_info, (datetime.now() - start).total_seconds()
+
+    # Context-carrying threads, so offline_mode/revalidate blocks apply to every board
+    with ContextThreadPoolExecutor(max_workers=max_boards) as pool:
+        futures = {pool.submit(fetch_board, board_id): board_id for board_id in board_ids}
+        for future in as_completed(futures):
+            board_id = futures[future]
+            try:
+                boards[board_id], elapsed = future.result()
+            except Exception as e:
+                errors[board_id] = e
+                print(f"\n[{len(boards) + len(errors)}/{len(board_ids)}] {board_id} failed: {e!r}")
+                continue
+
+            run_count = len(boards[board_id].runs) if boards[board_id].runs is not None else 0
+            print(f"\n[{len(boards) + len(errors)}/{len(board_ids)}] {board_id} done in {elapsed:.0f}s, {run_count} runs")
+
+    print(f"Fetched {len(boards)} of {len(board_ids)} boards" + (f", failed: {', '.join(errors)}" if errors else ""))
+    return boards, errors
+
+
+def read_runs(runs_path, columns=None, filters=None):
+    """Load a saved runs file, optionally only reading some of its columns and rows.
+
+    Runs are stored flat (see enrich_data.RUN_SCHEMA), so this is a memory-mapped Arrow read with no
+    python objects to rebuild. columns and filters (see run_filters, or a pyarrow expression like
+    query.compile_query makes) get pushed down into the parquet read, so columns you don't ask for
+    and row groups that can't match are never loaded.
+
+    Files saved before runs were flattened still have the nested API columns, and get read in full
+    and flattened on the way in."""
+    if 'players' in pq.read_schema(runs_path).names:
+        runs_table = flatten_runs_table(pq.read_table(runs_path, memory_map=True))
+        if isinstance(filters, pc.Expression):
+            runs_table = runs_table.filter(filters)
+        elif filters:
+            runs_table = runs_table.filter(pq.filters_to_expression(filters))
+    else:
+        runs_table = pq.read_table(runs_path, columns=columns, filters=filters, memory_map=True)
+
+    if columns is not None:
+        runs_table = runs_table.select(columns)
+    return runs_table.to_pandas()
+
+
+def run_filters(start_date=None, end_date=None, categories=None, levels=None, statuses=None, exclude_rats=False):
+    """Build row filters for read_runs/get_full_game_local. Every argument that's set narrows down
+    which runs get read: dates are inclusive, categories/levels/statuses are lists of ids/statuses
+    to keep, and exclude_rats drops Stupid Rat runs."""
+    filters = []
+    if start_date is not None:
+        filters.append(('date', '>=', pd.Timestamp(start_date)))
+    if end_date is not None:
+        filters.append(('date', '<=', pd.Timestamp(end_date)))
+    if categories is not None:
+        filters.append(('category', 'in', list(categories)))
+    if levels is not None:
+        filters.append(('level', 'in', list(levels)))
+    if statuses is not None:
+        filters.append(('e_status_judgment', 'in', list(statuses)))
+    if exclude_rats:
+        filters.append(('e_is_rat', '=', False))
+    return filters or None
+
+
+def write_runs(run_df, runs_path):
+    """Save runs in the RUN_SCHEMA layout (dictionary-encoded ids, typed dates/times), atomically"""
+    write_parquet_atomic(runs_to_table(run_df), runs_path)
+
+
 def get_levels(board_id, board_prefix=None, save_path=None):
     """Get a list of all levels for the boards in board_ids (see boards in config.py)"""
     level_api = f"{SRC_API_URL}/games/{board_id}/levels"
@@ -101,47 +273,481 @@ def get_categories(board_id, board_prefix=None, save_path=None):
     )
 
 
-def get_runs(board_id, board_prefix=None, save_path=None):
+def get_runs(
+        board_id,
+        board_prefix=None,
+        save_path=None,
+        concurrent=False,
+        partitioned=False,
+        embed_players=False):
     """Query the speedrun.com API to get every run for the game in board_id.
     
-    Because the runs endpoint requires the proper ID, lookup the game in case the user provided an abbreviation."""
+    Because the runs endpoint requires the proper ID, lookup the game in case the user provided an abbreviation.
+
+    Boards with more than SRC_MAX_OFFSET runs need partitioned set (see get_runs_partitioned), and
+    embed_players fills in runner names from the runs themselves (see get_full_game)."""
+    if partitioned:
+        return get_runs_partitioned(
+            board_id, board_prefix=board_prefix, save_path=save_path, embed_players=embed_players)
 
     game = query_api(f"{SRC_API_URL}/games/{board_id}")
     game_id = game['id']
     runs_api = f"{SRC_API_URL}/runs?game={game_id}"
     file_prefix = board_prefix or board_id
-    return load_data(
+    return load_runs(
         runs_api,
-        enrich_runs,
-        api_args={"max": 200},
-        save_path=save_path / f"{file_prefix}_runs.parquet" if save_path else None
+        api_args=run_query_args(embed_players),
+        save_path=save_path / f"{file_prefix}_runs.parquet" if save_path else None,
+        concurrent=concurrent
     )
 
 
-def get_leaderboards():
-    """Get the current leaderboards for Any%, True Ending, 100%, and 101%
-    
-    This method is currently unupdated for the new versions of the app"""
-    categories = ["Any", "True_Ending", "100", "101",]
+def stream_runs(runs_endpoint, runs_path, api_args=None):
+    """Download runs page by page straight to runs_path, so the whole board never sits in memory.
+
+    Each page is enriched as soon as it arrives and saved as its own part file in a
+    {runs file}.parts folder next to runs_path, and the next offset to fetch goes in the checkpoint
+    journal (see checkpoints.py).
+    If the download dies partway, calling this again with the same endpoint and args resumes from
+    the checkpoint. Once every page is in, the parts get copied into runs_path one row group at a
+    time and the parts folder is removed. Returns the number of runs written."""
+    parts_path = runs_path.with_name(f"{runs_path.name}.parts")
+    checkpoint = load_checkpoint(runs_endpoint, api_args, target=runs_path)
+
+    if checkpoint["pages"]:
+        print(f"Resuming from offset {checkpoint['next_offset']}, {checkpoint['pages']} pages already saved")
+    elif parts_path.exists():
+        # Left over from some other download into the same file
+        shutil.rmtree(parts_path)
+    parts_path.mkdir(parents=True, exist_ok=True)
+
+    for offset, page in query_api(runs_endpoint, api_args, stream=True, start_offset=checkpoint["next_offset"]):
+        if page:
+            write_parquet_atomic(
+                runs_to_table(enrich_fetched_runs(page)), parts_path / f"part-{offset:06d}.parquet")
+
+        # Only move the checkpoint once the page is safely on disk
+        save_checkpoint(checkpoint, offset, len(page))
+        print(f"\rSaved {checkpoint['pages']} pages, {checkpoint['next_offset']} runs", end="")
+    print("")
+
+    run_count = combine_run_parts(sorted(parts_path.glob("part-*.parquet")), runs_path)
+    shutil.rmtree(parts_path)
+    clear_checkpoint(checkpoint)
+    return run_count
+
+
+def combine_run_parts(part_paths, runs_path):
+    """Copy run part files into a single runs file, one row group per part, dropping runs that
+    showed up in an earlier part (pages can shift while a board is being downloaded)"""
+    part_schemas = [pq.read_schema(part_path) for part_path in part_paths]
+    part_columns = {field.name: field for schema in part_schemas for field in schema}
+    schema = pa.schema(
+        [field for field in RUN_SCHEMA if field.name in part_columns or not part_paths]
+        + sorted((field for name, field in part_columns.items() if name not in RUN_SCHEMA.names), key=lambda x: x.name))
+
+    seen_ids = set()
+    tmp_path = runs_path.with_name(f".{runs_path.name}.tmp")
+    with pq.ParquetWriter(tmp_path, schema) as writer:
+        for part_path in part_paths:
+            part = pq.read_table(part_path)
+            part = pa.table(
+                [part[field.name] if field.name in part.column_names else pa.nulls(len(part), field.type)
+                 for field in schema],
+                schema=schema)
+
+            keep = []
+            for run_id in part['id'].to_pylist():
+                keep.append(run_id not in seen_ids)
+                seen_ids.add(run_id)
+            part = part.filter(pa.array(keep, pa.bool_()))
+            writer.write_table(part)
+    os.replace(tmp_path, runs_path)
+    return len(seen_ids)
+
+
+def run_query_args(embed_players=False):
+    """Standard args for runs queries: biggest page size, and optionally embedded players"""
+    if embed_players:
+        return {"max": 200, "embed": "players"}
+    return {"max": 200}
+
+
+def enrich_fetched_runs(runs):
+    """enrich_runs for a list of runs straight off the API. If they were fetched with embed=players,
+    the embedded players get saved to the user store first, so their names don't need looking up later."""
+    users = {
+        player['id']: player['names']
+        for run in runs
+        if isinstance(run.get('players'), dict)
+        for player in run['players']['data']
+        if player['rel'] == 'user'}
+    if users:
+        save_users(users)
+    return enrich_runs(runs)
+
+
+def save_users_table(runs, save_path):
+    """Save the user store's entries for everyone who submitted to a board. Pairs with embed_players,
+    which puts every runner in the user store as runs are fetched (see enrich_fetched_runs)."""
+    users = get_users_table(runs['e_pid'])
+    users.to_parquet(path=save_path)
+    return users
+
+
+def get_runs_partitioned(
+        board_id,
+        board_prefix=None,
+        save_path=None,
+        max_workers=MAX_WORKERS,
+        embed_players=False):
+    """Get every run for a board that's too big to page through in one runs query.
+
+    The v1 API can't return more than SRC_MAX_OFFSET results for a query, so the runs query is split
+    up by category (see fetch_run_partition for how slices that are still too big get split further).
+    Slices are fetched in parallel, de-duplicated on run id, and enriched/saved just like get_runs."""
+    game = query_api(f"{SRC_API_URL}/games/{board_id}")
+    file_prefix = board_prefix or board_id
+    categories = query_api(f"{SRC_API_URL}/games/{game['id']}/categories")
+    levels = query_api(f"{SRC_API_URL}/games/{game['id']}/levels")
+    level_ids = [level['id'] for level in levels]
+
+    partitions = plan_run_partitions(game['id'], categories)
+    if embed_players:
+        partitions = [{**partition, "embed": "players"} for partition in partitions]
+    print(f"Fetching runs in {len(partitions)} partitions")
+    with ContextThreadPoolExecutor(max_workers=max_workers) as executor:
+        partition_runs = list(executor.map(
+            lambda partition: fetch_run_partition(partition, level_ids),
+            partitions))
+
+    # Slices can overlap (eg. a run that changed status mid-fetch), the first copy of each run wins
+    unique_runs = {}
+    for run in itertools.chain.from_iterable(partition_runs):
+        unique_runs.setdefault(run['id'], run)
+    runs_df = enrich_fetched_runs(list(unique_runs.values()))
 
-    current_date = datetime.utcnow().strftime("%Y-%m-%d")
+    if save_path:
+        write_runs(runs_df, save_path / f"{file_prefix}_runs.parquet")
+
+    return runs_df
+
+
+def plan_run_partitions(game_id, categories):
+    """Build the starting runs query args for a board, one slice per category. Per-level
+    categories are marked so they can be split up by level if they're still too big."""
+    return [
+        {"game": game_id, "category": category['id'], "per_level": category.get('type') == 'per-level'}
+        for category in categories
+    ]
+
+
+def fetch_run_partition(partition, level_ids):
+    """Fetch all runs for a single slice of a runs query, splitting it further if it hits the offset ceiling.
+
+    Splits are tried in order: by level (for per-level categories), then by run status. If a slice
+    is still too big after that, it's fetched sorted by submission date in both directions, which
+    covers up to twice the ceiling."""
+    runs_api = f"{SRC_API_URL}/runs"
+    query_args = {k: v for k, v in partition.items() if k != "per_level"}
+    runs = query_api(runs_api, {**query_args, "max": 200, "orderby": "submitted", "direction": "asc"}, checkpoint=True)
+    if len(runs) < SRC_MAX_OFFSET:
+        return runs
+
+    if partition.get("per_level") and "level" not in partition:
+        print(f"Splitting {query_args} by level")
+        return [
+            run for level_id in level_ids
+            for run in fetch_run_partition({**partition, "level": level_id}, level_ids)
+        ]
+
+    if "status" not in partition:
+        print(f"Splitting {query_args} by status")
+        return [
+            run for status in ("new", "verified", "rejected")
+            for run in fetch_run_partition({**partition, "status": status}, level_ids)
+        ]
+
+    # Out of filters to split on, so grab the slice from both ends and meet in the middle
+    print(f"Fetching {query_args} from both ends")
+    runs_desc = query_api(runs_api, {**query_args, "max": 200, "orderby": "submitted", "direction": "desc"}, checkpoint=True)
+    seen_ids = {run['id'] for run in runs}
+    runs += [run for run in runs_desc if run['id'] not in seen_ids]
+    if len(runs) >= 2 * SRC_MAX_OFFSET:
+        print(f"Warning: {query_args} has more than {2 * SRC_MAX_OFFSET} runs, some runs will be missing")
+    return runs
+
+
+def sync_runs(board_id, save_path, board_prefix=None, embed_players=False):
+    """Bring a saved runs file up to date without re-downloading the whole board.
+
+    Instead of paging through every run, this asks the runs endpoint for:
+    * The newest submissions, sorted by submission date, until we hit one we already have
+    * The newest verifications, sorted by verify-date, until we hit one we already have
+    * The current pending queue, since pending runs are the ones that get verified/rejected
+    Any run that was pending locally but has since left the queue without showing up above
+    (so it was rejected) gets re-fetched by id.
+
+    Changed runs replace their old rows, new runs get appended, and the file is rewritten
+    atomically. If the board's run count cube (see aggregates.py) was up to date, the changes get
+    folded into it too instead of it being rebuilt from every run.
+
+    Rejections of already-verified runs can't be spotted this way, so it's still worth doing a full
+    get_runs every once in a while."""
+    file_prefix = board_prefix or board_id
+    runs_path = save_path / f"{file_prefix}_runs.parquet"
+    if not runs_path.exists():
+        return get_runs(board_id, board_prefix=board_prefix, save_path=save_path, embed_players=embed_players)
 
-    for category in categories:
-        print(f"Fetching leaderboard for category {category}")
-        lb_response = requests.get(f"{SRC_API_URL}/leaderboards/{PT_ID}/category/{category}")
+    existing_runs = read_runs(runs_path)
+
+    game = query_api(f"{SRC_API_URL}/games/{board_id}")
+    runs_api = f"{SRC_API_URL}/runs"
+    base_args = {"game": game['id'], **run_query_args(embed_players)}
+
+    last_submitted = existing_runs['submitted'].max()
+    last_verified = existing_runs['e_verify_date'].max()
+
+    print(f"Fetching runs submitted after {last_submitted}")
+    new_runs = query_api(
+        runs_api,
+        {**base_args, "orderby": "submitted", "direction": "desc"},
+        stop_fun=lambda page: any(
+            run['submitted'] is None or pd.Timestamp(run['submitted']) <= last_submitted for run in page)
+    ) if pd.notna(last_submitted) else query_api(runs_api, base_args)
+
+    print(f"Fetching runs verified after {last_verified}")
+    verified_runs = query_api(
+        runs_api,
+        {**base_args, "orderby": "verify-date", "direction": "desc"},
+        stop_fun=lambda page: any(
+            run['status'].get('verify-date') is None or pd.Timestamp(run['status']['verify-date']) <= last_verified
+            for run in page)
+    ) if pd.notna(last_verified) else []
+
+    print("Fetching pending runs")
+    pending_runs = query_api(runs_api, {**base_args, "status": "new"})
+
+    # Anything we had as pending that isn't pending anymore and didn't come back verified got rejected
+    seen_ids = {run['id'] for run in new_runs + verified_runs + pending_runs}
+    locally_pending = existing_runs.loc[existing_runs['e_status_judgment'] == 'new', 'id']
+    left_queue = [run_id for run_id in locally_pending if run_id not in seen_ids]
+    if left_queue:
+        print(f"Re-fetching {len(left_queue)} runs that left the pending queue")
+    resolved_runs = []
+    deleted_ids = []
+    for run_id in left_queue:
+        try:
+            resolved_runs.append(query_api(
+                f"{SRC_API_URL}/runs/{run_id}",
+                {"embed": "players"} if embed_players else None))
+        except requests.HTTPError as e:
+            # Runners can delete their own pending runs, so drop those instead of failing the sync
+            if e.response is None or e.response.status_code != 404:
+                raise
+            deleted_ids.append(run_id)
+
+    changed_runs = new_runs + verified_runs + pending_runs + resolved_runs
+    if not changed_runs and not deleted_ids:
+        print("No changes, runs are up to date")
+        return existing_runs
+
+    # Only worth updating the cube if it matched the runs before this sync
+    counts_path = save_path / f"{file_prefix}_run_counts.parquet"
+    run_counts = load_run_counts(counts_path, runs_path)
+
+    deleted_runs = existing_runs[existing_runs['id'].isin(deleted_ids)]
+    existing_runs = existing_runs[~existing_runs['id'].isin(deleted_ids)]
+    if not changed_runs:
+        write_runs(existing_runs, runs_path)
+        if run_counts is not None:
+            save_run_counts(update_run_counts(run_counts, removed_runs=deleted_runs), counts_path, runs_path)
+        return existing_runs
+
+    # Latest copy of each run wins, so changed runs overwrite their old rows
+    changed_df = enrich_fetched_runs(changed_runs)
+    synced_runs = pd.concat([existing_runs, changed_df], ignore_index=True)\
+        .drop_duplicates(subset='id', keep='last')\
+        .reset_index(drop=True)
+
+    print(f"Synced {len(synced_runs) - len(existing_runs)} new runs, {len(synced_runs)} total")
+    write_runs(synced_runs, runs_path)
+    if run_counts is not None:
+        replaced_runs = existing_runs[existing_runs['id'].isin(changed_df['id'])]
+        run_counts = update_run_counts(
+            run_counts,
+            removed_runs=pd.concat([deleted_runs, replaced_runs]),
+            added_runs=changed_df.drop_duplicates(subset='id', keep='last'))
+        save_run_counts(run_counts, counts_path, runs_path)
+    return synced_runs
+
+
+"""Leaderboard snapshots"""
+
+def get_leaderboards(board_id, save_path=None, file_prefix=None, max_workers=MAX_WORKERS, metrics_path=None):
+    """Fetch every leaderboard on a board as it stands right now (see plan_leaderboards for which
+    ones there are). Leaderboards are fetched max_workers at a time through the shared API client,
+    with players embedded so runner names come along without any user lookups.
+
+    Returns the runs on every leaderboard in the RUN_SCHEMA layout, plus their place. If save_path is
+    set, they're also saved as today's snapshot in {file_prefix}_leaderboards (see
+    write_leaderboard_snapshot), so snapshots taken on different days build up into one dataset.
+
+    Every response gets revalidated with SRC instead of coming straight out of the HTTP cache (see
+    http_cache.revalidate), so a snapshot is never an older cached copy of the leaderboards."""
+    with request_labels(board=board_id), record_requests(board=board_id) as requests_made, revalidate():
+        try:
+            return fetch_leaderboards(board_id, save_path, file_prefix or board_id, max_workers)
+        finally:
+            print_summary(requests_made, title=f"{board_id} leaderboard requests")
+            if metrics_path:
+                write_jsonl(requests_made, metrics_path, board=board_id)
+
+
+def fetch_leaderboards(board_id, save_path, file_prefix, max_workers):
+    """The actual downloading for get_leaderboards"""
+    game = query_api(f"{SRC_API_URL}/games/{board_id}")
+    game_links = {link['rel']: link['uri'] for link in game['links']}
+    snapshot_date = datetime.utcnow().date()
+
+    with ContextThreadPoolExecutor(max_workers=3) as pool:
+        futures = {name: pool.submit(query_api, game_links[name]) for name in ('categories', 'levels', 'variables')}
+    leaderboards = plan_leaderboards(*(futures[name].result() for name in ('categories', 'levels', 'variables')))
+
+    print(f"Fetching {len(leaderboards)} leaderboards")
+    with ContextThreadPoolExecutor(max_workers=max_workers) as pool:
+        leaderboard_runs = list(pool.map(lambda leaderboard: fetch_leaderboard(game['id'], leaderboard), leaderboards))
 
-        run_list = lb_response.json()['data']['runs']
-        run_list_flattened = []
-        for run in run_list:
-            run_flat = {}
-            run_flat['place'] = run['place']
-            for k, v in run['run'].items():
-                run_flat[k] = v
-            run_list_flattened.append(run_flat)
+    runs = [run for runs in leaderboard_runs for run in runs]
+    if not runs:
+        print("No runs on any leaderboard")
+        return pd.DataFrame()
 
-        leaderboard_df = enrich_runs(run_list_flattened)
+    leaderboard_df = enrich_fetched_runs(runs)
+    leaderboard_df['place'] = [run['place'] for run in runs]
+    print(f"Got {len(leaderboard_df)} runs on {sum(1 for runs in leaderboard_runs if runs)} leaderboards")
 
-        leaderboard_df.to_parquet(path=DATA_PATH / f"PT_leaderboard_{category}_{current_date}.parquet")
+    if save_path:
+        write_leaderboard_snapshot(leaderboard_df, leaderboards_path(save_path, file_prefix), snapshot_date)
+    return leaderboard_df
+
+
+def variable_applies(variable, category_id, level_id):
+    """Whether a variable is on a category's leaderboard for a level (None for full game)"""
+    variable_category = variable.get('category')
+    if isinstance(variable_category, str) and variable_category != category_id:
+        return False
+
+    scope = variable.get('scope') or {}
+    scope_type = scope.get('type', 'global')
+    if scope_type == 'full-game':
+        return level_id is None
+    if scope_type == 'all-levels':
+        return level_id is not None
+    if scope_type == 'single-level':
+        return level_id == scope.get('level')
+    return True
+
+
+def plan_leaderboards(categories, levels, variables):
+    """Every leaderboard on a board, from its metadata (API lists or saved tables), as
+    {"category", "level", "values"} dicts. Full game categories get one leaderboard and per-level
+    categories get one per level (level None is full game). Each of those gets split again into
+    every combination of values of the subcategory variables on it, e.g. one per character."""
+    categories, levels, variables = (
+        pd.DataFrame(table).to_dict('records') if table is not None and len(table) else []
+        for table in (categories, levels, variables))
+    subcategories = [variable for variable in variables if variable.get('is-subcategory') is True]
+
+    leaderboards = []
+    for category in categories:
+        level_ids = [level['id'] for level in levels] if category.get('type') == 'per-level' else [None]
+        for level_id in level_ids:
+            value_choices = [
+                [(variable['id'], value_id) for value_id in variable_values(variable)]
+                for variable in subcategories if variable_applies(variable, category['id'], level_id)]
+            for values in itertools.product(*[choices for choices in value_choices if choices]):
+                leaderboards.append({"category": category['id'], "level": level_id, "values": dict(values)})
+    return leaderboards
+
+
+def leaderboard_url(game_id, leaderboard):
+    if leaderboard["level"] is None:
+        return f"{SRC_API_URL}/leaderboards/{game_id}/category/{leaderboard['category']}"
+    return f"{SRC_API_URL}/leaderboards/{game_id}/level/{leaderboard['level']}/{leaderboard['category']}"
+
+
+def fetch_leaderboard(game_id, leaderboard):
+    """Fetch one leaderboard from plan_leaderboards and return its runs, each with its place.
+
+    The leaderboard endpoint embeds players once for the whole board instead of on each run, so
+    they get put back on the runs the way the runs endpoint embeds them, for enrich_fetched_runs to pick up"""
+    params = {
+        "embed": "players",
+        **{f"var-{variable_id}": value_id for variable_id, value_id in leaderboard["values"].items()}}
+    board = query_api(leaderboard_url(game_id, leaderboard), params)
+
+    players = {player['id']: player for player in board['players']['data'] if player['rel'] == 'user'}
+
+    def embed_player(player):
+        if player['rel'] == 'user':
+            return players[player['id']]
+        return {**player, 'links': [{'rel': 'self', 'uri': player.get('uri')}]}
+
+    return [
+        {**entry['run'], 'players': {'data': [embed_player(player) for player in entry['run']['players']]},
+         'place': entry['place']}
+        for entry in board['runs']]
+
+
+def leaderboards_path(save_path, file_prefix):
+    return save_path / f"{file_prefix}_leaderboards"
+
+
+def write_leaderboard_snapshot(leaderboard_df, dataset_path, snapshot_date):
+    """Save a day's leaderboards into the snapshot dataset at dataset_path, as its
+    snapshot_date=YYYY-MM-DD partition, split up by category under that.
+
+    The day gets written to a temp folder first and swapped in, so taking a snapshot again on the
+    same day replaces that day's snapshot, and the other days are never touched"""
+    day_path = dataset_path / f"snapshot_date={snapshot_date}"
+    tmp_path = dataset_path / f".snapshot_date={snapshot_date}.tmp"
+    if tmp_path.exists():
+        shutil.rmtree(tmp_path)
+
+    table = runs_to_table(leaderboard_df.drop(columns='place'))
+    table = table.append_column('place', pa.array(leaderboard_df['place'], pa.int32()))
+    ds.write_dataset(
+        table,
+        tmp_path,
+        format="parquet",
+        partitioning=ds.partitioning(pa.schema([('category', table.schema.field('category').type)]), flavor="hive"),
+        basename_template="part-{i}.parquet")
+
+    if day_path.exists():
+        shutil.rmtree(day_path)
+    os.replace(tmp_path, day_path)
+
+
+def read_leaderboards(save_path, file_prefix, snapshot_dates=None, columns=None):
+    """Load saved leaderboard snapshots (see get_leaderboards), optionally only for some days. Every
+    run comes with the snapshot_date it was on the leaderboard for"""
+    partitioning = ds.partitioning(
+        pa.schema([('snapshot_date', pa.date32()), ('category', pa.string())]), flavor="hive")
+    dataset = ds.dataset(leaderboards_path(save_path, file_prefix), format="parquet", partitioning=partitioning)
+
+    # Variables can come and go between days, so every day's value_ columns get read
+    schema = pa.unify_schemas(
+        [fragment.physical_schema for fragment in dataset.get_fragments()] + [partitioning.schema],
+        promote_options="permissive")
+    dataset = ds.dataset(
+        leaderboards_path(save_path, file_prefix), format="parquet", partitioning=partitioning, schema=schema)
+
+    snapshot_filter = None
+    if snapshot_dates is not None:
+        snapshot_filter = pc.field('snapshot_date').isin(
+            pa.array([pd.Timestamp(snapshot_date).date() for snapshot_date in snapshot_dates], pa.date32()))
+    return dataset.to_table(columns=columns, filter=snapshot_filter).to_pandas()
 
 
 """Data Loading Functions, separate from enrichment"""
@@ -150,10 +756,15 @@ def load_data(
         api_endpoint,
         enrich_data_fun,
         api_args=None,
-        save_path=None):
-    """Fetch data with the SRC API, then enrich it with the enrich_data function and optionally save it."""
+        save_path=None,
+        concurrent=False,
+        checkpoint=False):
+    """Fetch data with the SRC API, then enrich it with the enrich_data function and optionally save it.
+
+    checkpoint is passed on to query_api, so an interrupted fetch resumes from its last page.
+    Runs go through load_runs instead."""
     
-    api_return = query_api(api_endpoint, api_args)
+    api_return = query_api(api_endpoint, api_args, concurrent=concurrent, checkpoint=checkpoint)
 
     data_df = pd.DataFrame(api_return)
 
@@ -165,3 +776,14 @@ def load_data(
         data_df.to_parquet(path=save_path)
 
     return data_df
+
+
+def load_runs(runs_endpoint, api_args=None, save_path=None, concurrent=False, checkpoint=False):
+    """load_data for runs. The API results go straight into enrich_fetched_runs as a list, without
+    being made into a dataframe first, and get saved in RUN_SCHEMA (see write_runs)."""
+    runs = enrich_fetched_runs(query_api(runs_endpoint, api_args, concurrent=concurrent, checkpoint=checkpoint))
+
+    if save_path:
+        write_runs(runs, save_path)
+
+    return runs
@@ -1,21 +1,49 @@
 """Random useful util functions"""
 
+import contextvars
+import os
 import pickle
+import sqlite3
+import threading
 import time
 import sys
+from concurrent.futures import ThreadPoolExecutor
 
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
 import requests
 from requests.adapters import HTTPAdapter, Retry
 
-from config import DATA_PATH, CHART_PATH, SRC_API_URL
+import http_cache
+import metrics
+from checkpoints import clear_checkpoint, load_checkpoint, load_pages, save_checkpoint
+from config import DATA_PATH, CHART_PATH, CACHE_PATH, SRC_API_URL
 
-# Store user id-to-name mappings in dict, but only load it in when get_user_name is called
+# Store user id-to-name mappings in a sqlite table, so new names can be added without rewriting everything
+USER_DB_PATH = DATA_PATH / "SRC_users.sqlite"
+
+# Where user names used to be pickled, gets imported into the sqlite store the first time it's opened
 USER_PICKLE_PATH = DATA_PATH / "SRC_users.pkl"
-USER_PICKLE = None
+
+# SQLite caps the number of ? parameters in one query, so lookups are done in chunks of this size
+USER_LOOKUP_CHUNK = 500
 
 # Length of time in seconds to sleep after each API call (currently unused but keeping it here for now)
 SLEEP_INTERVAL = 0.0
 
+# SRC asks for at most 100 requests per minute, all requests are throttled to stay under it
+REQUESTS_PER_SECOND = 100 / 60
+
+# Default number of pages to have in flight at once for concurrent fetches
+MAX_WORKERS = 4
+
+# SRC's default page size when max isn't passed
+DEFAULT_PAGE_SIZE = 20
+
+# The v1 API errors out on offsets past this, so no single query can return more results than it
+SRC_MAX_OFFSET = 10000
+
 SHORT_NAME_MAP = {
     "Tutorial": "Tutorial",
     "F1 - John Gutter": "John Gutter",
@@ -58,95 +86,399 @@ def init_folders():
     """Initialize folders for data/pngs in the project"""
     DATA_PATH.mkdir(parents=True, exist_ok=True)
     CHART_PATH.mkdir(parents=True, exist_ok=True)
+    CACHE_PATH.mkdir(parents=True, exist_ok=True)
+
+
+def open_user_db():
+    """Open the user name store, creating it (and importing the old pickle cache, if there is one) on first use"""
+    DATA_PATH.mkdir(parents=True, exist_ok=True)
+    conn = sqlite3.connect(USER_DB_PATH)
+    conn.execute("CREATE TABLE IF NOT EXISTS users (id TEXT PRIMARY KEY, international TEXT, japanese TEXT)")
+
+    if USER_PICKLE_PATH.exists() and conn.execute("SELECT COUNT(*) FROM users").fetchone()[0] == 0:
+        with open(USER_PICKLE_PATH, "rb") as pickle_file:
+            save_users(pickle.load(pickle_file), conn=conn)
+
+    return conn
+
+
+def save_users(users, conn=None):
+    """Write a dict of player ID -> SRC names dict to the user store in a single transaction"""
+    db = conn or open_user_db()
+    try:
+        with db:
+            db.executemany(
+                "INSERT OR REPLACE INTO users (id, international, japanese) VALUES (?, ?, ?)",
+                [(pid, names.get('international'), names.get('japanese')) for pid, names in users.items()])
+    finally:
+        if conn is None:
+            db.close()
+
+
+def fetch_user_names(pid):
+    """Look up a single player on SRC and return their names dict, or None if they don't exist anymore"""
+    try:
+        return query_api(f"{SRC_API_URL}/users/{pid}")["names"]
+    except requests.HTTPError as e:
+        if e.response is not None and e.response.status_code == 404:
+            return None
+        raise
+
+
+def get_user_names(pids, max_workers=MAX_WORKERS):
+    """Resolve a whole batch of src player IDs (eg. a column of runs) to their usernames (english).
+
+    IDs are de-duplicated, anything already in the user store is read from there, and only the
+    misses are looked up on SRC, concurrently, then saved in one go. Returns a dict of ID to name,
+    and IDs that couldn't be resolved (guests, deleted users) are left out."""
+    pid_list = list({pid for pid in pids if isinstance(pid, str)})
+    user_names = {}
+
+    conn = open_user_db()
+    try:
+        for i in range(0, len(pid_list), USER_LOOKUP_CHUNK):
+            chunk = pid_list[i:i + USER_LOOKUP_CHUNK]
+            user_names.update(conn.execute(
+                f"SELECT id, international FROM users WHERE id IN ({', '.join('?' * len(chunk))})",
+                chunk))
+
+        missing = [pid for pid in pid_list if pid not in user_names]
+        if missing:
+            print(f"Fetching {len(missing)} new users")
+            with ContextThreadPoolExecutor(max_workers=max_workers) as executor:
+                fetched = dict(zip(missing, executor.map(fetch_user_names, missing)))
+
+            # Deleted users get saved without names so we don't keep asking SRC about them
+            new_users = {pid: names or {} for pid, names in fetched.items()}
+            save_users(new_users, conn=conn)
+            user_names.update({pid: names.get('international') for pid, names in new_users.items()})
+    finally:
+        conn.close()
+
+    return {pid: name for pid, name in user_names.items() if name is not None}
+
+
+def get_users_table(pids):
+    """Get the user store's rows for a batch of player IDs as a dataframe (no lookups on SRC)"""
+    pid_list = list({pid for pid in pids if isinstance(pid, str)})
+    users = []
+
+    conn = open_user_db()
+    try:
+        for i in range(0, len(pid_list), USER_LOOKUP_CHUNK):
+            chunk = pid_list[i:i + USER_LOOKUP_CHUNK]
+            users += conn.execute(
+                f"SELECT id, international, japanese FROM users WHERE id IN ({', '.join('?' * len(chunk))})",
+                chunk).fetchall()
+    finally:
+        conn.close()
+
+    return pd.DataFrame(users, columns=["id", "international", "japanese"])
 
 
 def get_user_name(pid):
     """Perform a lookup on a src player ID to get their username (english)"""
-    global USER_PICKLE
-    if USER_PICKLE is None:
-        if USER_PICKLE_PATH.exists():
-            with open(USER_PICKLE_PATH, "rb") as pickle_file:
-                USER_PICKLE = pickle.load(pickle_file)
-        else:
-            USER_PICKLE = {}
+    return get_user_names([pid]).get(pid)
 
-    if pid in USER_PICKLE:
-        return USER_PICKLE[pid]['international']
 
-    # Re-save the pickle file every time we grab a new name, this will be pretty expensive at
-    # first but fall off very quickly as we get all the regulars
-    api_return = query_api(f"{SRC_API_URL}/users/{pid}")
+def map_short_name(official_name):
+    """Make a mapping between level names on SRC and the shortened forms I want to use on my charts.
+    Levels that aren't mapped (i.e. every board but Pizza Tower) just keep their SRC name"""
+    return SHORT_NAME_MAP.get(official_name, official_name)
 
-    api_return = api_return["names"]
-    print(f"Fetched new user {api_return['international']}")
-    USER_PICKLE[pid] = api_return
-    with open(USER_PICKLE_PATH, "wb") as pickle_file:
-        pickle.dump(USER_PICKLE, pickle_file)
-    return api_return['international']
 
+class ContextThreadPoolExecutor(ThreadPoolExecutor):
+    """Thread pool that runs tasks in the submitter's context, so request labels (see
+    metrics.request_labels) follow requests into worker threads"""
+
+    def submit(self, fn, /, *args, **kwargs):
+        return super().submit(contextvars.copy_context().run, fn, *args, **kwargs)
+
+
+class RateLimiter:
+    """Thread-safe limiter that spaces calls out to at most requests_per_second"""
+
+    def __init__(self, requests_per_second=None):
+        self.interval = 1.0 / requests_per_second if requests_per_second else 0.0
+        self.next_slot = time.monotonic()
+        self.lock = threading.Lock()
+
+    def wait(self):
+        """Block until the caller is allowed to make another request"""
+        if not self.interval:
+            return
+        with self.lock:
+            now = time.monotonic()
+            slot = max(self.next_slot, now)
+            self.next_slot = slot + self.interval
+        time.sleep(max(0.0, slot - now))
+
+
+# Every request goes through this, so concurrent fetches still stay under SRC's limit together
+API_RATE_LIMITER = RateLimiter(REQUESTS_PER_SECOND)
+
+
+# Shared HTTP client for every SRC API call. Creating one session up front means keep-alive and
+# connection pooling work across pages and calls, instead of paying for a new TLS handshake each time.
+class SRCRetry(Retry):
+    """Retry policy that also honors Retry-After on SRC's nonstandard 420 throttle responses"""
+    RETRY_AFTER_STATUS_CODES = frozenset([413, 420, 429, 503])
+
+    def sleep(self, response=None):
+        # Keep track of backoff time for the request's metrics
+        sleep_start = time.perf_counter()
+        super().sleep(response)
+        metrics.add_retry_sleep(time.perf_counter() - sleep_start)
+
+
+RETRY_STATUS_CODES = [420, 429, 500, 502, 503, 504]
+
+# Hard cap on retries per request, so a throttled or broken endpoint fails instead of stalling forever
+MAX_RETRIES = 8
+
+API_SESSION = None
+API_SESSION_LOCK = threading.Lock()
+
+
+def get_session():
+    """Get the shared SRC API session, creating it the first time it's needed"""
+    global API_SESSION
+    with API_SESSION_LOCK:
+        if API_SESSION is None:
+            retries = SRCRetry(
+                total=MAX_RETRIES,
+                backoff_factor=.5,
+                status_forcelist=RETRY_STATUS_CODES,
+                allowed_methods=["GET"],
+                respect_retry_after_header=True,
+                raise_on_status=False)
+            adapter = HTTPAdapter(
+                pool_connections=4,
+                pool_maxsize=MAX_WORKERS * 4,
+                max_retries=retries)
+
+            session = requests.Session()
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            session.headers.update({
+                "Accept": "application/json",
+                "Accept-Encoding": "gzip, deflate",
+                "User-Agent": "src-stats",
+            })
+            API_SESSION = session
+    return API_SESSION
+
+
+def api_get(url, params=None, limiter=None):
+    """Make a single GET against the SRC API through the shared session and rate limiter, and return the parsed JSON.
+
+    Throttles and server errors are retried (with backoff) by the session itself, so anything that
+    still isn't a 200 here is a real failure and gets raised.
+
+    Endpoints with a TTL in http_cache.CACHE_TTLS are served from the on-disk cache while fresh, and
+    revalidated with ETag/Last-Modified once they're stale. In offline mode, only the cache is used.
+
+    Every request waits on API_RATE_LIMITER, and on limiter too if one is passed.
+
+    Every request (cache hits too) is reported to the hooks in metrics.REQUEST_HOOKS."""
+    ttl = http_cache.cache_ttl(url)
+    entry = http_cache.load_entry(url, params) if ttl is not None or http_cache.is_offline() else None
+    record = metrics.RequestRecord(
+        url=url,
+        endpoint=metrics.endpoint_name(url),
+        status=None,
+        cache=None,
+        started=time.time(),
+        labels=metrics.REQUEST_LABELS.get())
+
+    if http_cache.is_offline():
+        if entry is None:
+            raise http_cache.CacheMiss(f"No cached response for {url} {params or ''}")
+        record.cache = "hit"
+        metrics.emit(record)
+        return entry["body"]
+
+    if entry is not None and http_cache.is_fresh(entry, ttl):
+        record.cache = "hit"
+        metrics.emit(record)
+        return entry["body"]
+
+    # A caller's limiter is an extra cap on top of the global one, never a replacement for it
+    wait_start = time.perf_counter()
+    if limiter is not None:
+        limiter.wait()
+    API_RATE_LIMITER.wait()
+    record.limiter_wait = time.perf_counter() - wait_start
+
+    headers = http_cache.revalidation_headers(entry) if entry is not None else None
+    metrics.reset_retry_sleep()
+    request_start = time.perf_counter()
+    try:
+        response = get_session().get(url, params=params, headers=headers)
+    except Exception as e:
+        record.latency = time.perf_counter() - request_start
+        record.retry_sleep = metrics.retry_sleep()
+        record.error = repr(e)
+        metrics.emit(record)
+        raise
+    record.latency = time.perf_counter() - request_start
+    record.retry_sleep = metrics.retry_sleep()
+    record.status = response.status_code
+    record.bytes = len(response.content)
+    retry_history = getattr(getattr(response.raw, "retries", None), "history", ()) or ()
+    record.retries = len(retry_history)
+    record.throttles = sum(attempt.status in metrics.THROTTLE_STATUS_CODES for attempt in retry_history)
+    time.sleep(SLEEP_INTERVAL)
+
+    if response.status_code == 304 and entry is not None:
+        record.cache = "revalidated"
+        metrics.emit(record)
+        http_cache.touch_entry(url, params, entry)
+        return entry["body"]
+
+    if response.status_code != 200:
+        record.error = f"HTTP {response.status_code}"
+        metrics.emit(record)
+        print(response.text)
+        response.raise_for_status()
+
+    parse_start = time.perf_counter()
+    body = response.json()
+    record.parse_time = time.perf_counter() - parse_start
+    metrics.emit(record)
+
+    if ttl is not None:
+        http_cache.save_entry(url, params, body, response.headers)
+    return body
 
-def map_short_name(official_name):
-    """Make a mapping between level names on SRC and the shortened forms I want to use on my charts"""
-    if official_name not in SHORT_NAME_MAP:
-        raise Exception(f"Level Name Not Mapped: {official_name}")
-    return SHORT_NAME_MAP[official_name]
 
 # Pagination gives you at most 200 results, so you gotta call the API again using
 # the return value's pagination.links.uri for rel = 'next'
 # It ends when the pagination list doesn't have a 'next' value anymore
-def query_api(endpoint, arg_dict=None):
-    """Query the SRC API and return all results for endpoint with the given args. Handles unrolling pagination."""
+def query_api(
+        endpoint,
+        arg_dict=None,
+        stop_fun=None,
+        concurrent=False,
+        max_workers=MAX_WORKERS,
+        requests_per_second=None,
+        stream=False,
+        start_offset=0,
+        checkpoint=False):
+    """Query the SRC API and return all results for endpoint with the given args. Handles unrolling pagination.
+
+    If stop_fun is provided, it's called with each page's list of results, and pagination stops
+    after the first page it returns True for (handy for sorted queries where we only want the newest stuff).
+
+    If concurrent is set, pages after the first are fetched by offset with up to max_workers requests
+    in flight instead of following the next links one at a time. They share the global
+    REQUESTS_PER_SECOND budget, and requests_per_second can cap them lower still.
+
+    If stream is set, nothing gets collected: you get a generator of (offset, results) pages instead,
+    starting from start_offset (see query_pages).
+
+    If checkpoint is set, every page is journaled as it comes in (see checkpoints.py), and running
+    the same query again after it got interrupted picks up from the last page it finished. This
+    pages through serially, concurrent is ignored."""
 
     if SRC_API_URL not in endpoint:
         raise Exception("Not a valid speedrun.com URL!")
 
-    s = requests.Session()
-    retries = Retry(total=10,
-                    backoff_factor=.25,
-                    status_forcelist=[420])
-    s.mount("http://", HTTPAdapter(max_retries=retries))
+    if stream:
+        return query_pages(endpoint, arg_dict, stop_fun=stop_fun, start_offset=start_offset)
+
+    if checkpoint:
+        return query_pages_checkpointed(endpoint, arg_dict, stop_fun=stop_fun)
 
     # SRC results can either be paginated or unpaginated. Handle the first call, and then if
     # it contains a `pagination` key, go into the paginator workflow
-    response = s.get(endpoint, params=arg_dict)
-    time.sleep(SLEEP_INTERVAL)
-    if response.status_code != 200:
-        print(response.text)
-        response.raise_for_status()
+    arg_dict = {**(arg_dict or {}), "offset": start_offset} if start_offset else arg_dict
+    results = api_get(endpoint, params=arg_dict)
+
+    if "pagination" not in results:
+        if isinstance(results['data'], list):
+            print(f"Got {len(results['data'])} results")
+        return results['data']
 
-    if "pagination" not in response.json():
-        if isinstance(response.json()['data'], list):
-            print(f"Got {len(response.json()['data'])} results")
-        return response.json()['data']
+    if concurrent:
+        return query_pages_concurrent(
+            endpoint,
+            arg_dict,
+            results,
+            stop_fun=stop_fun,
+            max_workers=max_workers,
+            requests_per_second=requests_per_second)
 
     # Unroll pagination to return a single list of all results
-    results = response.json()
-    next_url = get_next_uri(results)
     results_list = []
-    while response is not None:
-        if response.status_code != 200:
-            # So far the only error I've seen for valid requests is rate limits, so
-            # sleep and retry when it happens
-            print(response.text)
-            time.sleep(10)
-            results = s.get(next_url) if next_url else None
-            continue
-
-        results = response.json()
-        results_list += results["data"]
+    for _, page in query_pages(endpoint, arg_dict, stop_fun=stop_fun, first_page=results):
+        results_list += page
 
         # Update result counts without printing a billion lines, lol
         sys.stdout.write('\r')
         sys.stdout.write(f"Got {len(results_list)} results")
         sys.stdout.flush()
 
-        next_url = get_next_uri(results["pagination"])
-        response = requests.get(next_url) if next_url else None
+    print("")
 
-        time.sleep(SLEEP_INTERVAL)
+    return results_list
 
-    print("")
 
+def query_pages(endpoint, arg_dict=None, stop_fun=None, start_offset=0, first_page=None):
+    """Walk a query's pages, yielding (offset, results) for each page as soon as it comes in.
+
+    Starts at start_offset, or from first_page if you've already fetched it. Unpaginated endpoints
+    come back as a single page at offset 0. Like query_api, this stops after the first page stop_fun
+    returns True for, and at the SRC_MAX_OFFSET pagination ceiling."""
+    if first_page is None:
+        arg_dict = {**(arg_dict or {}), "offset": start_offset} if start_offset else arg_dict
+        first_page = api_get(endpoint, params=arg_dict)
+
+    if "pagination" not in first_page:
+        yield 0, first_page['data']
+        return
+
+    results = first_page
+    while results is not None:
+        page_info = results["pagination"]
+        yield page_info.get("offset", 0), results["data"]
+
+        if stop_fun and stop_fun(results["data"]):
+            break
+
+        next_url = get_next_uri(page_info)
+
+        # Don't walk off the end of the offset ceiling, just hand back what we could get
+        if next_url and page_info.get("offset", 0) + page_info.get("max", DEFAULT_PAGE_SIZE) >= SRC_MAX_OFFSET:
+            print(f"\nHit the {SRC_MAX_OFFSET} result pagination limit, results are incomplete")
+            break
+
+        results = api_get(next_url) if next_url else None
+
+
+def query_pages_checkpointed(endpoint, arg_dict=None, stop_fun=None):
+    """Page through a query like query_api, journaling each page so an interrupted query resumes
+    from its last good page the next time it's run with the same endpoint and args"""
+    checkpoint = load_checkpoint(endpoint, arg_dict)
+    results_list = load_pages(checkpoint)
+    if checkpoint["pages"]:
+        print(f"Resuming from offset {checkpoint['next_offset']}, {len(results_list)} results already fetched")
+
+    for offset, page in query_pages(endpoint, arg_dict, stop_fun=stop_fun, start_offset=checkpoint["next_offset"]):
+        if not isinstance(page, list):
+            # Unpaginated single results, nothing to resume
+            clear_checkpoint(checkpoint)
+            return page
+
+        results_list += page
+        save_checkpoint(checkpoint, offset, len(page), page)
+
+        sys.stdout.write('\r')
+        sys.stdout.write(f"Got {len(results_list)} results")
+        sys.stdout.flush()
+
+    print("")
+    clear_checkpoint(checkpoint)
     return results_list
 
 
@@ -156,4 +488,75 @@ def get_next_uri(pagination_dict):
         if link['rel'] == 'next':
             return link['uri']
 
-    return None
\ No newline at end of file
+    return None
+
+
+def query_pages_concurrent(
+        endpoint,
+        arg_dict,
+        first_page,
+        stop_fun=None,
+        max_workers=MAX_WORKERS,
+        requests_per_second=None):
+    """Fetch the rest of a paginated query by offset, with up to max_workers pages in flight.
+
+    SRC doesn't tell us how many results there are, so pages are requested in waves of max_workers
+    until one comes back short (or stop_fun says we're done). Pages are stitched back together in
+    offset order, and results are de-duplicated on id in case runs shifted between pages mid-fetch."""
+    arg_dict = dict(arg_dict or {})
+    page_size = first_page["pagination"].get("max") or arg_dict.get("max") or DEFAULT_PAGE_SIZE
+    start_offset = first_page["pagination"].get("offset") or arg_dict.get("offset") or 0
+    limiter = RateLimiter(requests_per_second) if requests_per_second else None
+
+    def fetch_page(offset):
+        return api_get(endpoint, params={**arg_dict, "offset": offset, "max": page_size}, limiter=limiter)["data"]
+
+    pages = [first_page["data"]]
+    done = len(first_page["data"]) < page_size or (stop_fun and stop_fun(first_page["data"]))
+    next_offset = start_offset + page_size
+
+    with ContextThreadPoolExecutor(max_workers=max_workers) as executor:
+        while not done:
+            offsets = [
+                next_offset + i * page_size for i in range(max_workers)
+                if next_offset + i * page_size < SRC_MAX_OFFSET]
+            if not offsets:
+                print(f"\nHit the {SRC_MAX_OFFSET} result pagination limit, results are incomplete")
+                break
+            next_offset = offsets[-1] + page_size
+
+            # map hands pages back in offset order, so anything after a short page can be dropped
+            for page in executor.map(fetch_page, offsets):
+                pages.append(page)
+                if len(page) < page_size or (stop_fun and stop_fun(page)):
+                    done = True
+                    break
+
+            sys.stdout.write('\r')
+            sys.stdout.write(f"Got {sum(len(page) for page in pages)} results")
+            sys.stdout.flush()
+
+    print("")
+
+    results_list = []
+    seen_ids = set()
+    for page in pages:
+        for result in page:
+            result_id = result.get("id") if isinstance(result, dict) else None
+            if result_id is not None:
+                if result_id in seen_ids:
+                    continue
+                seen_ids.add(result_id)
+            results_list.append(result)
+
+    return results_list
+
+
+def write_parquet_atomic(data, path):
+    """Write a dataframe (or Arrow table) to parquet through a temp file so a crash mid-write never leaves a half-written file"""
+    tmp_path = path.with_name(f".{path.name}.tmp")
+    if isinstance(data, pa.Table):
+        pq.write_table(data, tmp_path)
+    else:
+        data.to_parquet(path=tmp_path)
+    os.replace(tmp_path, path)